@@ -0,0 +1,114 @@
+"""
+Compare StockHandler's batched update of a market message against updating
+it line by line, over a corpus of market messages.
+
+Run with: python -m benchmark.batch_update
+"""
+
+import random
+
+from time import perf_counter
+from typing import List, Tuple
+
+from config.model import DockConfig, StockConfig
+from eddn.commodity_v3.model import Commodity, CommodityV3, Header, Message
+from summary.dock_handler.journal_v1 import DockHandler, dock_key
+from summary.model import DockSummary, Station, StockSummary
+from summary.schema import StockSummarySchema
+from summary.stock_handler.commodity_v3 import StockHandler
+
+STATIONS = 2000
+MESSAGES = 10000
+COMMODITIES = [f"Commodity {i}" for i in range(120)]
+
+
+def make_docks() -> DockSummary:
+    rand = random.Random(0)
+    summary = DockSummary()
+    for station in range(STATIONS):
+        system = f"System {station // 3}"
+        summary.stations[dock_key(system, f"Station {station}")] = Station(
+            market_id=3200000000 + station,
+            star_pos=[rand.uniform(-200, 200) for _ in range(3)],
+            station_name=f"Station {station}",
+            station_type="Coriolis",
+            system_address=station // 3,
+            system_name=system,
+            timestamp="2023-01-01T00:00:00+00:00",
+            dist_from_star_ls=rand.uniform(10, 1000),
+        )
+    return summary
+
+
+def make_messages() -> List[CommodityV3]:
+    rand = random.Random(1)
+    header = Header("uploader", "benchmark", "1", "2023-01-01T00:00:00Z")
+    messages = []
+    for count in range(MESSAGES):
+        station = rand.randrange(STATIONS)
+        lines = [
+            Commodity(
+                name=name,
+                mean_price=1000,
+                buy_price=rand.choice([0, rand.randint(100, 5000)]),
+                stock=rand.randint(0, 5000),
+                stock_bracket="",
+                sell_price=rand.randint(0, 6000),
+                demand=rand.randint(0, 5000),
+                demand_bracket="",
+            )
+            for name in COMMODITIES
+        ]
+        message = Message(
+            system_name=f"System {station // 3}",
+            station_name=f"Station {station}",
+            market_id=3200000000 + station,
+            timestamp=f"2023-01-01T{count // 3600 % 24:02d}:{count // 60 % 60:02d}:{count % 60:02d}Z",
+            commodities=lines,
+        )
+        messages.append(CommodityV3(header=header, message=message))
+    return messages
+
+
+def run(batch_update: bool, messages: List[CommodityV3]) -> Tuple[float, dict]:
+    config = StockConfig(
+        file_path="",
+        max_best=5,
+        min_stock=500,
+        min_demand=1,
+        acceptable_station_types=["Coriolis"],
+        origin_coords=[0.0, 0.0, 0.0],
+        max_from_origin=1000.0,
+        max_from_sun=5000.0,
+        batch_update=batch_update,
+    )
+    dock_handler = DockHandler(config=DockConfig(file_path=""), target=make_docks())
+    summary = StockSummary()
+    handler = StockHandler(config=config, target=summary, dock_handler=dock_handler)
+
+    started = perf_counter()
+    for commodity_v3 in messages:
+        handler.update(commodity_v3)
+        handler.pop_changes()
+    return perf_counter() - started, StockSummarySchema().dump(summary)
+
+
+def main() -> None:
+    messages = make_messages()
+    line_seconds, line_result = run(batch_update=False, messages=messages)
+    batch_seconds, batch_result = run(batch_update=True, messages=messages)
+    if line_result != batch_result:
+        raise AssertionError("Batched and line by line updates differ")
+
+    lines = MESSAGES * len(COMMODITIES)
+    print(f"{MESSAGES} messages of {len(COMMODITIES)} commodities")
+    print(f"{'':>13} {'us/message':>11} {'ns/line':>8}")
+    for name, seconds in (("line by line", line_seconds), ("batched", batch_seconds)):
+        print(
+            f"{name:>13} {seconds / MESSAGES * 1e6:>11.1f} {seconds / lines * 1e9:>8.0f}"
+        )
+    print(f"speed up: {line_seconds / batch_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compare MarketBook against the original list scanning best-sales insert.
+
+Run with: python -m benchmark.market_book
+"""
+
+import random
+
+from timeit import timeit
+from typing import List
+
+from summary.model import CostSnapshot
+from summary.stock_handler.market_book import MarketBook
+
+UPDATES = 20000
+
+
+def legacy_insert_sell(
+    best_sales: List[CostSnapshot], cost_snapshot: CostSnapshot, max_best: int
+) -> List[CostSnapshot]:
+    """The StockHandler._insert_sell algorithm the book replaced"""
+    for i in range(len(best_sales) - 1, -1, -1):
+        sale = best_sales[i]
+        if (
+            sale.system_name == cost_snapshot.system_name
+            and sale.station_name == cost_snapshot.station_name
+        ):
+            best_sales.pop(i)
+
+    i = 0
+    while i < len(best_sales):
+        if cost_snapshot.sell_price > best_sales[i].sell_price:
+            break
+        i += 1
+    best_sales.insert(i, cost_snapshot)
+    return best_sales[:max_best]
+
+
+def make_updates(stations: int, count: int) -> List[CostSnapshot]:
+    rand = random.Random(stations)
+    return [
+        CostSnapshot(
+            system_name=f"System {station % 1000}",
+            station_name=f"Station {station}",
+            timestamp="2023-01-01T00:00:00Z",
+            buy_price=0,
+            stock=0,
+            sell_price=rand.randint(1, 10000),
+            demand=1000,
+        )
+        for station in (rand.randrange(stations) for _ in range(count))
+    ]
+
+
+def main() -> None:
+    print(f"{'N':>6} {'legacy us/op':>14} {'book us/op':>12} {'speed up':>9}")
+    for max_best in (5, 100, 1000):
+        # Enough stations that the book stays full and most updates compete
+        updates = make_updates(stations=max_best * 4, count=UPDATES)
+
+        def run_legacy():
+            best_sales = []
+            for cost_snapshot in updates:
+                best_sales = legacy_insert_sell(best_sales, cost_snapshot, max_best)
+            return best_sales
+
+        def run_book():
+            book = MarketBook(
+                entries=[],
+                price=lambda cost_snapshot: cost_snapshot.sell_price,
+                descending=True,
+                max_size=max_best,
+            )
+            for cost_snapshot in updates:
+                book.upsert(cost_snapshot)
+            return book.entries
+
+        if run_legacy() != run_book():
+            raise AssertionError(f"Results differ at N={max_best}")
+
+        legacy = timeit(run_legacy, number=1) / UPDATES * 1e6
+        book = timeit(run_book, number=1) / UPDATES * 1e6
+        print(f"{max_best:>6} {legacy:>14.2f} {book:>12.2f} {legacy / book:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
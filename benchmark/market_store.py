@@ -0,0 +1,120 @@
+"""
+Time updating the market store, and measure its memory, with 5,000 and
+20,000 markets, with and without the all-pairs profit matrix.
+
+Run with: python -m benchmark.market_store
+
+Each market reports once to fill the store, then random markets report
+again. Only the reports after filling are timed, so each one updates a row and
+column of the full sized matrix.
+"""
+
+import random
+
+from time import perf_counter
+from typing import List
+
+from benchmark.pipeline import peak_rss_mb
+from config.model import MarketStoreConfig, StockConfig
+from eddn.commodity_v3.model import Commodity, Message
+from summary.model import Station
+from summary.stock_handler.market_store import MarketStore
+
+MARKETS = [5000, 20000]
+UPDATES = 1000
+COMMODITIES = [f"Commodity {i}" for i in range(400)]
+# Markets list a selection of all the commodities there are
+LISTED = 120
+
+
+def make_message(rand: random.Random, market: int) -> Message:
+    return Message(
+        system_name=f"System {market // 3}",
+        station_name=f"Station {market}",
+        market_id=3200000000 + market,
+        timestamp="2023-01-01T00:00:00Z",
+        commodities=[
+            Commodity(
+                name=name,
+                mean_price=1000,
+                buy_price=rand.choice([0, rand.randint(100, 5000)]),
+                stock=rand.randint(0, 5000),
+                stock_bracket="",
+                sell_price=rand.randint(0, 6000),
+                demand=rand.randint(0, 5000),
+                demand_bracket="",
+            )
+            for name in rand.sample(COMMODITIES, LISTED)
+        ],
+    )
+
+
+def make_station(market: int) -> Station:
+    return Station(
+        market_id=3200000000 + market,
+        star_pos=[0.0, 0.0, 0.0],
+        station_name=f"Station {market}",
+        station_type="Coriolis",
+        system_address=market // 3,
+        system_name=f"System {market // 3}",
+        timestamp="2023-01-01T00:00:00+00:00",
+    )
+
+
+def run(markets: int, profit_matrix: bool) -> None:
+    stock_config = StockConfig(
+        file_path="",
+        max_best=5,
+        min_stock=500,
+        min_demand=1,
+        acceptable_station_types=["Coriolis"],
+        origin_coords=[0.0, 0.0, 0.0],
+        max_from_origin=1000.0,
+        max_from_sun=5000.0,
+    )
+    store = MarketStore(
+        MarketStoreConfig(
+            enabled=True, profit_matrix=profit_matrix, initial_markets=markets
+        ),
+        stock_config,
+    )
+    rand = random.Random(0)
+    stations = [make_station(market) for market in range(markets)]
+
+    started = perf_counter()
+    for market in range(markets):
+        store.update(make_message(rand, market), stations[market])
+    fill_seconds = perf_counter() - started
+
+    messages = [make_message(rand, rand.randrange(markets)) for _ in range(UPDATES)]
+    latencies: List[float] = []
+    for message in messages:
+        started = perf_counter()
+        store.update(message, stations[message.market_id - 3200000000])
+        latencies.append(perf_counter() - started)
+    latencies.sort()
+
+    rss = peak_rss_mb()
+    print(
+        f"{markets:>8} {'yes' if profit_matrix else 'no':>7}"
+        f" {store.nbytes() / 2**20:>9.0f}"
+        f" {'-' if rss is None else f'{rss:.0f}':>8}"
+        f" {fill_seconds:>7.1f}"
+        f" {latencies[len(latencies) // 2] * 1000:>8.2f}"
+        f" {latencies[round(0.99 * (len(latencies) - 1))] * 1000:>8.2f}"
+    )
+
+
+def main() -> None:
+    print(f"{len(COMMODITIES)} commodities, {LISTED} listed by each market")
+    print(
+        f"{'markets':>8} {'matrix':>7} {'store MB':>9} {'RSS MB':>8}"
+        f" {'fill s':>7} {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    for markets in MARKETS:
+        for profit_matrix in (False, True):
+            run(markets, profit_matrix)
+
+
+if __name__ == "__main__":
+    main()
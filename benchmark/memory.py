@@ -0,0 +1,125 @@
+"""
+Compare the memory taken by the compact Station and CostSnapshot against the
+plain dataclasses they replaced, for docks and stocks loaded from JSON.
+
+Run with: python -m benchmark.memory
+"""
+
+import gc
+import json
+import random
+import tracemalloc
+
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Tuple
+
+from summary.model import CostSnapshot, Station
+
+STATIONS = 20000
+SNAPSHOTS_PER_STATION = 10
+
+
+@dataclass
+class LegacyStation:
+    market_id: int
+    star_pos: List[float]
+    station_name: str
+    station_type: str
+    system_address: int
+    system_name: str
+    timestamp: str
+    dist_from_star_ls: Optional[float] = None
+    station_allegiance: Optional[str] = None
+
+
+@dataclass
+class LegacyCostSnapshot:
+    system_name: str
+    station_name: str
+    timestamp: str
+    buy_price: int
+    stock: int
+    sell_price: int
+    demand: int
+    market_id: Optional[int] = None
+    star_pos: Optional[List[float]] = None
+    station_type: Optional[str] = None
+    system_address: Optional[int] = None
+    dist_from_star_ls: Optional[float] = None
+    station_allegiance: Optional[str] = None
+    _datetime: Optional[Any] = None
+
+
+def make_json() -> Tuple[str, str]:
+    """Dock and stock records as the JSON files hold them"""
+    rand = random.Random(0)
+    stations, snapshots = [], []
+    for station in range(STATIONS):
+        details = {
+            "market_id": 3200000000 + station,
+            "star_pos": [rand.uniform(-1000, 1000) for _ in range(3)],
+            "station_name": f"Station {station}",
+            "station_type": rand.choice(["Coriolis", "Orbis", "Outpost"]),
+            "system_address": station // 3,
+            "system_name": f"System {station // 3}",
+            "dist_from_star_ls": rand.uniform(10, 5000),
+            "station_allegiance": rand.choice([None, "Empire", "Federation"]),
+        }
+        stations.append(dict(details, timestamp="2023-01-01T00:00:00+00:00"))
+        for _ in range(SNAPSHOTS_PER_STATION):
+            snapshots.append(
+                dict(
+                    details,
+                    timestamp="2023-01-01T00:00:00Z",
+                    buy_price=rand.randint(0, 10000),
+                    stock=rand.randint(0, 10000),
+                    sell_price=rand.randint(0, 10000),
+                    demand=rand.randint(0, 10000),
+                )
+            )
+    return json.dumps(stations), json.dumps(snapshots)
+
+
+def measure(build: Callable[[], Any]) -> Tuple[Any, int]:
+    """What `build` returns, and the bytes still allocated for it afterwards"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return built, size
+
+
+def main() -> None:
+    stations_json, snapshots_json = make_json()
+    snapshots = STATIONS * SNAPSHOTS_PER_STATION
+
+    legacy_stations, legacy_station_bytes = measure(
+        lambda: [LegacyStation(**record) for record in json.loads(stations_json)]
+    )
+    legacy_snapshots, legacy_snapshot_bytes = measure(
+        lambda: [LegacyCostSnapshot(**record) for record in json.loads(snapshots_json)]
+    )
+    # Snapshots are loaded after the docks, so share the stations' details
+    compact_stations, compact_station_bytes = measure(
+        lambda: [Station(**record) for record in json.loads(stations_json)]
+    )
+    compact_snapshots, compact_snapshot_bytes = measure(
+        lambda: [CostSnapshot(**record) for record in json.loads(snapshots_json)]
+    )
+
+    print(f"{'':>10} {'legacy B':>9} {'compact B':>10} {'saving':>7}")
+    for name, legacy, compact, count in (
+        ("station", legacy_station_bytes, compact_station_bytes, STATIONS),
+        ("snapshot", legacy_snapshot_bytes, compact_snapshot_bytes, snapshots),
+    ):
+        print(
+            f"{name:>10} {legacy / count:>9.0f} {compact / count:>10.0f}"
+            f" {1 - compact / legacy:>6.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Time each stage of handling EDDN messages, from the raw frame to the saved
+and printed summaries, over a recording made with `slurper.py --record`.
+Without a recording, one is made up of synthetic dock and market messages.
+
+Run with: python -m benchmark.pipeline [--replay recording] [--config file]
+
+Each stage is run over every message before the next stage starts, and
+reports its rate, per-message latency and how far it raised the peak RSS of
+the process. As the peak only rises, a stage using less memory than one
+before it shows no growth. The whole pipeline is then timed end to end
+through a replay.
+"""
+
+import json
+import os
+import random
+import tempfile
+import zlib
+
+from dataclasses import replace
+from time import perf_counter
+from typing import Callable, Iterable, List, Optional
+
+from config import args, config
+from config.model import AutosaveConfig
+from eddn.commodity_v3.model import CommodityV3
+from eddn.connection.recording import FrameRecorder, read_frames
+from eddn.connection.replay import FrameReplayer
+from eddn.decoder import COMMODITY_V3_SCHEMA, JOURNAL_V1_SCHEMA, DecodedMessage
+from slurper import Slurper
+from summary.save_scheduler import SaveScheduler
+from summary.store import create_store
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+STATIONS = 2000
+MARKET_MESSAGES = 3000
+COMMODITIES = [f"Commodity {i}" for i in range(120)]
+RENDERS = 100
+
+
+def make_recording(path: str) -> None:
+    rand = random.Random(0)
+    header = {
+        "uploaderID": "benchmark",
+        "softwareName": "benchmark",
+        "softwareVersion": "1",
+        "gatewayTimestamp": "2023-01-01T00:00:00.000000Z",
+    }
+    with FrameRecorder(path) as recorder:
+        received = 1672531200.0
+        for station in range(STATIONS):
+            message = {
+                "event": "Docked",
+                "StarPos": [rand.uniform(-200, 200) for _ in range(3)],
+                "StarSystem": f"System {station // 3}",
+                "SystemAddress": station // 3,
+                "timestamp": "2023-01-01T00:00:00Z",
+                "DistFromStarLS": rand.uniform(10, 3000),
+                "MarketID": 3200000000 + station,
+                "StationName": f"Station {station}",
+                "StationType": rand.choice(["Coriolis", "Orbis", "Outpost"]),
+            }
+            frame = {
+                "$schemaRef": JOURNAL_V1_SCHEMA,
+                "header": header,
+                "message": message,
+            }
+            received += rand.expovariate(20)
+            recorder.write(zlib.compress(json.dumps(frame).encode()), received)
+
+        for count in range(MARKET_MESSAGES):
+            station = rand.randrange(STATIONS)
+            message = {
+                "systemName": f"System {station // 3}",
+                "stationName": f"Station {station}",
+                "marketId": 3200000000 + station,
+                "timestamp": f"2023-01-01T{count // 3600 % 24:02d}:{count // 60 % 60:02d}:{count % 60:02d}Z",
+                "commodities": [
+                    {
+                        "name": name,
+                        "meanPrice": 1000,
+                        "buyPrice": rand.choice([0, rand.randint(100, 5000)]),
+                        "stock": rand.randint(0, 5000),
+                        "stockBracket": "",
+                        "sellPrice": rand.randint(0, 6000),
+                        "demand": rand.randint(0, 5000),
+                        "demandBracket": "",
+                    }
+                    for name in COMMODITIES
+                ],
+            }
+            frame = {
+                "$schemaRef": COMMODITY_V3_SCHEMA,
+                "header": header,
+                "message": message,
+            }
+            received += rand.expovariate(20)
+            recorder.write(zlib.compress(json.dumps(frame).encode()), received)
+
+
+def make_slurper(folder: str) -> Slurper:
+    """A slurper saving into `folder`, that only saves and prints when told"""
+    storage = config.storage and replace(
+        config.storage, sqlite_file=os.path.join(folder, "slurps.db")
+    )
+    store = create_store(
+        replace(
+            config,
+            dock=replace(config.dock, file_path=os.path.join(folder, "docks")),
+            stock=replace(config.stock, file_path=os.path.join(folder, "stocks")),
+            storage=storage,
+        )
+    )
+    slurper = Slurper(
+        journal_summary=store.load_docks(),
+        commodity_summary=store.load_stocks(),
+        print_wait=10**9,
+        store=store,
+    )
+    slurper.save_scheduler = SaveScheduler(
+        AutosaveConfig(min_interval=float("inf"), max_interval=float("inf"))
+    )
+    return slurper
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[round(fraction * (len(sorted_values) - 1))]
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    # Linux reports kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report(name: str, latencies: List[float], peak_before: Optional[float]) -> None:
+    latencies.sort()
+    total = sum(latencies)
+    peak = peak_rss_mb()
+    rss = None if peak is None else peak - peak_before
+    print(
+        f"{name:>13} {len(latencies):>7}"
+        f" {len(latencies) / total if total else 0:>10.0f}"
+        f" {percentile(latencies, 0.5) * 1e6:>9.1f}"
+        f" {percentile(latencies, 0.99) * 1e6:>9.1f}"
+        f" {'-' if rss is None else f'{rss:.0f}':>8}"
+    )
+
+
+def run_stage(name: str, items: Iterable, stage: Callable) -> list:
+    """Run `stage` on each item, reporting the timings and returning the results"""
+    results, latencies = [], []
+    peak_before = peak_rss_mb()
+    for item in items:
+        started = perf_counter()
+        results.append(stage(item))
+        latencies.append(perf_counter() - started)
+    report(name, latencies, peak_before)
+    return results
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as folder:
+        recording = args.replay
+        if not recording:
+            recording = os.path.join(folder, "synthetic.eddn")
+            make_recording(recording)
+        frames = [frame for _, frame in read_frames(recording)]
+
+        print(f"{len(frames)} frames from {recording}")
+        print(
+            f"{'stage':>13} {'count':>7} {'per sec':>10} {'p50 us':>9}"
+            f" {'p99 us':>9} {'+peak MB':>8}"
+        )
+        os.mkdir(os.path.join(folder, "stages"))
+        slurper = make_slurper(os.path.join(folder, "stages"))
+
+        messages = run_stage("decompress", frames, zlib.decompress)
+
+        def parse(message: bytes):
+            schema_name, event, wanted = slurper.peek_filter.check(message)
+            if not wanted:
+                return DecodedMessage(schema_name=schema_name, event=event)
+            return slurper.parse_eddn_json(message)
+
+        parsed = run_stage("parse", messages, parse)
+        decoded = [item for item in parsed if isinstance(item, DecodedMessage)]
+        decoded += run_stage(
+            "validate",
+            [item for item in parsed if not isinstance(item, DecodedMessage)],
+            slurper.validate_eddn_json,
+        )
+        run_stage(
+            "dock update",
+            [item for item in decoded if not isinstance(item.model, CommodityV3)],
+            slurper.apply_eddn_message,
+        )
+        run_stage(
+            "stock update",
+            [item for item in decoded if isinstance(item.model, CommodityV3)],
+            slurper.apply_eddn_message,
+        )
+
+        def save(_) -> None:
+            slurper.store.save_docks(slurper.dock_handler.journal)
+            slurper.store.save_stocks(slurper.stock_handler.stock_summary)
+            # Wait for any saves made in the background
+            slurper.store.close()
+
+        run_stage("save", [None], save)
+        run_stage(
+            "render", range(RENDERS), lambda _: slurper.get_highest_trade_diffs_str()
+        )
+
+        os.mkdir(os.path.join(folder, "replay"))
+        slurper = make_slurper(os.path.join(folder, "replay"))
+        latencies = []
+        peak_before = peak_rss_mb()
+
+        def handle(frame: bytes) -> None:
+            started = perf_counter()
+            slurper.handle_eddn_message(frame)
+            latencies.append(perf_counter() - started)
+
+        FrameReplayer(recording, handle, speed=args.replay_speed).start()
+        slurper.store.close()
+        report("end to end", latencies, peak_before)
+
+
+if __name__ == "__main__":
+    main()
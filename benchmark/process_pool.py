@@ -0,0 +1,95 @@
+"""
+Compare handling messages in-process with decoding them in a pool of 1, 2, 4
+and 8 worker processes, as many of those as there are CPUs for, over a
+recording or a synthetic one as made by `benchmark.pipeline`.
+
+Run with: python -m benchmark.process_pool [--replay recording] [--config file]
+
+The decoder set in the config is used, so the pool has the most to gain with
+the default "strict" decoder. Each run starts from empty docks and stocks,
+and must end with the same stocks as the in-process run.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+from dataclasses import replace
+from time import perf_counter
+
+from benchmark.pipeline import make_recording, make_slurper
+from config import args, config
+from eddn.compact import to_record
+from eddn.connection.recording import read_frames
+from pipeline.bounded_queue import BLOCK
+from pipeline.process_pool import ProcessPoolPipeline
+from slurper import FAST_DECODER, Slurper
+from summary.schema import StockSummarySchema
+
+WORKERS = [1, 2, 4, 8]
+
+
+def stocks_digest(slurper: Slurper) -> str:
+    stocks = StockSummarySchema().dump(slurper.stock_handler.stock_summary)
+    return hashlib.md5(
+        json.dumps(stocks, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def main() -> None:
+    print(f"{os.cpu_count()} cores, {config.decoder} decoder")
+    with tempfile.TemporaryDirectory() as folder:
+        recording = args.replay
+        if not recording:
+            recording = os.path.join(folder, "synthetic.eddn")
+            make_recording(recording)
+        frames = [frame for _, frame in read_frames(recording)]
+
+        run_folder = os.path.join(folder, "in_process")
+        os.mkdir(run_folder)
+        slurper = make_slurper(run_folder)
+
+        decoded = [slurper.decode_eddn_message(frame) for frame in frames]
+        model_bytes = sum(len(pickle.dumps(message)) for message in decoded)
+        record_bytes = sum(len(pickle.dumps(to_record(message))) for message in decoded)
+        print(
+            f"Pickled per message: {model_bytes / len(frames):.0f} bytes as models,"
+            f" {record_bytes / len(frames):.0f} bytes as compact records"
+        )
+
+        started = perf_counter()
+        for frame in frames:
+            slurper.handle_eddn_message(frame)
+        baseline = perf_counter() - started
+        expected = stocks_digest(slurper)
+        print(f"{'in process':>10}: {len(frames) / baseline:8.0f} msgs/sec")
+
+        ingest = replace(config.ingest, overflow_policy=BLOCK, queue_size=1000)
+        for workers in [count for count in WORKERS if count <= (os.cpu_count() or 1)]:
+            run_folder = os.path.join(folder, f"workers_{workers}")
+            os.mkdir(run_folder)
+            slurper = make_slurper(run_folder)
+            pipeline = ProcessPoolPipeline(
+                config=replace(ingest, decode_processes=workers),
+                fast=config.decoder == FAST_DECODER,
+                apply=slurper.apply_eddn_message,
+            )
+            pipeline.start()
+
+            started = perf_counter()
+            for frame in frames:
+                pipeline.put(frame)
+            pipeline.stop()
+            seconds = perf_counter() - started
+
+            same = stocks_digest(slurper) == expected
+            print(
+                f"{workers:>2} workers : {len(frames) / seconds:8.0f} msgs/sec"
+                f" ({baseline / seconds:.2f}x){'' if same else ' STOCKS DIFFER'}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Time the route engine over a bubble sized set of synthetic stations and
+market messages: building the graph, keeping it up to date as prices change,
+and answering route queries of different lengths.
+
+Run with: python -m benchmark.routes
+"""
+
+import random
+
+from time import perf_counter
+from typing import Callable, List
+
+from config.model import DockConfig, RouteConfig, StockConfig
+from eddn.commodity_v3.model import Commodity, CommodityV3, Header, Message
+from summary.dock_handler.journal_v1 import DockHandler, dock_key
+from summary.model import DockSummary, Station, StockSummary
+from summary.route_engine import RouteEngine
+from summary.stock_handler.commodity_v3 import StockHandler
+
+STATIONS = 20000
+COMMODITIES = [f"Commodity {i}" for i in range(120)]
+# Deep enough books that most stations have a price somewhere in them
+MAX_BEST = 50
+# Messages after the graph is built, each followed by a refresh
+UPDATES = 500
+QUERIES = 50
+JUMP_RANGE = 40.0
+CAPACITY = 720
+
+
+def make_docks() -> DockSummary:
+    rand = random.Random(0)
+    summary = DockSummary()
+    for station in range(STATIONS):
+        system = f"System {station // 3}"
+        summary.stations[dock_key(system, f"Station {station}")] = Station(
+            market_id=3200000000 + station,
+            star_pos=[rand.uniform(-200, 200) for _ in range(3)],
+            station_name=f"Station {station}",
+            station_type="Coriolis",
+            system_address=station // 3,
+            system_name=system,
+            timestamp="2023-01-01T00:00:00+00:00",
+            dist_from_star_ls=rand.uniform(10, 1000),
+        )
+    return summary
+
+
+def make_message(rand: random.Random, count: int) -> CommodityV3:
+    station = rand.randrange(STATIONS)
+    lines = [
+        Commodity(
+            name=name,
+            mean_price=1000,
+            buy_price=rand.choice([0, rand.randint(100, 5000)]),
+            stock=rand.randint(0, 5000),
+            stock_bracket="",
+            sell_price=rand.randint(0, 6000),
+            demand=rand.randint(0, 5000),
+            demand_bracket="",
+        )
+        for name in COMMODITIES
+    ]
+    message = Message(
+        system_name=f"System {station // 3}",
+        station_name=f"Station {station}",
+        market_id=3200000000 + station,
+        timestamp=f"2023-01-01T{count // 3600 % 24:02d}:{count // 60 % 60:02d}:{count % 60:02d}Z",
+        commodities=lines,
+    )
+    return CommodityV3(
+        header=Header("uploader", "benchmark", "1", "2023-01-01T00:00:00Z"),
+        message=message,
+    )
+
+
+def time_ms(call: Callable[[], object]) -> float:
+    started = perf_counter()
+    call()
+    return (perf_counter() - started) * 1000
+
+
+def report(name: str, latencies: List[float]) -> None:
+    latencies.sort()
+    print(
+        f"{name:>16} {latencies[len(latencies) // 2]:>9.2f}"
+        f" {latencies[round(0.99 * (len(latencies) - 1))]:>9.2f}"
+        f" {latencies[-1]:>9.2f}"
+    )
+
+
+def main() -> None:
+    config = StockConfig(
+        file_path="",
+        max_best=MAX_BEST,
+        min_stock=500,
+        min_demand=1,
+        acceptable_station_types=["Coriolis"],
+        origin_coords=[0.0, 0.0, 0.0],
+        max_from_origin=1000.0,
+        max_from_sun=5000.0,
+    )
+    dock_handler = DockHandler(config=DockConfig(file_path=""), target=make_docks())
+    handler = StockHandler(
+        config=config, target=StockSummary(), dock_handler=dock_handler
+    )
+    engine = RouteEngine(RouteConfig(), handler)
+
+    rand = random.Random(1)
+    count = 0
+    for _ in range(STATIONS):
+        handler.update(make_message(rand, count))
+        count += 1
+
+    print(f"{STATIONS} stations, {len(COMMODITIES)} commodities, {MAX_BEST} deep")
+    print(f"graph built in {time_ms(engine.refresh):.0f} ms, {len(engine)} edges")
+
+    systems = [f"System {rand.randrange(STATIONS // 3)}" for _ in range(QUERIES)]
+    print(f"{'ms':>16} {'p50':>9} {'p99':>9} {'max':>9}")
+    refreshes = []
+    for _ in range(UPDATES):
+        handler.update(make_message(rand, count))
+        count += 1
+        refreshes.append(time_ms(engine.refresh))
+    report("refresh/message", refreshes)
+
+    for hops, loop in ((1, False), (2, False), (3, False), (4, False), (2, True)):
+        latencies = [
+            time_ms(
+                lambda: engine.routes(system, JUMP_RANGE, CAPACITY, hops, loop=loop)
+            )
+            for system in systems
+        ]
+        report(f"{hops} hop {'loop' if loop else 'chain'}", latencies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compare how long the slurper takes to load its docks and look up a station,
+as it does for the first market message, with JSON and binary dock files.
+
+Run with: python -m benchmark.startup
+"""
+
+import os
+import random
+import tempfile
+
+from time import perf_counter
+from typing import Callable
+
+from summary.dock_handler import binary_storage, storage
+from summary.model import DockSummary, Station
+
+SIZES = (10000, 100000, 1000000)
+
+# Writing and reading a million stations through the schemas takes minutes
+JSON_LIMIT = 100000
+
+
+def make_docks(stations: int) -> DockSummary:
+    rand = random.Random(stations)
+    summary = DockSummary()
+    for station in range(stations):
+        system = f"System {station // 3}"
+        summary.stations[f"{system}/Station {station}"] = Station(
+            market_id=3200000000 + station,
+            star_pos=[rand.uniform(-1000, 1000) for _ in range(3)],
+            station_name=f"Station {station}",
+            station_type=rand.choice(["Coriolis", "Orbis", "Outpost", "Ocellus"]),
+            system_address=station // 3,
+            system_name=system,
+            timestamp="2023-01-01T00:00:00+00:00",
+            dist_from_star_ls=rand.uniform(10, 5000),
+            station_allegiance=rand.choice([None, "Empire", "Federation"]),
+        )
+    return summary
+
+
+def time_to_first_lookup(load: Callable[[], DockSummary], key: str) -> float:
+    started = perf_counter()
+    summary = load()
+    if summary.stations.get(key) is None:
+        raise AssertionError(f"{key} missing after load")
+    return perf_counter() - started
+
+
+def main() -> None:
+    print(
+        f"{'stations':>9} {'json s':>8} {'binary s':>9} {'lazy s':>8}"
+        f" {'json MB':>8} {'binary MB':>10}"
+    )
+    with tempfile.TemporaryDirectory() as folder:
+        json_file = os.path.join(folder, "dockfile.json")
+        binary_file = os.path.join(folder, "dockfile.bin")
+        for size in SIZES:
+            summary = make_docks(size)
+            key = random.Random(0).choice(list(summary.stations))
+
+            binary_storage.save(binary_file, summary)
+            binary = time_to_first_lookup(lambda: binary_storage.load(binary_file), key)
+            lazy = time_to_first_lookup(
+                lambda: binary_storage.load(binary_file, lazy=True), key
+            )
+            binary_mb = os.path.getsize(binary_file) / 1e6
+
+            if size <= JSON_LIMIT:
+                storage.save(json_file, summary)
+                json = time_to_first_lookup(lambda: storage.load(json_file), key)
+                json_columns = f"{json:>8.2f}"
+                json_mb = f"{os.path.getsize(json_file) / 1e6:>8.1f}"
+                if storage.load(json_file) != binary_storage.load(binary_file):
+                    raise AssertionError(f"Loaded docks differ at {size} stations")
+            else:
+                json_columns = json_mb = f"{'-':>8}"
+
+            print(
+                f"{size:>9} {json_columns} {binary:>9.2f} {lazy:>8.2f}"
+                f" {json_mb} {binary_mb:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Compare what a separate process pays to look up one commodity and one
+station: loading the JSON stock and dock files, against mapping the state
+export. Also times publishing the export, in full and after one message.
+
+Run with: python -m benchmark.state_export
+"""
+
+import json
+import os
+import random
+import tempfile
+import threading
+
+from time import perf_counter
+from typing import Callable
+
+from benchmark.routes import COMMODITIES, make_message
+from benchmark.startup import make_docks
+from config.model import DockConfig, StockConfig
+from summary.dock_handler import storage as dock_storage
+from summary.dock_handler.journal_v1 import DockHandler
+from summary.model import StockSummary
+from summary.output_handler.state_export import StateExport
+from summary.state_file import StateReader
+from summary.stock_handler import storage as stock_storage
+from summary.stock_handler.commodity_v3 import StockHandler
+
+STATIONS = 100000
+MESSAGES = 5000
+LOOKUPS = 20
+
+
+def time_ms(call: Callable[[], object]) -> float:
+    started = perf_counter()
+    call()
+    return (perf_counter() - started) * 1000
+
+
+def main() -> None:
+    # Market messages name stations 0 up, as the docks do
+    docks = make_docks(STATIONS)
+    config = StockConfig(
+        file_path="",
+        max_best=5,
+        min_stock=500,
+        min_demand=1,
+        acceptable_station_types=["Coriolis", "Orbis", "Outpost", "Ocellus"],
+        origin_coords=[0.0, 0.0, 0.0],
+        max_from_origin=5000.0,
+        max_from_sun=5000.0,
+    )
+    dock_handler = DockHandler(config=DockConfig(file_path=""), target=docks)
+    handler = StockHandler(
+        config=config, target=StockSummary(), dock_handler=dock_handler
+    )
+    rand = random.Random(1)
+    for count in range(MESSAGES):
+        handler.update(make_message(rand, count))
+
+    with tempfile.TemporaryDirectory() as folder:
+        stock_file = os.path.join(folder, "stockfile.json")
+        dock_file = os.path.join(folder, "dockfile.json")
+        export_file = os.path.join(folder, "state.mmap")
+        stock_storage.save(stock_file, handler.stock_summary)
+        dock_storage.save(dock_file, docks)
+
+        export = StateExport(
+            path=export_file,
+            stock_handler=handler,
+            dock_handler=dock_handler,
+            state_lock=threading.Lock(),
+            interval=5.0,
+        )
+        full = time_ms(export.publish)
+        version = handler.version
+        while handler.version == version:
+            handler.update(make_message(rand, MESSAGES))
+        again = time_ms(export.publish)
+        print(f"{STATIONS} stations, {len(COMMODITIES)} commodities")
+        print(f"publish: {full:.1f} ms in full, {again:.1f} ms after a message")
+        json_mb = (os.path.getsize(stock_file) + os.path.getsize(dock_file)) / 1e6
+        export_mb = os.path.getsize(export_file) / 1e6
+        print(f"files: json {json_mb:.1f} MB, export {export_mb:.1f} MB")
+
+        names = [rand.choice(COMMODITIES) for _ in range(LOOKUPS)]
+        market_ids = [3200000000 + rand.randrange(STATIONS) for _ in range(LOOKUPS)]
+
+        def json_lookup(name: str, market_id: int) -> None:
+            with open(stock_file) as stocks, open(dock_file) as stations:
+                commodities = json.load(stocks)["commodities"]
+                stations = json.load(stations)["stations"]
+            next(c for c in commodities if c["name"] == name)
+            next(s for s in stations.values() if s["market_id"] == market_id)
+
+        def schema_lookup(name: str, market_id: int) -> None:
+            summary = stock_storage.load(stock_file)
+            stations = dock_storage.load(dock_file).stations
+            next(c for c in summary.commodities if c.name == name)
+            next(s for s in stations.values() if s.market_id == market_id)
+
+        def export_lookup(name: str, market_id: int) -> None:
+            reader = StateReader(export_file)
+            if reader.commodity(name) is None or reader.station(market_id) is None:
+                raise AssertionError(f"{name} or {market_id} missing from export")
+            reader.close()
+
+        reader = StateReader(export_file)
+
+        def mapped_lookup(name: str, market_id: int) -> None:
+            reader.commodity(name)
+            reader.station(market_id)
+
+        print(f"{'lookup':>22} {'ms':>10}")
+        for title, lookup, count in (
+            ("json.load", json_lookup, 3),
+            ("storage.load", schema_lookup, 1),
+            ("export, opened each", export_lookup, LOOKUPS),
+            ("export, kept open", mapped_lookup, LOOKUPS),
+        ):
+            latency = sum(
+                time_ms(lambda: lookup(name, market_id))
+                for name, market_id in list(zip(names, market_ids))[:count]
+            )
+            print(f"{title:>22} {latency / count:>10.3f}")
+        reader.close()
+        export.stop()
+
+
+if __name__ == "__main__":
+    main()
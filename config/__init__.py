@@ -2,7 +2,27 @@ from argparse import ArgumentParser
 from config.storage import load as _load
 
 parser = ArgumentParser()
-parser.add_argument("--config", help="use an alternative config file", type=str, default="config.json")
-parser.parse_args()
+parser.add_argument(
+    "--config", help="use an alternative config file", type=str, default="config.json"
+)
+parser.add_argument(
+    "--record",
+    help="also write every frame received to this file",
+    type=str,
+    default=None,
+)
+parser.add_argument(
+    "--replay",
+    help="read frames from this recording instead of the network",
+    type=str,
+    default=None,
+)
+parser.add_argument(
+    "--replay-speed",
+    help="replay this many times faster than recorded, or 0 for as fast as possible",
+    type=float,
+    default=0,
+)
+args = parser.parse_args()
 
-config = _load(config_file=parser.parse_args().config)
+config = _load(config_file=args.config)
@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Dict, List
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
 
 @dataclass
@@ -11,13 +11,11 @@ class CmdLineConfig:
 @dataclass
 class DockConfig:
     file_path: str
-    autosave_wait: int
 
 
 @dataclass
 class StockConfig:
     file_path: str
-    autosave_wait: int
     max_best: int
     min_stock: int
     min_demand: int
@@ -25,6 +23,102 @@ class StockConfig:
     origin_coords: List[float]
     max_from_origin: float
     max_from_sun: float
+    batch_update: bool = True
+    # Prices older than this are dropped from the best lists
+    max_age_hours: Optional[float] = None
+    # Prices count for half as much in the best lists each time this passes
+    half_life_hours: Optional[float] = None
+    expiry_interval: float = 60.0
+
+
+@dataclass
+class IngestConfig:
+    enabled: bool
+    queue_size: int
+    overflow_policy: str
+    decode_workers: int
+    decode_processes: int = 0
+
+
+@dataclass
+class AsyncioConfig:
+    enabled: bool
+    queue_size: int = 1000
+    render_interval: float = 10.0
+    save_check_interval: float = 1.0
+    decode_concurrency: int = 4
+
+
+@dataclass
+class StorageConfig:
+    mode: str
+    compact_bytes: int
+    sqlite_file: Optional[str] = None
+    station_cache_size: int = 10000
+    snapshot_format: str = "json"
+    lazy_load: bool = False
+
+
+@dataclass
+class AutosaveConfig:
+    min_interval: float = 30.0
+    max_interval: float = 300.0
+
+
+@dataclass
+class HistoryConfig:
+    enabled: bool
+    folder: str = "history"
+    chunk_rows: int = 100000
+    raw_hours: float = 48.0
+    hourly_days: float = 30.0
+    daily_days: float = 365.0
+
+
+@dataclass
+class MarketStoreConfig:
+    enabled: bool
+    profit_matrix: bool = True
+    initial_markets: int = 1024
+
+
+@dataclass
+class RouteConfig:
+    max_jump_range: float = 60.0
+    beam_width: int = 200
+
+
+@dataclass
+class RelayConfig:
+    urls: List[str]
+    dedupe_window: float = 600.0
+    dedupe_size: int = 100000
+    min_backoff: float = 1.0
+    max_backoff: float = 60.0
+
+
+@dataclass
+class MetricsConfig:
+    enabled: bool
+    port: Optional[int] = None
+    stats_file: Optional[str] = None
+    stats_interval: float = 10.0
+    profile_every: int = 100
+    profile_file: str = "slurper.prof"
+
+
+@dataclass
+class QueryConfig:
+    enabled: bool
+    port: int = 9102
+    cache_size: int = 256
+
+
+@dataclass
+class ExportConfig:
+    enabled: bool
+    path: str = "state.mmap"
+    interval: float = 5.0
 
 
 @dataclass
@@ -34,3 +128,15 @@ class Config:
     cmd_line: CmdLineConfig
     dock: DockConfig
     stock: StockConfig
+    decoder: str = "strict"
+    autosave: AutosaveConfig = field(default_factory=AutosaveConfig)
+    routes: RouteConfig = field(default_factory=RouteConfig)
+    ingest: Optional[IngestConfig] = None
+    asyncio: Optional[AsyncioConfig] = None
+    storage: Optional[StorageConfig] = None
+    metrics: Optional[MetricsConfig] = None
+    relays: Optional[RelayConfig] = None
+    query: Optional[QueryConfig] = None
+    markets: Optional[MarketStoreConfig] = None
+    history: Optional[HistoryConfig] = None
+    export: Optional[ExportConfig] = None
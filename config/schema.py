@@ -1,7 +1,24 @@
 from marshmallow import Schema, fields, EXCLUDE, post_load
-from marshmallow.validate import Length
+from marshmallow.validate import Length, OneOf
 
-from config.model import Config, DockConfig, StockConfig, CmdLineConfig
+from config.model import (
+    AsyncioConfig,
+    AutosaveConfig,
+    Config,
+    DockConfig,
+    ExportConfig,
+    HistoryConfig,
+    StockConfig,
+    CmdLineConfig,
+    IngestConfig,
+    MarketStoreConfig,
+    MetricsConfig,
+    QueryConfig,
+    RelayConfig,
+    RouteConfig,
+    StorageConfig,
+)
+from pipeline.bounded_queue import OVERFLOW_POLICIES
 
 
 class BaseSchema(Schema):
@@ -20,7 +37,6 @@ class CmdLineConfigSchema(BaseSchema):
 
 class DockConfigSchema(BaseSchema):
     file_path = fields.String(required=True)
-    autosave_wait = fields.Integer(required=True)
 
     @post_load
     def to_domain(self, data, **kwargs) -> DockConfig:
@@ -29,7 +45,6 @@ class DockConfigSchema(BaseSchema):
 
 class StockConfigSchema(BaseSchema):
     file_path = fields.String(required=True)
-    autosave_wait = fields.Integer(required=True)
     max_best = fields.Integer(required=True)
     min_stock = fields.Integer(required=True)
     min_demand = fields.Integer(required=True)
@@ -39,18 +54,157 @@ class StockConfigSchema(BaseSchema):
     )
     max_from_origin = fields.Float(required=True)
     max_from_sun = fields.Float(required=True)
+    batch_update = fields.Boolean()
+    max_age_hours = fields.Float(allow_none=True)
+    half_life_hours = fields.Float(allow_none=True)
+    expiry_interval = fields.Float()
 
     @post_load
     def to_domain(self, data, **kwargs) -> StockConfig:
         return StockConfig(**data)
 
 
+class IngestConfigSchema(BaseSchema):
+    enabled = fields.Boolean(required=True)
+    queue_size = fields.Integer(required=True)
+    overflow_policy = fields.String(required=True, validate=OneOf(OVERFLOW_POLICIES))
+    decode_workers = fields.Integer(required=True)
+    decode_processes = fields.Integer()
+
+    @post_load
+    def to_domain(self, data, **kwargs) -> IngestConfig:
+        return IngestConfig(**data)
+
+
+class AsyncioConfigSchema(BaseSchema):
+    enabled = fields.Boolean(required=True)
+    queue_size = fields.Integer()
+    render_interval = fields.Float()
+    save_check_interval = fields.Float()
+    decode_concurrency = fields.Integer()
+
+    @post_load
+    def to_domain(self, data, **kwargs) -> AsyncioConfig:
+        return AsyncioConfig(**data)
+
+
+class StorageConfigSchema(BaseSchema):
+    mode = fields.String(required=True, validate=OneOf(["json", "log", "sqlite"]))
+    compact_bytes = fields.Integer(required=True)
+    sqlite_file = fields.String(allow_none=True)
+    station_cache_size = fields.Integer()
+    snapshot_format = fields.String(validate=OneOf(["json", "binary"]))
+    lazy_load = fields.Boolean()
+
+    @post_load
+    def to_domain(self, data, **kwargs) -> StorageConfig:
+        return StorageConfig(**data)
+
+
+class AutosaveConfigSchema(BaseSchema):
+    min_interval = fields.Float(required=True)
+    max_interval = fields.Float(required=True)
+
+    @post_load
+    def to_domain(self, data, **kwargs) -> AutosaveConfig:
+        return AutosaveConfig(**data)
+
+
+class MetricsConfigSchema(BaseSchema):
+    enabled = fields.Boolean(required=True)
+    port = fields.Integer(allow_none=True)
+    stats_file = fields.String(allow_none=True)
+    stats_interval = fields.Float()
+    profile_every = fields.Integer()
+    profile_file = fields.String()
+
+    @post_load
+    def to_domain(self, data, **kwargs) -> MetricsConfig:
+        return MetricsConfig(**data)
+
+
+class HistoryConfigSchema(BaseSchema):
+    enabled = fields.Boolean(required=True)
+    folder = fields.String()
+    chunk_rows = fields.Integer()
+    raw_hours = fields.Float()
+    hourly_days = fields.Float()
+    daily_days = fields.Float()
+
+    @post_load
+    def to_domain(self, data, **kwargs) -> HistoryConfig:
+        return HistoryConfig(**data)
+
+
+class MarketStoreConfigSchema(BaseSchema):
+    enabled = fields.Boolean(required=True)
+    profit_matrix = fields.Boolean()
+    initial_markets = fields.Integer()
+
+    @post_load
+    def to_domain(self, data, **kwargs) -> MarketStoreConfig:
+        return MarketStoreConfig(**data)
+
+
+class RouteConfigSchema(BaseSchema):
+    max_jump_range = fields.Float()
+    beam_width = fields.Integer()
+
+    @post_load
+    def to_domain(self, data, **kwargs) -> RouteConfig:
+        return RouteConfig(**data)
+
+
+class RelayConfigSchema(BaseSchema):
+    urls = fields.List(fields.String(), required=True)
+    dedupe_window = fields.Float()
+    dedupe_size = fields.Integer()
+    min_backoff = fields.Float()
+    max_backoff = fields.Float()
+
+    @post_load
+    def to_domain(self, data, **kwargs) -> RelayConfig:
+        return RelayConfig(**data)
+
+
+class QueryConfigSchema(BaseSchema):
+    enabled = fields.Boolean(required=True)
+    port = fields.Integer()
+    cache_size = fields.Integer()
+
+    @post_load
+    def to_domain(self, data, **kwargs) -> QueryConfig:
+        return QueryConfig(**data)
+
+
+class ExportConfigSchema(BaseSchema):
+    enabled = fields.Boolean(required=True)
+    path = fields.String()
+    interval = fields.Float()
+
+    @post_load
+    def to_domain(self, data, **kwargs) -> ExportConfig:
+        return ExportConfig(**data)
+
+
 class ConfigSchema(BaseSchema):
     eddn_relay_url = fields.String(required=True)
     eddn_timeout = fields.Integer(required=True)
     cmd_line = fields.Nested(CmdLineConfigSchema, required=True)
     dock = fields.Nested(DockConfigSchema, required=True)
     stock = fields.Nested(StockConfigSchema, required=True)
+    decoder = fields.String(validate=OneOf(["fast", "strict"]))
+    autosave = fields.Nested(AutosaveConfigSchema)
+    routes = fields.Nested(RouteConfigSchema)
+    ingest = fields.Nested(IngestConfigSchema, allow_none=True)
+    asyncio = fields.Nested(AsyncioConfigSchema, allow_none=True)
+    storage = fields.Nested(StorageConfigSchema, allow_none=True)
+    metrics = fields.Nested(MetricsConfigSchema, allow_none=True)
+    relays = fields.Nested(RelayConfigSchema, allow_none=True)
+    query = fields.Nested(QueryConfigSchema, allow_none=True)
+    markets = fields.Nested(MarketStoreConfigSchema, allow_none=True)
+    history = fields.Nested(HistoryConfigSchema, allow_none=True)
+    export = fields.Nested(ExportConfigSchema, allow_none=True)
 
     @post_load
     def to_domain(self, data, **kwargs) -> Config:
@@ -0,0 +1,74 @@
+from decimal import Decimal
+from typing import Any
+
+from eddn.commodity_v3.model import Commodity, CommodityV3, Economy, Header, Message
+from eddn.fast_fields import (
+    integer,
+    number,
+    optional_boolean,
+    optional_string,
+    optional_string_list,
+    string,
+)
+
+
+def _bracket(value: Any) -> str:
+    """Bracket info can be 0, 1, 2, 3 or \"\" """
+    if type(value) is int:
+        return str(value)
+    return string(value)
+
+
+def _commodity(data: dict) -> Commodity:
+    return Commodity(
+        name=string(data["name"]),
+        mean_price=integer(data["meanPrice"]),
+        buy_price=integer(data["buyPrice"]),
+        stock=integer(data["stock"]),
+        stock_bracket=_bracket(data["stockBracket"]),
+        sell_price=integer(data["sellPrice"]),
+        demand=integer(data["demand"]),
+        demand_bracket=_bracket(data["demandBracket"]),
+        status_flags=optional_string_list(data.get("statusFlags")),
+    )
+
+
+def _economy(data: dict) -> Economy:
+    return Economy(
+        name=string(data["name"]),
+        proportion=Decimal(str(number(data["proportion"]))),
+    )
+
+
+def decode(data: dict) -> CommodityV3:
+    """
+    Build a CommodityV3 straight from a parsed message, without marshmallow.
+    Raises KeyError, TypeError or ValueError for anything CommodityV3Schema
+    would have to coerce or reject, so the caller can fall back to it.
+    """
+    header = data["header"]
+    message = data["message"]
+
+    economies = message.get("economies")
+    if economies is not None:
+        economies = [_economy(economy) for economy in economies]
+
+    return CommodityV3(
+        header=Header(
+            uploader_id=string(header["uploaderID"]),
+            software_name=string(header["softwareName"]),
+            software_version=string(header["softwareVersion"]),
+            gateway_timestamp=optional_string(header["gatewayTimestamp"]),
+        ),
+        message=Message(
+            system_name=string(message["systemName"]),
+            station_name=string(message["stationName"]),
+            market_id=integer(message["marketId"]),
+            timestamp=string(message["timestamp"]),
+            commodities=[_commodity(commodity) for commodity in message["commodities"]],
+            economies=economies,
+            prohibited=optional_string_list(message.get("prohibited")),
+            horizons=optional_boolean(message.get("horizons")),
+            odyssey=optional_boolean(message.get("odyssey")),
+        ),
+    )
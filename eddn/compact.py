@@ -0,0 +1,109 @@
+"""
+Decoded messages as plain tuples, for passing between processes.
+
+Pickling the models themselves writes out every field name of every object,
+the commodity lines of a market message making up most of that. As tuples
+only the values are sent, and the models are rebuilt from them on arrival.
+"""
+
+from dataclasses import fields
+from operator import attrgetter
+from typing import Tuple
+
+from eddn.commodity_v3 import model as commodity_v3
+from eddn.decoder import DecodedMessage
+from eddn.journal_v1 import model as journal_v1
+
+COMMODITY_V3 = 1
+JOURNAL_V1 = 2
+
+
+def _values_of(model_class: type) -> attrgetter:
+    return attrgetter(*(field.name for field in fields(model_class)))
+
+
+_commodity_header = _values_of(commodity_v3.Header)
+_commodity = _values_of(commodity_v3.Commodity)
+_economy = _values_of(commodity_v3.Economy)
+_journal_header = _values_of(journal_v1.Header)
+_journal_message = _values_of(journal_v1.Message)
+
+
+def to_record(decoded: DecodedMessage) -> Tuple:
+    model = decoded.model
+    if isinstance(model, commodity_v3.CommodityV3):
+        message = model.message
+        body = (
+            message.system_name,
+            message.station_name,
+            message.market_id,
+            message.timestamp,
+            [_commodity(commodity) for commodity in message.commodities],
+            (
+                None
+                if message.economies is None
+                else [_economy(economy) for economy in message.economies]
+            ),
+            message.prohibited,
+            message.horizons,
+            message.odyssey,
+        )
+        return (
+            decoded.schema_name,
+            decoded.event,
+            COMMODITY_V3,
+            _commodity_header(model.header),
+            body,
+        )
+    if isinstance(model, journal_v1.JournalV1):
+        return (
+            decoded.schema_name,
+            decoded.event,
+            JOURNAL_V1,
+            _journal_header(model.header),
+            _journal_message(model.message),
+        )
+    return decoded.schema_name, decoded.event
+
+
+def from_record(record: Tuple) -> DecodedMessage:
+    if len(record) == 2:
+        return DecodedMessage(schema_name=record[0], event=record[1])
+
+    schema_name, event, kind, header, body = record
+    if kind == COMMODITY_V3:
+        (
+            system_name,
+            station_name,
+            market_id,
+            timestamp,
+            commodities,
+            economies,
+            prohibited,
+            horizons,
+            odyssey,
+        ) = body
+        model = commodity_v3.CommodityV3(
+            header=commodity_v3.Header(*header),
+            message=commodity_v3.Message(
+                system_name=system_name,
+                station_name=station_name,
+                market_id=market_id,
+                timestamp=timestamp,
+                commodities=[commodity_v3.Commodity(*line) for line in commodities],
+                economies=(
+                    None
+                    if economies is None
+                    else [commodity_v3.Economy(*economy) for economy in economies]
+                ),
+                prohibited=prohibited,
+                horizons=horizons,
+                odyssey=odyssey,
+            ),
+        )
+    else:
+        model = journal_v1.JournalV1(
+            header=journal_v1.Header(*header),
+            message=journal_v1.Message(*body),
+        )
+    return DecodedMessage(schema_name=schema_name, model=model, event=event)
@@ -0,0 +1,75 @@
+import hashlib
+import re
+import threading
+
+from collections import OrderedDict
+from time import monotonic
+from typing import Hashable, Optional, Tuple
+
+_UPLOADER = re.compile(rb'"uploaderID"\s*:\s*"([^"]*)"')
+_MARKET_ID = re.compile(rb'"(?:marketId|MarketID)"\s*:\s*(\d+)')
+_TIMESTAMP = re.compile(rb'"timestamp"\s*:\s*"([^"]*)"')
+_MESSAGE = re.compile(rb'"message"\s*:')
+
+MessageKey = Tuple[Optional[bytes], Optional[bytes], Optional[bytes], bytes]
+
+
+def _peek(pattern: re.Pattern, message: bytes) -> Optional[bytes]:
+    if match := pattern.search(message):
+        return match.group(1)
+    return None
+
+
+def message_key(message: bytes) -> MessageKey:
+    """
+    What identifies a decompressed message however it reached us: who uploaded
+    it, the market it's about, its timestamp, and a hash of its body. The
+    header is left out of the hash, as relays may differ in how they pass it on.
+    """
+    body_at = _MESSAGE.search(message)
+    body = message[body_at.end() :] if body_at else message
+    return (
+        _peek(_UPLOADER, message),
+        _peek(_MARKET_ID, message),
+        _peek(_TIMESTAMP, body),
+        hashlib.blake2b(body, digest_size=16).digest(),
+    )
+
+
+class DedupeCache:
+    """
+    Remembers the keys seen in the last `window` seconds, up to `max_size` of
+    them, forgetting the oldest first.
+    """
+
+    def __init__(self, window: float, max_size: int) -> None:
+        self.window = window
+        self.max_size = max(1, max_size)
+        self.duplicates = 0
+        self._seen: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def seen(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """Whether the key was seen within the window, remembering it if not"""
+        if now is None:
+            now = monotonic()
+        with self._lock:
+            self._forget_before(now - self.window)
+            if key in self._seen:
+                self.duplicates += 1
+                return True
+            self._seen[key] = now
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return False
+
+    def _forget_before(self, cutoff: float) -> None:
+        # Keys are remembered in the order they were seen, so the oldest are first
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if seen_at >= cutoff:
+                return
+            del self._seen[key]
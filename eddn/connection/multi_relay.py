@@ -0,0 +1,241 @@
+import re
+import sys
+import threading
+import time
+import zlib
+import zmq
+
+from collections import deque
+from datetime import datetime
+from time import monotonic
+from typing import Callable, Deque, Dict, List, Optional
+
+from eddn.connection.dedupe import DedupeCache, message_key
+from eddn.connection.recording import FrameRecorder
+
+# How long each poll waits for a message, so stopping is noticed promptly
+POLL_MILLISECONDS = 500
+# Most frames taken from one relay before checking the others
+MAX_BURST = 100
+# The window message rates are measured over
+RATE_SECONDS = 60.0
+
+_GATEWAY_TIMESTAMP = re.compile(rb'"gatewayTimestamp"\s*:\s*"([^"]*)"')
+
+
+class RelayStats:
+    def __init__(self) -> None:
+        self.received = 0
+        self.duplicates = 0
+        self.reconnects = 0
+        self.errors = 0
+        self.last_lag_seconds = 0.0
+        self.total_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self.lagged = 0
+        self.recent: Deque[float] = deque()
+
+    def record(self, now: float, lag: Optional[float]) -> None:
+        self.received += 1
+        self.recent.append(now)
+        if lag is not None:
+            self.lagged += 1
+            self.last_lag_seconds = lag
+            self.total_lag_seconds += lag
+            self.max_lag_seconds = max(self.max_lag_seconds, lag)
+
+    def summary(self, now: float) -> Dict[str, float]:
+        while self.recent and self.recent[0] < now - RATE_SECONDS:
+            self.recent.popleft()
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "reconnects": self.reconnects,
+            "errors": self.errors,
+            "per_second": round(len(self.recent) / RATE_SECONDS, 3),
+            "last_lag_ms": round(1000 * self.last_lag_seconds, 3),
+            "mean_lag_ms": round(1000 * self.total_lag_seconds / (self.lagged or 1), 3),
+            "max_lag_ms": round(1000 * self.max_lag_seconds, 3),
+        }
+
+
+class Relay:
+    """The socket subscribed to one relay, and when to next try connecting it"""
+
+    def __init__(self, url: str, min_backoff: float) -> None:
+        self.url = url
+        self.socket: Optional[zmq.Socket] = None
+        self.last_message = 0.0
+        self.backoff = min_backoff
+        self.next_attempt = 0.0
+        self.stats = RelayStats()
+
+
+class RelayGroup:
+    """
+    The relays subscribed to, how long to back off each for, and their stats,
+    however the sockets are read.
+
+    A relay that has sent nothing for `timeout` milliseconds, or whose socket
+    fails, is disconnected and retried after a backoff that doubles with each
+    attempt, from `min_backoff` up to `max_backoff` seconds. Lag is the time
+    from the EDDN gateway stamping a message to it being received here, so
+    includes any clock difference. With `dedupe`, each message is only
+    accepted once, however many of the relays it arrives from.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        timeout: int,
+        dedupe: Optional[DedupeCache],
+        min_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ) -> None:
+        self.timeout = timeout
+        self.dedupe = dedupe
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.relays = [Relay(url, min_backoff) for url in urls]
+        self._stats_lock = threading.Lock()
+
+    def _back_off(self, relay: Relay, now: float, reason: str) -> float:
+        """Note a relay as dropped, returning how long to wait before retrying"""
+        print(f"Relay {relay.url} {reason}, retrying in {relay.backoff:g}s")
+        sys.stdout.flush()
+        delay = relay.backoff
+        relay.next_attempt = now + delay
+        relay.backoff = min(relay.backoff * 2, self.max_backoff)
+        with self._stats_lock:
+            relay.stats.reconnects += 1
+        return delay
+
+    def _accept(self, relay: Relay, frame: bytes, now: float) -> Optional[bytes]:
+        """
+        Note a frame from a relay, returning it decompressed if it should be
+        passed on, so the decoder needn't decompress it again
+        """
+        relay.last_message = now
+        relay.backoff = self.min_backoff
+        try:
+            message = zlib.decompress(frame)
+        except zlib.error:
+            with self._stats_lock:
+                relay.stats.errors += 1
+            return None
+
+        lag = None
+        if match := _GATEWAY_TIMESTAMP.search(message):
+            try:
+                stamped = datetime.fromisoformat(match.group(1).decode())
+                lag = time.time() - stamped.timestamp()
+            except ValueError:
+                pass
+
+        duplicate = self.dedupe is not None and self.dedupe.seen(
+            message_key(message), now
+        )
+        with self._stats_lock:
+            relay.stats.record(now, lag)
+            if duplicate:
+                relay.stats.duplicates += 1
+        return None if duplicate else message
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        now = monotonic()
+        with self._stats_lock:
+            return {relay.url: relay.stats.summary(now) for relay in self.relays}
+
+
+class MultiRelayListener(RelayGroup):
+    """
+    Subscribes to one or more EDDN relays at once, passing each message on
+    once however many of the relays it arrives from. A relay that goes quiet
+    or fails is backed off as `RelayGroup` says, while the others carry on.
+    `callback` is given each frame along with the message decompressed.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        timeout: int,
+        callback: Callable[[bytes, Optional[bytes]], None],
+        dedupe: Optional[DedupeCache],
+        min_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        recorder: Optional[FrameRecorder] = None,
+    ) -> None:
+        super().__init__(urls, timeout, dedupe, min_backoff, max_backoff)
+        self.callback = callback
+        # Keeps a copy of every frame passed on, for replaying later
+        self.recorder = recorder
+
+        self._continue = False
+        self._context = zmq.Context.instance()
+        self._poller = zmq.Poller()
+
+    def _connect(self, relay: Relay, now: float) -> None:
+        relay.socket = self._context.socket(zmq.SUB)
+        relay.socket.setsockopt(zmq.SUBSCRIBE, b"")
+        relay.socket.setsockopt(zmq.LINGER, 0)
+        relay.socket.connect(relay.url)
+        self._poller.register(relay.socket, zmq.POLLIN)
+        # Give it the whole timeout to send its first message
+        relay.last_message = now
+
+    def _disconnect(self, relay: Relay, now: float, reason: str) -> None:
+        if relay.socket is not None:
+            self._poller.unregister(relay.socket)
+            relay.socket.close()
+            relay.socket = None
+        self._back_off(relay, now, reason)
+
+    def _receive(self, relay: Relay) -> None:
+        for _ in range(MAX_BURST):
+            try:
+                frame = relay.socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            message = self._accept(relay, frame, monotonic())
+            if message is None:
+                continue
+            if self.recorder:
+                self.recorder.write(frame)
+            self.callback(frame, message)
+
+    def _check_relays(self, now: float) -> None:
+        for relay in self.relays:
+            if relay.socket is None:
+                if now >= relay.next_attempt:
+                    self._connect(relay, now)
+            elif now - relay.last_message > self.timeout / 1000:
+                self._disconnect(relay, now, "has gone quiet")
+
+    def start(self) -> None:
+        self._continue = True
+        try:
+            while self._continue:
+                self._check_relays(monotonic())
+                try:
+                    ready = dict(self._poller.poll(POLL_MILLISECONDS))
+                except zmq.ZMQError as e:
+                    print("ZMQSocketException: " + str(e))
+                    sys.stdout.flush()
+                    continue
+
+                for relay in self.relays:
+                    if relay.socket is None or relay.socket not in ready:
+                        continue
+                    try:
+                        self._receive(relay)
+                    except zmq.ZMQError as e:
+                        self._disconnect(relay, monotonic(), f"failed: {e}")
+        finally:
+            for relay in self.relays:
+                if relay.socket is not None:
+                    self._poller.unregister(relay.socket)
+                    relay.socket.close()
+                    relay.socket = None
+
+    def stop(self, sig, frame) -> None:
+        self._continue = False
@@ -0,0 +1,55 @@
+"""
+Files of raw EDDN frames as received, for replaying without the network.
+
+A recording is a short header followed by one record per frame: the time it
+was received, in seconds since the epoch, its length, then its bytes still
+zlib compressed exactly as they came off the relay.
+"""
+
+import struct
+import time
+
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+MAGIC = b"EDDNREC1"
+_RECORD = struct.Struct("<dI")
+
+
+class FrameRecorder:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.frames = 0
+        self._file: BinaryIO = open(path, "wb")
+        self._file.write(MAGIC)
+
+    def write(self, frame: bytes, received: Optional[float] = None) -> None:
+        if received is None:
+            received = time.time()
+        self._file.write(_RECORD.pack(received, len(frame)))
+        self._file.write(frame)
+        self.frames += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "FrameRecorder":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def read_frames(path: str) -> Iterator[Tuple[float, bytes]]:
+    """The (receive time, frame) of each frame recorded, stopping at any torn end"""
+    with open(path, "rb") as recording:
+        if recording.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an EDDN frame recording")
+        while True:
+            header = recording.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            received, length = _RECORD.unpack(header)
+            frame = recording.read(length)
+            if len(frame) < length:
+                return
+            yield received, frame
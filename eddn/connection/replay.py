@@ -0,0 +1,47 @@
+import time
+
+from typing import Callable, Optional
+
+from eddn.connection.recording import read_frames
+
+
+class FrameReplayer:
+    """
+    Feeds a recording to `callback` in place of a `MultiRelayListener`.
+
+    With a `speed` the frames are spaced out as they were received, sped up
+    that many times, so 1 replays in real time. Without one, or with 0, they
+    are fed as fast as the callback takes them.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        callback: Callable[[bytes], None],
+        speed: Optional[float] = None,
+    ) -> None:
+        self.path = path
+        self.callback = callback
+        self.speed = speed or None
+        self.frames = 0
+        self._continue = False
+
+    def start(self) -> None:
+        self._continue = True
+        first_received = None
+        started = time.monotonic()
+        for received, frame in read_frames(self.path):
+            if not self._continue:
+                break
+            if self.speed:
+                if first_received is None:
+                    first_received = received
+                due = started + (received - first_received) / self.speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            self.callback(frame)
+            self.frames += 1
+
+    def stop(self, sig, frame) -> None:
+        self._continue = False
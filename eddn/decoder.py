@@ -0,0 +1,135 @@
+import simplejson
+import zlib
+
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Callable, Optional, Union
+
+from eddn import fast_fields
+from eddn.commodity_v3 import decoder as commodity_v3_decoder
+from eddn.commodity_v3.model import CommodityV3
+from eddn.commodity_v3.schema import CommodityV3Schema
+from eddn.journal_v1 import decoder as journal_v1_decoder
+from eddn.journal_v1.model import JournalV1
+from eddn.journal_v1.schema import JournalV1Schema
+from eddn.peek import PeekFilter
+
+COMMODITY_V3_SCHEMA = "https://eddn.edcd.io/schemas/commodity/3"
+JOURNAL_V1_SCHEMA = "https://eddn.edcd.io/schemas/journal/1"
+
+# We only care about ships docking or reporting location at a dock
+WANTED_JOURNAL_EVENTS = ["Docked", "Location"]
+
+# The stages of decoding a message, as timed by `time_stage`
+DECOMPRESS = "decompress"
+PEEK = "peek"
+PARSE = "parse"
+VALIDATE = "validate"
+
+
+@dataclass
+class DecodedMessage:
+    schema_name: str
+    model: Optional[Union[CommodityV3, JournalV1]] = None
+    event: Optional[str] = None
+
+
+def _untimed(stage: str, started: float) -> float:
+    return perf_counter()
+
+
+class MessageDecoder:
+    """
+    Turns raw EDDN frames into models. It touches no summary state, so can be
+    used from any thread, or built afresh in another process.
+
+    With `fast` the models are built directly, falling back to the validating
+    schemas for anything the fast decoders can't take as-is. `time_stage` is
+    told when each stage finishes, with when it started, and returns the time
+    it was told so the next stage can start from there.
+    """
+
+    def __init__(
+        self,
+        fast: bool,
+        time_stage: Callable[[str, float], float] = _untimed,
+    ) -> None:
+        self.fast = fast
+        self.time_stage = time_stage
+        self.commodity_v3_schema = CommodityV3Schema()
+        self.journal_v1_schema = JournalV1Schema()
+        self.peek_filter = PeekFilter(
+            wanted={
+                COMMODITY_V3_SCHEMA: None,
+                JOURNAL_V1_SCHEMA: WANTED_JOURNAL_EVENTS,
+            }
+        )
+
+    def decode(
+        self, message: bytes, decompressed: Optional[bytes] = None
+    ) -> DecodedMessage:
+        """
+        Decompress, parse and validate a raw EDDN message. A listener that has
+        already decompressed it passes that in as `decompressed`.
+        """
+        started = perf_counter()
+        message = zlib.decompress(message) if decompressed is None else decompressed
+        started = self.time_stage(DECOMPRESS, started)
+
+        # Skip the parse altogether for schemas and events we ignore
+        schema_name, event, wanted = self.peek_filter.check(message)
+        started = self.time_stage(PEEK, started)
+        if not wanted:
+            return DecodedMessage(schema_name=schema_name, event=event)
+
+        json = self.parse_json(message)
+        started = self.time_stage(PARSE, started)
+        decoded = self.validate_json(json, message)
+        self.time_stage(VALIDATE, started)
+        return decoded
+
+    def parse_json(self, message: bytes) -> dict:
+        if self.fast:
+            return fast_fields.loads(message)
+        return simplejson.loads(message)
+
+    def validate_json(
+        self, json: dict, message: Optional[bytes] = None
+    ) -> DecodedMessage:
+        """
+        Build the model for a parsed message, if it's of a schema we handle.
+        Given the raw `message`, it's parsed again with simplejson for the
+        schemas if the fast decoders can't take it, as orjson reads integers
+        wider than 64 bits as floats.
+        """
+        schema_name = json["$schemaRef"]
+        if schema_name == COMMODITY_V3_SCHEMA:
+            return DecodedMessage(
+                schema_name=schema_name, model=self._load_commodity_v3(json, message)
+            )
+        if schema_name == JOURNAL_V1_SCHEMA:
+            return DecodedMessage(
+                schema_name=schema_name, model=self._load_journal_v1(json, message)
+            )
+        return DecodedMessage(schema_name=schema_name)
+
+    def _load_commodity_v3(self, json: dict, message: Optional[bytes]) -> CommodityV3:
+        """Use the fast decoder if enabled, falling back to the validating schema"""
+        if self.fast:
+            try:
+                return commodity_v3_decoder.decode(json)
+            except (KeyError, TypeError, ValueError):
+                json = self._strict_json(json, message)
+        return self.commodity_v3_schema.load(json)
+
+    def _load_journal_v1(self, json: dict, message: Optional[bytes]) -> JournalV1:
+        """Use the fast decoder if enabled, falling back to the validating schema"""
+        if self.fast:
+            try:
+                return journal_v1_decoder.decode(json)
+            except (KeyError, TypeError, ValueError):
+                json = self._strict_json(json, message)
+        return self.journal_v1_schema.load(json)
+
+    def _strict_json(self, json: dict, message: Optional[bytes]) -> dict:
+        return json if message is None else simplejson.loads(message)
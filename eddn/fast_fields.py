@@ -0,0 +1,82 @@
+"""
+Type checked field readers for the fast decoders.
+
+These only accept values already in the exact type the model expects,
+raising ValueError for anything else, so any message needing the coercion
+rules of the marshmallow schemas can be handed back to them instead.
+"""
+
+from math import isfinite
+from typing import Any, List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import simplejson
+
+
+def loads(message: bytes) -> dict:
+    """
+    Parse JSON with orjson when it is installed. It rejects some JSON that
+    simplejson takes, such as NaN and integers wider than 64 bits, so those
+    are parsed again with simplejson.
+    """
+    if orjson:
+        try:
+            return orjson.loads(message)
+        except orjson.JSONDecodeError:
+            pass
+    return simplejson.loads(message)
+
+
+def string(value: Any) -> str:
+    if type(value) is not str:
+        raise ValueError(f"Expected string, got {type(value).__name__}")
+    return value
+
+
+def integer(value: Any) -> int:
+    if type(value) is not int:
+        raise ValueError(f"Expected integer, got {type(value).__name__}")
+    return value
+
+
+def number(value: Any) -> float:
+    if type(value) is not float and type(value) is not int:
+        raise ValueError(f"Expected number, got {type(value).__name__}")
+    value = float(value)
+    if not isfinite(value):
+        raise ValueError("Expected finite number")
+    return value
+
+
+def boolean(value: Any) -> bool:
+    if type(value) is not bool:
+        raise ValueError(f"Expected boolean, got {type(value).__name__}")
+    return value
+
+
+def optional_string(value: Any) -> Optional[str]:
+    return None if value is None else string(value)
+
+
+def optional_integer(value: Any) -> Optional[int]:
+    return None if value is None else integer(value)
+
+
+def optional_number(value: Any) -> Optional[float]:
+    return None if value is None else number(value)
+
+
+def optional_boolean(value: Any) -> Optional[bool]:
+    return None if value is None else boolean(value)
+
+
+def optional_string_list(value: Any) -> Optional[List[str]]:
+    if value is None:
+        return None
+    if type(value) is not list:
+        raise ValueError(f"Expected list, got {type(value).__name__}")
+    return [string(item) for item in value]
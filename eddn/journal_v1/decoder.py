@@ -0,0 +1,65 @@
+import re
+
+from datetime import datetime
+from typing import Any, Optional
+
+from eddn.fast_fields import (
+    integer,
+    number,
+    optional_integer,
+    optional_number,
+    optional_string,
+    string,
+)
+from eddn.journal_v1.model import JournalV1, Header, Message
+
+# The timestamps EDDN sends, on which fromisoformat and the schema's
+# DateTime agree. Anything else, such as a date alone, is left to the schema.
+_TIMESTAMP = re.compile(
+    r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?(Z|[+-]\d{2}:\d{2})?"
+)
+
+
+def _datetime(value: Any) -> datetime:
+    if not _TIMESTAMP.fullmatch(string(value)):
+        raise ValueError(f"Expected ISO 8601 timestamp, got {value!r}")
+    return datetime.fromisoformat(value)
+
+
+def _optional_datetime(value: Any) -> Optional[datetime]:
+    return None if value is None else _datetime(value)
+
+
+def decode(data: dict) -> JournalV1:
+    """
+    Build a JournalV1 straight from a parsed message, without marshmallow.
+    Raises KeyError, TypeError or ValueError for anything JournalV1Schema
+    would have to coerce or reject, so the caller can fall back to it.
+    """
+    header = data["header"]
+    message = data["message"]
+
+    star_pos = message["StarPos"]
+    if type(star_pos) is not list:
+        raise ValueError("Expected StarPos list")
+
+    return JournalV1(
+        header=Header(
+            uploader_id=string(header["uploaderID"]),
+            software_name=string(header["softwareName"]),
+            software_version=string(header["softwareVersion"]),
+            gateway_timestamp=_optional_datetime(header["gatewayTimestamp"]),
+        ),
+        message=Message(
+            event=string(message["event"]),
+            star_pos=[number(coord) for coord in star_pos],
+            system_name=string(message["StarSystem"]),
+            system_address=integer(message["SystemAddress"]),
+            timestamp=_datetime(message["timestamp"]),
+            dist_from_star_ls=optional_number(message.get("DistFromStarLS")),
+            market_id=optional_integer(message.get("MarketID")),
+            station_allegiance=optional_string(message.get("StationAllegiance")),
+            station_name=optional_string(message.get("StationName")),
+            station_type=optional_string(message.get("StationType")),
+        ),
+    )
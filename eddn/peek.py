@@ -0,0 +1,74 @@
+import re
+import threading
+
+from typing import Dict, List, Optional, Tuple
+
+_SCHEMA_REF = re.compile(rb'"\$schemaRef"\s*:\s*"([^"]*)"')
+_EVENT = re.compile(rb'"event"\s*:\s*"([^"]*)"')
+
+
+def peek_schema_ref(message: bytes) -> Optional[str]:
+    """Find the `$schemaRef` of a decompressed message without parsing it"""
+    if match := _SCHEMA_REF.search(message):
+        return match.group(1).decode()
+    return None
+
+
+def peek_event(message: bytes) -> Optional[str]:
+    """Find the journal `event` of a decompressed message without parsing it"""
+    if match := _EVENT.search(message):
+        return match.group(1).decode()
+    return None
+
+
+class PeekFilter:
+    """
+    Decides from a cheap look at the raw JSON whether a message is worth parsing.
+
+    `wanted` maps each schema we handle to the journal events we handle for it,
+    or to None if every message of that schema is wanted. Anything that can't be
+    peeked at is let through for a full parse.
+    """
+
+    def __init__(self, wanted: Dict[str, Optional[List[str]]]) -> None:
+        self.wanted = wanted
+        self.skipped_messages: Dict[str, int] = {}
+        self.skipped_bytes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def check(self, message: bytes) -> Tuple[Optional[str], Optional[str], bool]:
+        """Returns the peeked schema, the peeked event, and whether to parse it"""
+        schema_name = peek_schema_ref(message)
+        if schema_name is None:
+            return None, None, True
+
+        if schema_name not in self.wanted:
+            self._count_skip(schema_name, len(message))
+            return schema_name, None, False
+
+        wanted_events = self.wanted[schema_name]
+        if wanted_events is None:
+            return schema_name, None, True
+
+        event = peek_event(message)
+        if event is None or event in wanted_events:
+            return schema_name, event, True
+
+        self._count_skip(schema_name, len(message))
+        return schema_name, event, False
+
+    def _count_skip(self, schema_name: str, size: int) -> None:
+        with self._lock:
+            self.skipped_messages[schema_name] = (
+                self.skipped_messages.get(schema_name, 0) + 1
+            )
+            self.skipped_bytes[schema_name] = (
+                self.skipped_bytes.get(schema_name, 0) + size
+            )
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                "skipped_messages": dict(self.skipped_messages),
+                "skipped_bytes": dict(self.skipped_bytes),
+            }
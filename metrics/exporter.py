@@ -0,0 +1,101 @@
+import json
+import os
+import sys
+import threading
+import traceback
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from metrics.registry import MetricsRegistry
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsServer:
+    """
+    Serves the metrics over HTTP on the local machine only: in the Prometheus
+    text format at `/metrics`, and as JSON at `/stats.json`.
+    """
+
+    def __init__(self, registry: MetricsRegistry, port: int) -> None:
+        self.registry = registry
+
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path == "/metrics":
+                    body = registry_.to_prometheus().encode()
+                    content_type = PROMETHEUS_CONTENT_TYPE
+                elif self.path == "/stats.json":
+                    body = json.dumps(registry_.to_dict()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                # Scrapes would otherwise be logged amongst the trade summaries
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="metrics-server", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class StatsFileWriter:
+    """Rewrites a JSON file of the metrics every `interval` seconds"""
+
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float) -> None:
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="metrics-file", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop, writing the metrics one last time"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+    def write(self) -> None:
+        # Swapped in whole so readers never see a half written file
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as stats_file:
+            json.dump(self.registry.to_dict(), stats_file, indent=2)
+        os.replace(temp_path, self.path)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except Exception:
+                print(f"Failed to write {self.path}:\n{traceback.format_exc()}")
+                sys.stdout.flush()
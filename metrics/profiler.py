@@ -0,0 +1,88 @@
+import cProfile
+import io
+import pstats
+import threading
+
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+# How many of the slowest functions are printed when profiling stops
+PRINTED_FUNCTIONS = 25
+
+
+class SampledProfiler:
+    """
+    Profiles one in every `sample_every` calls made through `run`, while
+    switched on with `toggle`.
+
+    Only one call is profiled at a time, so a call made on another thread while
+    one is being profiled is just run. When switched off the profile gathered
+    is saved to `output_file`, for `pstats` or `snakeviz`, and the functions
+    taking the most time are printed.
+    """
+
+    def __init__(self, sample_every: int, output_file: str) -> None:
+        self.sample_every = max(1, sample_every)
+        self.output_file = output_file
+        self.enabled = False
+        self._profile = cProfile.Profile()
+        self._calls = 0
+        self._sampled = 0
+        self._running = threading.Lock()
+        self._dump_pending = False
+
+    def toggle(self, sig=None, frame=None) -> None:
+        """Switch profiling on or off, usable as a signal handler"""
+        if not self.enabled:
+            self._profile = cProfile.Profile()
+            self._calls = 0
+            self._sampled = 0
+            self.enabled = True
+            print(f"Profiling one in every {self.sample_every} messages...")
+            return
+
+        self.enabled = False
+        if not self._running.acquire(False):
+            # This may be interrupting the call being profiled, on this very
+            # thread, so leave the call to dump the profile when it's done
+            self._dump_pending = True
+            return
+        try:
+            self._dump()
+        finally:
+            self._running.release()
+
+    def _dump(self) -> None:
+        self._dump_pending = False
+        if not self._sampled:
+            print("Profiling stopped before any messages were profiled")
+            return
+        self._profile.dump_stats(self.output_file)
+        printed = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=printed)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PRINTED_FUNCTIONS)
+        print(
+            f"Profiled {self._sampled} messages, saved to {self.output_file}\n"
+            f"{printed.getvalue()}"
+        )
+
+    def run(self, function: Callable[..., T], *args) -> T:
+        if not self.enabled:
+            return function(*args)
+        self._calls += 1
+        if self._calls % self.sample_every or not self._running.acquire(False):
+            return function(*args)
+        try:
+            if not self.enabled:
+                return function(*args)
+            self._sampled += 1
+            return self._profile.runcall(function, *args)
+        finally:
+            if self._dump_pending:
+                self._dump()
+            self._running.release()
+
+    def wrap(self, function: Callable[..., T]) -> Callable[..., T]:
+        """`function`, called through `run`"""
+        return lambda *args: self.run(function, *args)
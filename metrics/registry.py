@@ -0,0 +1,257 @@
+import threading
+
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# Upper bounds, in seconds, of the buckets stage timings are counted in
+DEFAULT_BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+class Counter:
+    """A count that only goes up, kept per set of label values"""
+
+    kind = COUNTER
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge:
+    """
+    A value read when the metrics are collected, from a callback returning the
+    value for each set of label values. Counts kept elsewhere can be exposed
+    this way too, with a `kind` of counter.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], Dict[LabelValues, float]],
+        labels: Iterable[str] = (),
+        kind: str = GAUGE,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.kind = kind
+        self._read = read
+
+    def samples(self) -> Dict[LabelValues, float]:
+        return self._read()
+
+
+class HistogramValues:
+    """The bucket counts of one set of label values of a histogram"""
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        # The last count is of everything over the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def quantile(self, fraction: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Histogram:
+    """Counts of observed values, in buckets, per set of label values"""
+
+    kind = HISTOGRAM
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Iterable[str] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values: Dict[LabelValues, HistogramValues] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                values = self._values[label_values] = HistogramValues(self.buckets)
+            values.counts[index] += 1
+            values.count += 1
+            values.sum += value
+
+    def samples(self) -> Dict[LabelValues, HistogramValues]:
+        with self._lock:
+            copies = {}
+            for label_values, values in self._values.items():
+                copy = HistogramValues(self.buckets)
+                copy.counts = list(values.counts)
+                copy.count = values.count
+                copy.sum = values.sum
+                copies[label_values] = copy
+            return copies
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class MetricsRegistry:
+    """
+    Every metric the slurper keeps, for exporting in the Prometheus text format
+    or as JSON. Metrics are registered once by name, and registering the same
+    name again returns the metric already registered.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], Dict[LabelValues, float]],
+        labels: Iterable[str] = (),
+        kind: str = GAUGE,
+    ) -> Gauge:
+        return self._register(Gauge(name, help, read, labels, kind))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Iterable[str] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def metrics(self) -> List[Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for label_values, value in _sorted_samples(metric):
+                labels = list(zip(metric.labels, label_values))
+                if metric.kind != HISTOGRAM:
+                    lines.append(
+                        f"{metric.name}{_label_str(labels)} {_number_str(value)}"
+                    )
+                    continue
+                cumulative = 0
+                for bound, count in zip(value.buckets, value.counts):
+                    cumulative += count
+                    bucket_labels = _label_str(labels + [("le", _number_str(bound))])
+                    lines.append(f"{metric.name}_bucket{bucket_labels} {cumulative}")
+                bucket_labels = _label_str(labels + [("le", "+Inf")])
+                lines.append(f"{metric.name}_bucket{bucket_labels} {value.count}")
+                lines.append(
+                    f"{metric.name}_sum{_label_str(labels)} {_number_str(value.sum)}"
+                )
+                lines.append(f"{metric.name}_count{_label_str(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict[str, Dict[str, object]]:
+        """
+        Every metric's values keyed by their label values joined with commas.
+        Histograms are summarised by their count, mean and estimated quantiles.
+        """
+        stats = {}
+        for metric in self.metrics():
+            values = {}
+            for label_values, value in _sorted_samples(metric):
+                key = ",".join(label_values)
+                if metric.kind != HISTOGRAM:
+                    values[key] = value
+                    continue
+                values[key] = {
+                    "count": value.count,
+                    "mean_ms": round(1000 * value.sum / (value.count or 1), 3),
+                    "p50_ms": round(1000 * value.quantile(0.5), 3),
+                    "p99_ms": round(1000 * value.quantile(0.99), 3),
+                }
+            stats[metric.name] = values
+        return stats
+
+
+def _sorted_samples(metric: Metric) -> List[Tuple[LabelValues, object]]:
+    return sorted(metric.samples().items(), key=lambda sample: sample[0])
+
+
+def _number_str(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _label_str(labels: List[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
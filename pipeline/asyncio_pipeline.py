@@ -0,0 +1,222 @@
+import asyncio
+import signal
+import sys
+import traceback
+import zmq
+import zmq.asyncio
+
+from collections import deque
+from time import monotonic
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from config.model import AsyncioConfig
+from eddn.connection.multi_relay import Relay, RelayGroup
+from eddn.connection.recording import FrameRecorder, read_frames
+
+# How many frames are replayed at full speed before letting other tasks run
+REPLAY_BATCH = 100
+
+# A frame as received, and its message if already decompressed
+Frame = Tuple[bytes, Optional[bytes]]
+
+
+class AsyncRelayGroup(RelayGroup):
+    """
+    The frames of each relay as a source for `AsyncPipeline`, read with
+    `zmq.asyncio` sockets, but backed off, deduplicated and counted just as
+    `MultiRelayListener` does. Each frame comes with its message decompressed.
+    """
+
+    def sources(self) -> List[AsyncIterator[Frame]]:
+        return [self._frames(relay) for relay in self.relays]
+
+    async def _frames(self, relay: Relay) -> AsyncIterator[Frame]:
+        context = zmq.asyncio.Context.instance()
+        while True:
+            subscriber = context.socket(zmq.SUB)
+            subscriber.setsockopt(zmq.SUBSCRIBE, b"")
+            subscriber.setsockopt(zmq.LINGER, 0)
+            try:
+                subscriber.connect(relay.url)
+                while True:
+                    frame = await asyncio.wait_for(
+                        subscriber.recv(), self.timeout / 1000
+                    )
+                    message = self._accept(relay, frame, monotonic())
+                    if message is not None:
+                        yield frame, message
+            except asyncio.TimeoutError:
+                reason = "has gone quiet"
+            except zmq.ZMQError as e:
+                reason = f"failed: {e}"
+            finally:
+                subscriber.close()
+            await asyncio.sleep(self._back_off(relay, monotonic(), reason))
+
+
+async def replay_frames(path: str, speed: Optional[float]) -> AsyncIterator[Frame]:
+    """
+    The frames of a recording, spaced out as received but `speed` times faster,
+    or as fast as they're taken without a speed. They're left compressed.
+    """
+    started = monotonic()
+    first_received = None
+    for count, (received, frame) in enumerate(read_frames(path)):
+        if speed:
+            if first_received is None:
+                first_received = received
+            due = started + (received - first_received) / speed
+            await asyncio.sleep(max(0.0, due - monotonic()))
+        elif count % REPLAY_BATCH == 0:
+            await asyncio.sleep(0)
+        yield frame, None
+
+
+class AsyncPipeline:
+    """
+    Runs the slurper as cooperating tasks on one event loop.
+
+    A task per source of frames puts them on a queue, which a decode task takes
+    them from in order, decoding on worker threads so the loop stays
+    responsive, with up to `config.decode_concurrency` decodes at once. An
+    apply task feeds the decoded messages to `apply`, on the loop, in the
+    order received. Rendering and saving run on timers of their own, rather
+    than after a count of messages.
+
+    SIGINT cancels the sources, and whatever is already queued is decoded and
+    applied before `run` returns. It also returns once every source runs out,
+    as a replay does.
+    """
+
+    def __init__(
+        self,
+        config: AsyncioConfig,
+        sources: List[AsyncIterator[Frame]],
+        decode: Callable[[bytes, Optional[bytes]], Any],
+        apply: Callable[[Any], None],
+        render: Callable[[], None],
+        save: Callable[[], None],
+        recorder: Optional[FrameRecorder] = None,
+    ) -> None:
+        self.config = config
+        self.sources = sources
+        self._decode = decode
+        self._apply = apply
+        self._render = render
+        self._save = save
+        # Keeps a copy of every frame received, for replaying later
+        self.recorder = recorder
+
+        self.received = 0
+        self.applied = 0
+        self._rendered_at = 0
+        self._frames: Optional[asyncio.Queue] = None
+        self._decoded: Optional[asyncio.Queue] = None
+
+    def get_depths(self) -> Dict[str, int]:
+        return {
+            "frames": self._frames.qsize() if self._frames else 0,
+            "decoded": self._decoded.qsize() if self._decoded else 0,
+        }
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._frames = asyncio.Queue(maxsize=self.config.queue_size)
+        self._decoded = asyncio.Queue(maxsize=self.config.queue_size)
+
+        receivers = [
+            asyncio.create_task(self._receive(source)) for source in self.sources
+        ]
+        decoder = asyncio.create_task(self._decode_loop())
+        applier = asyncio.create_task(self._apply_loop())
+        timers = [
+            asyncio.create_task(self._every(self.config.render_interval, self._tick)),
+            asyncio.create_task(
+                self._every(self.config.save_check_interval, self._save)
+            ),
+        ]
+
+        def stop() -> None:
+            for receiver in receivers:
+                receiver.cancel()
+
+        try:
+            loop.add_signal_handler(signal.SIGINT, stop)
+        except NotImplementedError:  # Not available on Windows
+            signal.signal(signal.SIGINT, lambda *_: loop.call_soon_threadsafe(stop))
+
+        try:
+            await asyncio.gather(*receivers, return_exceptions=True)
+            # Let everything already received through before stopping
+            await self._frames.put(None)
+            await decoder
+            await applier
+        finally:
+            for timer in timers:
+                timer.cancel()
+            await asyncio.gather(*timers, return_exceptions=True)
+            try:
+                loop.remove_signal_handler(signal.SIGINT)
+            except NotImplementedError:
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    async def _receive(self, source: AsyncIterator[Frame]) -> None:
+        async for frame, message in source:
+            if self.recorder:
+                self.recorder.write(frame)
+            self.received += 1
+            await self._frames.put((frame, message))
+
+    async def _decode_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        # Decodes in flight, passed on in the order the frames came
+        pending: Deque[asyncio.Future] = deque()
+        while True:
+            # Wait on the oldest decode once at the limit, or with nothing to add
+            if pending and (
+                len(pending) >= self.config.decode_concurrency or self._frames.empty()
+            ):
+                await self._pass_on(pending.popleft())
+                continue
+            taken = await self._frames.get()
+            if taken is None:
+                break
+            pending.append(loop.run_in_executor(None, self._decode, *taken))
+        while pending:
+            await self._pass_on(pending.popleft())
+        await self._decoded.put(None)
+
+    async def _pass_on(self, decoding: asyncio.Future) -> None:
+        try:
+            decoded = await decoding
+        except Exception:
+            print(f"Failed to decode message:\n{traceback.format_exc()}")
+            sys.stdout.flush()
+            return
+        await self._decoded.put(decoded)
+
+    async def _apply_loop(self) -> None:
+        while (decoded := await self._decoded.get()) is not None:
+            try:
+                self._apply(decoded)
+            except Exception:
+                print(f"Failed to apply message:\n{traceback.format_exc()}")
+                sys.stdout.flush()
+            self.applied += 1
+            # Give the timers a look in when messages are arriving steadily
+            await asyncio.sleep(0)
+
+    def _tick(self) -> None:
+        """Render, unless nothing has changed since the last time"""
+        if self.applied != self._rendered_at:
+            self._rendered_at = self.applied
+            self._render()
+
+    async def _every(self, seconds: float, action: Callable[[], None]) -> None:
+        while True:
+            await asyncio.sleep(seconds)
+            try:
+                action()
+            except Exception:
+                print(f"Failed in timed task:\n{traceback.format_exc()}")
+                sys.stdout.flush()
@@ -0,0 +1,90 @@
+import threading
+
+from collections import deque
+from time import monotonic
+from typing import Any, Deque, Optional
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+OVERFLOW_POLICIES = [BLOCK, DROP_OLDEST, DROP_NEWEST]
+
+
+class BoundedQueue:
+    """
+    A thread safe FIFO with a fixed capacity.
+    When full, `overflow_policy` decides whether the producer waits for space,
+    the oldest queued item is discarded, or the new item is discarded.
+    """
+
+    def __init__(self, capacity: int, overflow_policy: str) -> None:
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.capacity = max(1, capacity)
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self.max_depth = 0
+
+        self._items: Deque[Any] = deque()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put(self, item: Any) -> bool:
+        """Queues the item and returns false if it was dropped instead"""
+        with self._lock:
+            if self._closed:
+                return False
+
+            if len(self._items) >= self.capacity:
+                if self.overflow_policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif self.overflow_policy == DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._items) >= self.capacity and not self._closed:
+                        self._not_full.wait()
+                    if self._closed:
+                        return False
+
+            self._items.append(item)
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._not_empty.notify()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Any]:
+        """
+        Returns the next item, waiting up to `timeout` seconds for one.
+        Returns None on timeout, or once the queue is closed and drained.
+        """
+        with self._lock:
+            deadline = None if timeout is None else monotonic() + timeout
+            while not self._items and not self._closed:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._not_empty.wait(remaining)
+
+            if not self._items:
+                return None
+
+            item = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    def close(self) -> None:
+        """Stop accepting items, wake any waiters; queued items can still be taken"""
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
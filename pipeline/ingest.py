@@ -0,0 +1,187 @@
+import heapq
+import sys
+import threading
+import traceback
+
+from time import monotonic, perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config.model import IngestConfig
+from pipeline.bounded_queue import BoundedQueue
+from pipeline.stats import StageStats
+
+# How long the applier waits for a message before calling `idle`
+IDLE_SECONDS = 1.0
+
+
+class IngestPipeline:
+    """
+    Moves message processing off the thread that owns the EDDN socket.
+
+    `put` only queues the raw frame, so the receiving thread never waits on
+    processing (unless the overflow policy is "block"). A pool of decode workers
+    turns frames into decoded messages, and a single applier thread feeds them
+    to `apply` in the order they were received, so all summary state is still
+    only ever touched by one thread. That thread also calls `idle` whenever it
+    has been waiting on messages for a while.
+    """
+
+    def __init__(
+        self,
+        config: IngestConfig,
+        decode: Callable[[bytes, Optional[bytes]], Any],
+        apply: Callable[[Any], None],
+        idle: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.config = config
+        self._decode = decode
+        self._apply = apply
+        self._idle = idle
+
+        self._raw = BoundedQueue(
+            capacity=self.config.queue_size,
+            overflow_policy=self.config.overflow_policy,
+        )
+        self._take_lock = threading.Lock()
+        self._next_take = 0
+
+        # Decoded messages waiting for the applier, ordered by receive sequence
+        self._decoded: List[Tuple[int, float, Any]] = []
+        self._decoded_cond = threading.Condition()
+        self._next_apply = 0
+        self._decoding_done = False
+
+        self.receive_stats = StageStats("receive")
+        self.decode_stats = StageStats("decode")
+        self.apply_stats = StageStats("apply")
+
+        self._workers: List[threading.Thread] = []
+        self._applier: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        for n in range(max(1, self.config.decode_workers)):
+            worker = threading.Thread(
+                target=self._decode_loop, name=f"eddn-decode-{n}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+        self._applier = threading.Thread(
+            target=self._apply_loop, name="eddn-apply", daemon=True
+        )
+        self._applier.start()
+
+    def put(self, message: bytes, decompressed: Optional[bytes] = None) -> None:
+        """Listener callback: queue the raw frame and return straight away"""
+        started = perf_counter()
+        if self._raw.put((monotonic(), message, decompressed)):
+            self.receive_stats.record(perf_counter() - started)
+        else:
+            self.receive_stats.record_error()
+        self.receive_stats.set_depth(len(self._raw))
+
+    def stop(self) -> None:
+        """Stop taking frames, then finish processing everything already queued"""
+        self._raw.close()
+        for worker in self._workers:
+            worker.join()
+        with self._decoded_cond:
+            self._decoding_done = True
+            self._decoded_cond.notify_all()
+        if self._applier:
+            self._applier.join()
+
+    def _take(self) -> Optional[Tuple[int, float, bytes, Optional[bytes]]]:
+        # Sequence numbers are handed out in queue order so the applier can
+        # restore that order after the workers finish out of step
+        with self._take_lock:
+            item = self._raw.get()
+            if item is None:
+                return None
+            sequence = self._next_take
+            self._next_take += 1
+        return (sequence, *item)
+
+    def _decode_loop(self) -> None:
+        while taken := self._take():
+            sequence, queued_at, message, decompressed = taken
+            self.receive_stats.set_depth(len(self._raw))
+
+            started = perf_counter()
+            try:
+                decoded = self._decode(message, decompressed)
+            except Exception:
+                self.decode_stats.record_error()
+                print(f"Failed to decode message:\n{traceback.format_exc()}")
+                sys.stdout.flush()
+                decoded = None
+            self.decode_stats.record(
+                seconds=perf_counter() - started,
+                wait_seconds=monotonic() - queued_at,
+            )
+            self._hand_to_applier(sequence, decoded)
+
+    def _hand_to_applier(self, sequence: int, decoded: Any) -> None:
+        with self._decoded_cond:
+            # Hold back when the applier is behind, unless this is the message
+            # it is waiting for
+            while (
+                len(self._decoded) >= self._raw.capacity
+                and sequence != self._next_apply
+            ):
+                self._decoded_cond.wait()
+            heapq.heappush(self._decoded, (sequence, monotonic(), decoded))
+            self.decode_stats.set_depth(len(self._decoded))
+            self._decoded_cond.notify_all()
+
+    def _is_next_ready(self) -> bool:
+        return bool(self._decoded) and self._decoded[0][0] == self._next_apply
+
+    def _apply_loop(self) -> None:
+        while True:
+            with self._decoded_cond:
+                if not self._is_next_ready():
+                    if self._decoding_done and not self._decoded:
+                        return
+                    self._decoded_cond.wait(IDLE_SECONDS)
+                ready = self._is_next_ready()
+                if ready:
+                    _, decoded_at, decoded = heapq.heappop(self._decoded)
+                    self._next_apply += 1
+                    self.decode_stats.set_depth(len(self._decoded))
+                    self._decoded_cond.notify_all()
+
+            if not ready:
+                if self._idle:
+                    self._run_idle()
+                continue
+
+            if decoded is None:
+                continue
+
+            started = perf_counter()
+            try:
+                self._apply(decoded)
+            except Exception:
+                self.apply_stats.record_error()
+                print(f"Failed to apply message:\n{traceback.format_exc()}")
+                sys.stdout.flush()
+            self.apply_stats.record(
+                seconds=perf_counter() - started,
+                wait_seconds=monotonic() - decoded_at,
+            )
+
+    def _run_idle(self) -> None:
+        try:
+            self._idle()
+        except Exception:
+            print(f"Failed while idle:\n{traceback.format_exc()}")
+            sys.stdout.flush()
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        stats = {
+            stage.name: stage.summary()
+            for stage in (self.receive_stats, self.decode_stats, self.apply_stats)
+        }
+        stats["receive"]["dropped"] = self._raw.dropped
+        stats["receive"]["max_depth"] = self._raw.max_depth
+        return stats
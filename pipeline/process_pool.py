@@ -0,0 +1,217 @@
+import multiprocessing
+import os
+import sys
+import threading
+import traceback
+
+from collections import deque
+from multiprocessing.pool import AsyncResult
+from time import monotonic, perf_counter
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from config.model import IngestConfig
+from eddn.compact import from_record, to_record
+from eddn.decoder import MessageDecoder
+from pipeline.bounded_queue import BLOCK, DROP_OLDEST
+from pipeline.stats import StageStats
+
+# How long the applier waits for a message before calling `idle`
+IDLE_SECONDS = 1.0
+
+# Frames sent to the pool at a time for each worker, enough to keep them busy
+IN_FLIGHT_PER_PROCESS = 2
+
+# The decoder of each worker process
+_decoder: Optional[MessageDecoder] = None
+
+
+def _start_worker(fast: bool) -> None:
+    global _decoder
+    _decoder = MessageDecoder(fast=fast)
+
+
+def _decode(message: bytes) -> Tuple[Tuple, float]:
+    started = perf_counter()
+    record = to_record(_decoder.decode(message))
+    return record, perf_counter() - started
+
+
+def _ready(_: int) -> None:
+    pass
+
+
+class ProcessPoolPipeline:
+    """
+    Decodes messages in a pool of `config.decode_processes` worker processes,
+    so decoding isn't held to the one core the GIL allows.
+
+    `put` queues each raw frame, and only a few per worker are sent to the
+    pool at a time. The decoded messages come back as compact records, and a
+    single applier thread rebuilds them and feeds them to `apply` in the order
+    they were received, so each market's messages are applied in order and
+    all summary state is still only ever touched by one thread. Up to
+    `config.queue_size` frames can be waiting to be sent, beyond which
+    `config.overflow_policy` applies, so frames dropped are never decoded.
+
+    Sending frames to other processes and results back costs more than the
+    decoding saves in most cases, so more processes than CPUs are refused.
+    """
+
+    def __init__(
+        self,
+        config: IngestConfig,
+        fast: bool,
+        apply: Callable[[Any], None],
+        idle: Optional[Callable[[], None]] = None,
+    ) -> None:
+        cpus = os.cpu_count() or 1
+        if config.decode_processes > cpus:
+            raise ValueError(
+                f"ingest.decode_processes is {config.decode_processes},"
+                f" but there are only {cpus} CPUs"
+            )
+        self.config = config
+        self.fast = fast
+        self._apply = apply
+        self._idle = idle
+        self.capacity = max(1, self.config.queue_size)
+        self.processes = max(1, self.config.decode_processes)
+        self.dropped = 0
+
+        # Frames not sent to the pool yet, then those sent, in receive order
+        self._waiting: Deque[Tuple[float, bytes]] = deque()
+        self._pending: Deque[Tuple[float, AsyncResult]] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.receive_stats = StageStats("receive")
+        self.decode_stats = StageStats("decode")
+        self.apply_stats = StageStats("apply")
+
+        self._pool = None
+        self._applier: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the workers, returning once they're ready for messages"""
+        # Workers are started afresh rather than forked, as forking a process
+        # with threads and sockets already running isn't safe
+        self._pool = multiprocessing.get_context("spawn").Pool(
+            processes=self.processes, initializer=_start_worker, initargs=(self.fast,)
+        )
+        self._pool.map(_ready, range(self.processes), chunksize=1)
+        self._applier = threading.Thread(
+            target=self._apply_loop, name="eddn-apply", daemon=True
+        )
+        self._applier.start()
+
+    def put(self, message: bytes, decompressed: Optional[bytes] = None) -> None:
+        """
+        Listener callback: queue the raw frame for the pool and return. Only
+        the compressed frame is sent, as it's several times smaller to pass to
+        a worker than the message the listener decompressed.
+        """
+        started = perf_counter()
+        with self._cond:
+            while len(self._waiting) >= self.capacity and not self._closed:
+                if self.config.overflow_policy == BLOCK:
+                    self._cond.wait()
+                    continue
+                self.dropped += 1
+                self.receive_stats.record_error()
+                if self.config.overflow_policy != DROP_OLDEST:
+                    return
+                self._waiting.popleft()
+            if self._closed:
+                return
+            self._waiting.append((monotonic(), message))
+            self._send()
+            self._cond.notify_all()
+        self.receive_stats.record(perf_counter() - started)
+
+    def _send(self) -> None:
+        """Send waiting frames to the pool, up to a few per worker at a time"""
+        while self._waiting and len(self._pending) < (
+            self.processes * IN_FLIGHT_PER_PROCESS
+        ):
+            queued_at, message = self._waiting.popleft()
+            result = self._pool.apply_async(_decode, (message,))
+            self._pending.append((queued_at, result))
+        self.receive_stats.set_depth(len(self._waiting) + len(self._pending))
+
+    def stop(self) -> None:
+        """Stop taking frames, then finish processing everything already sent"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._applier:
+            self._applier.join()
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+
+    def _next(self) -> Optional[Tuple[float, AsyncResult]]:
+        """The oldest message sent, waiting a while for one if there are none"""
+        with self._cond:
+            if not self._pending and not self._closed:
+                self._cond.wait(IDLE_SECONDS)
+            if self._pending:
+                return self._pending[0]
+            return None
+
+    def _apply_loop(self) -> None:
+        while True:
+            head = self._next()
+            if head is None:
+                with self._cond:
+                    if self._closed and not self._pending:
+                        return
+                self._run_idle()
+                continue
+
+            queued_at, result = head
+            result.wait(IDLE_SECONDS)
+            if not result.ready():
+                self._run_idle()
+                continue
+
+            with self._cond:
+                self._pending.popleft()
+                self._send()
+                self._cond.notify_all()
+
+            try:
+                record, seconds = result.get()
+            except Exception:
+                self.decode_stats.record_error()
+                print(f"Failed to decode message:\n{traceback.format_exc()}")
+                sys.stdout.flush()
+                continue
+            self.decode_stats.record(
+                seconds=seconds, wait_seconds=monotonic() - queued_at
+            )
+
+            started = perf_counter()
+            try:
+                self._apply(from_record(record))
+            except Exception:
+                self.apply_stats.record_error()
+                print(f"Failed to apply message:\n{traceback.format_exc()}")
+                sys.stdout.flush()
+            self.apply_stats.record(seconds=perf_counter() - started)
+
+    def _run_idle(self) -> None:
+        if not self._idle:
+            return
+        try:
+            self._idle()
+        except Exception:
+            print(f"Failed while idle:\n{traceback.format_exc()}")
+            sys.stdout.flush()
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        stats = {
+            stage.name: stage.summary()
+            for stage in (self.receive_stats, self.decode_stats, self.apply_stats)
+        }
+        stats["receive"]["dropped"] = self.dropped
+        return stats
@@ -0,0 +1,51 @@
+import threading
+
+from typing import Dict
+
+
+class StageStats:
+    """Thread safe counters for one stage of the message pipeline"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.depth = 0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, wait_seconds: float = 0.0) -> None:
+        """Record one item handled in `seconds` after waiting `wait_seconds` for it"""
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def set_depth(self, depth: int) -> None:
+        with self._lock:
+            self.depth = depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            count = self.count or 1
+            return {
+                "count": self.count,
+                "errors": self.errors,
+                "mean_ms": round(1000 * self.total_seconds / count, 3),
+                "max_ms": round(1000 * self.max_seconds, 3),
+                "mean_wait_ms": round(1000 * self.total_wait_seconds / count, 3),
+                "max_wait_ms": round(1000 * self.max_wait_seconds, 3),
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+            }
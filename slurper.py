@@ -1,21 +1,52 @@
+import asyncio
 import signal
-import simplejson
-import zlib
+import threading
 
 from sys import stdout
+from time import perf_counter
+from typing import Callable, Dict, Optional, Tuple
 
-from config import config
+from config import args, config
 from eddn.commodity_v3.model import CommodityV3
-from eddn.commodity_v3.schema import CommodityV3Schema
-from eddn.connection.eddn import EddnListener
+from eddn.connection.dedupe import DedupeCache
+from eddn.connection.multi_relay import MultiRelayListener
+from eddn.connection.recording import FrameRecorder
+from eddn.connection.replay import FrameReplayer
+from eddn.decoder import WANTED_JOURNAL_EVENTS, DecodedMessage, MessageDecoder
 from eddn.journal_v1.model import JournalV1
-from eddn.journal_v1.schema import JournalV1Schema
-from summary.stock_handler import storage as commodity_storage
+from metrics.exporter import MetricsServer, StatsFileWriter
+from metrics.profiler import SampledProfiler
+from metrics.registry import COUNTER, Counter, MetricsRegistry
+from pipeline.asyncio_pipeline import (
+    AsyncPipeline,
+    AsyncRelayGroup,
+    replay_frames,
+)
+from pipeline.ingest import IngestPipeline
+from pipeline.process_pool import ProcessPoolPipeline
 from summary.stock_handler.commodity_v3 import StockHandler
-from summary.dock_handler import storage as journal_storage
+from summary.stock_handler.market_store import MarketStore
 from summary.dock_handler.journal_v1 import DockHandler
 from summary.model import DockSummary, StockSummary
 from summary.output_handler.cmd_line import Output as CmdLineOutput
+from summary.output_handler.query_api import QueryApi, QueryServer
+from summary.output_handler.state_export import StateExport
+from summary.price_history import PriceHistory
+from summary.route_engine import RouteEngine
+from summary.save_scheduler import SaveScheduler
+from summary.store import JsonStore, create_store
+
+FAST_DECODER = "fast"
+
+DOCKS = "docks"
+STOCKS = "stocks"
+
+# The stages each message goes through after decoding, as timed in
+# `slurper_stage_seconds` alongside the decoding stages
+DOCK_UPDATE = "dock_update"
+STOCK_UPDATE = "stock_update"
+SAVE = "save"
+RENDER = "render"
 
 
 class Slurper:
@@ -24,49 +55,119 @@ class Slurper:
         journal_summary: DockSummary,
         commodity_summary: StockSummary,
         print_wait: int,
+        store: JsonStore,
     ):
 
+        self.store = store
+        self.save_scheduler = SaveScheduler(config.autosave)
         self.dock_handler = DockHandler(config=config.dock, target=journal_summary)
+        market_store = None
+        if config.markets and config.markets.enabled:
+            market_store = MarketStore(config.markets, config.stock)
+        price_history = None
+        if config.history and config.history.enabled:
+            price_history = PriceHistory(config.history)
         self.stock_handler = StockHandler(
             config=config.stock,
             target=commodity_summary,
             dock_handler=self.dock_handler,
+            market_store=market_store,
+            price_history=price_history,
+        )
+        self.route_engine = RouteEngine(config.routes, self.stock_handler)
+        self.print_handler = CmdLineOutput(
+            config.cmd_line,
+            self.stock_handler.trade_index,
+            self.dock_handler.spatial_index,
         )
-        self.print_handler = CmdLineOutput(config.cmd_line, commodity_summary)
         self._print_wait = print_wait
         self.print_counter = self._print_wait
+        # Held while the summaries change, so other threads can read them whole
+        self.state_lock = threading.RLock()
 
         print(
             f"Journal loaded with {len(journal_summary.stations)} stations\n"
             f"Stock list loaded with {len(commodity_summary.commodities)} commodities"
         )
 
-        self.commodity_v3_schema = CommodityV3Schema()
-        self.journal_v1_schema = JournalV1Schema()
-        self._setup_dev_analysis()
+        self.decoder = MessageDecoder(
+            fast=config.decoder == FAST_DECODER, time_stage=self._time_stage
+        )
+        self.peek_filter = self.decoder.peek_filter
+        self.metrics = MetricsRegistry()
+        self._setup_metrics()
 
     def get_highest_trade_diffs_str(self) -> str:
-        return self.print_handler.get_highest_trade_diffs_str()
-
-    def handle_eddn_message(self, message: str) -> None:
+        started = perf_counter()
+        trade_diffs = self.print_handler.get_highest_trade_diffs_str()
+        self._time_stage(RENDER, started)
+        return trade_diffs
+
+    def handle_eddn_message(
+        self, message: bytes, decompressed: Optional[bytes] = None
+    ) -> None:
         """
         This function is called by the EDDN listener for each message received.
         This could be considered to be the main-loop
         """
-        message = zlib.decompress(message)
-        json = simplejson.loads(message)
+        self.apply_eddn_message(self.decode_eddn_message(message, decompressed))
 
-        # Handle schemas
-        schema_name = json["$schemaRef"]
-        self._update_dev_analysis_received_schemas(schema_name)
+    def decode_eddn_message(
+        self, message: bytes, decompressed: Optional[bytes] = None
+    ) -> DecodedMessage:
+        """
+        Decompress, parse and validate a raw EDDN message, unless the listener
+        has already decompressed it.
+        This touches no summary state, so can be run on any thread.
+        """
+        return self.decoder.decode(message, decompressed)
 
-        if schema_name == "https://eddn.edcd.io/schemas/commodity/3":
-            self._handle_commodity_v3(json=json)
-        if schema_name == "https://eddn.edcd.io/schemas/journal/1":
-            self._handle_journal_v1(json=json)
+    def parse_eddn_json(self, message: bytes) -> dict:
+        return self.decoder.parse_json(message)
 
+    def validate_eddn_json(self, json: dict) -> DecodedMessage:
+        return self.decoder.validate_json(json)
+
+    def apply_eddn_message(self, decoded: DecodedMessage) -> None:
+        """
+        Update the summaries from a decoded message, then save and print if due.
+        All summary state is owned by whichever single thread calls this.
+        """
+        self.update_summaries(decoded)
+        self.save_when_due()
         self._print_on_messages_counted()
 
+    def update_summaries(self, decoded: DecodedMessage) -> None:
+        """Update the summaries from a decoded message, leaving saving to the caller"""
+        self._received_schemas.inc(str(decoded.schema_name))
+        if decoded.model is None and decoded.event:
+            self._journal_events.inc(decoded.event)
+
+        with self.state_lock:
+            if isinstance(decoded.model, CommodityV3):
+                self._handle_commodity_v3(commodity_v3=decoded.model)
+            if isinstance(decoded.model, JournalV1):
+                self._handle_journal_v1(journal_v1=decoded.model)
+
+    def save_when_due(self) -> None:
+        """
+        Save whatever has changed, if the save scheduler says it's time.
+        Called while idle too, so prices that have gone stale are expired
+        first, even when no market messages are arriving.
+        """
+        with self.state_lock:
+            self.stock_handler.expire_idle()
+            if changes := self.stock_handler.pop_changes():
+                self.store.stocks_changed(self.stock_handler.stock_summary, changes)
+                self.save_scheduler.mark_dirty(STOCKS)
+        for name in self.save_scheduler.due():
+            started = perf_counter()
+            if name == DOCKS:
+                self.store.save_docks(self.dock_handler.journal)
+            if name == STOCKS:
+                self.store.save_stocks(self.stock_handler.stock_summary)
+            self._time_stage(SAVE, started)
+
     def _print_on_messages_counted(self):
         """Print after `_print_wait` messages received"""
         if self.print_counter <= 0:
@@ -76,102 +177,392 @@ class Slurper:
         else:
             self.print_counter -= 1
 
-    def _handle_commodity_v3(self, json: dict) -> CommodityV3:
-        commodity_v3 = self.commodity_v3_schema.load(json)
-        time_to_save = self.stock_handler.update(commodity_v3)
-        if time_to_save:
-            commodity_storage.save(
-                stock_file=config.stock.file_path,
-                summary=self.stock_handler.stock_summary,
-            )
+    def _handle_commodity_v3(self, commodity_v3: CommodityV3) -> CommodityV3:
+        started = perf_counter()
+        self.stock_handler.update(commodity_v3)
+        if self.store.market_received(commodity_v3.message):
+            self.save_scheduler.mark_dirty(STOCKS)
+        if changes := self.stock_handler.pop_changes():
+            self.store.stocks_changed(self.stock_handler.stock_summary, changes)
+            self.save_scheduler.mark_dirty(STOCKS)
+        self._time_stage(STOCK_UPDATE, started)
         return commodity_v3
 
-    def _handle_journal_v1(self, json: dict) -> JournalV1:
-        journal_v1 = self.journal_v1_schema.load(json)
+    def _handle_journal_v1(self, journal_v1: JournalV1) -> JournalV1:
         event = journal_v1.message.event
         station = journal_v1.message.station_name
         station_type = journal_v1.message.station_type or "None"
-        self._update_dev_analysis_journal_events(event=event)
+        self._journal_events.inc(event)
 
         # We only care about ships docking or reporting location at a dock
-        if (event == "Docked" or event == "Location") and station:
-            self._update_dev_analysis_station_types(station_type=station_type)
-
-            time_to_save = self.dock_handler.update(journal_v1)
-            if time_to_save:
-                journal_storage.save(
-                    dock_file=config.dock.file_path,
-                    summary=self.dock_handler.journal,
-                )
+        if event in WANTED_JOURNAL_EVENTS and station:
+            started = perf_counter()
+            self._station_types.inc(station_type)
+
+            self.dock_handler.update(journal_v1)
+            if changes := self.dock_handler.pop_changes():
+                self.store.docks_changed(self.dock_handler.journal, changes)
+                self.save_scheduler.mark_dirty(DOCKS)
+            self._time_stage(DOCK_UPDATE, started)
 
         return journal_v1
 
-    # The dev analysis methods below are probably temporary
-    # Just gathering stats that might be relevant for development
+    def _time_stage(self, stage: str, started: float) -> float:
+        """Record a stage as having run from `started` until now, returning now"""
+        now = perf_counter()
+        self._stage_seconds.observe(now - started, stage)
+        return now
+
+    def _setup_metrics(self) -> None:
+        self._stage_seconds = self.metrics.histogram(
+            "slurper_stage_seconds",
+            "Time taken by each stage of handling a message",
+            labels=["stage"],
+        )
+        self._received_schemas = self.metrics.counter(
+            "slurper_messages_total", "Messages received", labels=["schema"]
+        )
+        self._journal_events = self.metrics.counter(
+            "slurper_journal_events_total",
+            "Journal messages received",
+            labels=["event"],
+        )
+        self._station_types = self.metrics.counter(
+            "slurper_station_types_total",
+            "Docks reported at",
+            labels=["station_type"],
+        )
+        self.metrics.gauge(
+            "slurper_skipped_messages_total",
+            "Messages skipped without being parsed",
+            lambda: _by_label(self.peek_filter.get_stats()["skipped_messages"]),
+            labels=["schema"],
+            kind=COUNTER,
+        )
+        self.metrics.gauge(
+            "slurper_skipped_bytes_total",
+            "Bytes of the messages skipped without being parsed",
+            lambda: _by_label(self.peek_filter.get_stats()["skipped_bytes"]),
+            labels=["schema"],
+            kind=COUNTER,
+        )
+        self.metrics.gauge(
+            "slurper_station_verdicts",
+            "Station check cache hits and misses, and markets cached",
+            lambda: _by_label(self.stock_handler.get_verdict_stats()),
+            labels=["result"],
+        )
+        register_stats(
+            self.metrics,
+            "slurper_store",
+            "Saves of each file, from the store's stats",
+            "file",
+            self.store.get_stats,
+        )
 
-    def _setup_dev_analysis(self):
-        self._received_schemas = {}
-        self._journal_events = {}
-        self._station_types = {}
+    def get_dev_analysis(self) -> dict:
+        return {
+            "received_schemas": _counts(self._received_schemas),
+            "journal_events": _counts(self._journal_events),
+            "station_types": _counts(self._station_types),
+            **self.peek_filter.get_stats(),
+            "station_verdicts": self.stock_handler.get_verdict_stats(),
+            "stages": self.metrics.to_dict()["slurper_stage_seconds"],
+        }
 
-    def _update_dev_analysis_journal_events(self, event: str):
-        if event in self._journal_events:
-            self._journal_events[event] += 1
-        else:
-            self._journal_events[event] = 1
 
-    def _update_dev_analysis_station_types(self, station_type: str):
-        if station_type in self._station_types:
-            self._station_types[station_type] += 1
-        else:
-            self._station_types[station_type] = 1
+def _counts(counter: Counter) -> Dict[str, int]:
+    return {labels[0]: int(count) for labels, count in counter.samples().items()}
 
-    def _update_dev_analysis_received_schemas(self, schema_name: str):
-        if schema_name in self._received_schemas:
-            self._received_schemas[schema_name] += 1
-        else:
-            self._received_schemas[schema_name] = 1
 
-    def get_dev_analysis(self) -> dict:
+def _by_label(values: Dict[str, float]) -> Dict[Tuple[str], float]:
+    return {(str(label),): value for label, value in values.items()}
+
+
+def register_stats(
+    registry: MetricsRegistry,
+    name: str,
+    help: str,
+    label: str,
+    read: Callable[[], Dict[str, Dict[str, float]]],
+) -> None:
+    """
+    Expose a `get_stats` style dict, of the stats kept for each thing, as a
+    gauge labelled by the thing and the name of the stat
+    """
+
+    def samples() -> Dict[Tuple[str, str], float]:
         return {
-            "received_schemas": self._received_schemas,
-            "journal_events": self._journal_events,
-            "station_types": self._station_types,
+            (str(key), stat): value
+            for key, stats in read().items()
+            for stat, value in stats.items()
         }
 
+    registry.gauge(name, help, samples, labels=[label, "stat"])
+
 
 def main() -> None:
 
+    store = create_store(config)
+
     print("Loading last saved dock descriptions...")
-    journal_summary = journal_storage.load(dock_file=config.dock.file_path)
+    journal_summary = store.load_docks()
 
     print("Loading last saved stock history...")
-    commodity_summary = commodity_storage.load(stock_file=config.stock.file_path)
+    commodity_summary = store.load_stocks()
 
     print("Setting up network listener...")
     slurper = Slurper(
         journal_summary=journal_summary,
         commodity_summary=commodity_summary,
         print_wait=config.cmd_line.print_wait,
+        store=store,
     )
-    listener = EddnListener(
-        url=config.eddn_relay_url,
-        timeout=config.eddn_timeout,
-        callback=slurper.handle_eddn_message,
+    decode = slurper.decode_eddn_message
+    apply = slurper.apply_eddn_message
+    update = slurper.update_summaries
+    callback = slurper.handle_eddn_message
+    exporters = []
+    if config.metrics and config.metrics.enabled:
+        profiler = SampledProfiler(
+            sample_every=config.metrics.profile_every,
+            output_file=config.metrics.profile_file,
+        )
+        decode = profiler.wrap(decode)
+        apply = profiler.wrap(apply)
+        update = profiler.wrap(update)
+        callback = profiler.wrap(callback)
+        # Not available on Windows
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, profiler.toggle)
+            print("Send SIGUSR1 to start or stop profiling")
+        if config.metrics.port:
+            exporters.append(MetricsServer(slurper.metrics, config.metrics.port))
+            print(f"Serving metrics on http://127.0.0.1:{config.metrics.port}/metrics")
+        if config.metrics.stats_file:
+            exporters.append(
+                StatsFileWriter(
+                    slurper.metrics,
+                    config.metrics.stats_file,
+                    config.metrics.stats_interval,
+                )
+            )
+            print(f"Writing metrics to {config.metrics.stats_file}")
+    if config.query and config.query.enabled:
+        query_server = QueryServer(
+            api=QueryApi(
+                slurper.stock_handler,
+                slurper.dock_handler,
+                slurper.print_handler,
+                slurper.route_engine,
+            ),
+            port=config.query.port,
+            cache_size=config.query.cache_size,
+            state_lock=slurper.state_lock,
+        )
+        slurper.metrics.gauge(
+            "slurper_query",
+            "Query API cache hits, misses, 304s and failed requests",
+            lambda: _by_label(query_server.get_stats()),
+            labels=["stat"],
+        )
+        exporters.append(query_server)
+        print(f"Serving queries on http://127.0.0.1:{query_server.port}/")
+    if config.export and config.export.enabled:
+        exporters.append(
+            StateExport(
+                path=config.export.path,
+                stock_handler=slurper.stock_handler,
+                dock_handler=slurper.dock_handler,
+                state_lock=slurper.state_lock,
+                interval=config.export.interval,
+            )
+        )
+        print(f"Publishing the state to {config.export.path}")
+
+    recorder = None
+    if args.record and not args.replay:
+        print(f"Recording received frames to {args.record}...")
+        recorder = FrameRecorder(args.record)
+
+    if config.asyncio and config.asyncio.enabled:
+        run_asyncio(slurper, decode, update, recorder, exporters)
+    else:
+        run_threaded(slurper, decode, apply, callback, recorder, exporters)
+
+    if recorder:
+        recorder.close()
+        print(f"Recorded {recorder.frames} frames")
+
+    print("Saving current stock history...")
+    store.save_stocks(commodity_summary)
+
+    print("Saving current dock descriptions...")
+    store.save_docks(journal_summary)
+    store.close()
+    print(store.get_stats())
+    if slurper.stock_handler.price_history:
+        slurper.stock_handler.price_history.close()
+
+    for exporter in exporters:
+        exporter.stop()
+    print(slurper.get_dev_analysis())
+
+
+def run_asyncio(
+    slurper: Slurper,
+    decode: Callable[[bytes, Optional[bytes]], DecodedMessage],
+    update: Callable[[DecodedMessage], None],
+    recorder: Optional[FrameRecorder],
+    exporters: list,
+) -> None:
+    """Run until stopped as tasks on an event loop, saving and printing on timers"""
+    relays = None
+    if args.replay:
+        print(f"Replaying {args.replay}...")
+        sources = [replay_frames(args.replay, args.replay_speed)]
+    elif config.relays and config.relays.urls:
+        print(f"Subscribing to {len(config.relays.urls)} relays...")
+        relays = AsyncRelayGroup(
+            urls=config.relays.urls,
+            timeout=config.eddn_timeout,
+            dedupe=DedupeCache(
+                window=config.relays.dedupe_window,
+                max_size=config.relays.dedupe_size,
+            ),
+            min_backoff=config.relays.min_backoff,
+            max_backoff=config.relays.max_backoff,
+        )
+    else:
+        relays = AsyncRelayGroup(
+            urls=[config.eddn_relay_url], timeout=config.eddn_timeout, dedupe=None
+        )
+    if relays is not None:
+        sources = relays.sources()
+        register_stats(
+            slurper.metrics,
+            "slurper_relay",
+            "Messages, duplicates, reconnects and lag of each relay",
+            "relay",
+            relays.get_stats,
+        )
+
+    def render() -> None:
+        print(slurper.get_highest_trade_diffs_str())
+        stdout.flush()
+
+    pipeline = AsyncPipeline(
+        config=config.asyncio,
+        sources=sources,
+        decode=decode,
+        apply=update,
+        render=render,
+        save=slurper.save_when_due,
+        recorder=recorder,
+    )
+    slurper.metrics.gauge(
+        "slurper_asyncio_queue_depth",
+        "Messages waiting in each queue of the asyncio pipeline",
+        lambda: {(queue,): depth for queue, depth in pipeline.get_depths().items()},
+        labels=["queue"],
     )
+    for exporter in exporters:
+        exporter.start()
+
+    print("Listening!")
+    asyncio.run(pipeline.run())
+    print(f"Closing listener after {pipeline.applied} messages...")
+    if relays is not None:
+        print(relays.get_stats())
+
+
+def run_threaded(
+    slurper: Slurper,
+    decode: Callable[[bytes, Optional[bytes]], DecodedMessage],
+    apply: Callable[[DecodedMessage], None],
+    callback: Callable[[bytes, Optional[bytes]], None],
+    recorder: Optional[FrameRecorder],
+    exporters: list,
+) -> None:
+    """Run until stopped with a blocking listener, and ingest threads if enabled"""
+    pipeline = None
+    if config.ingest and config.ingest.enabled:
+        if config.ingest.decode_processes > 0:
+            print(f"Starting {config.ingest.decode_processes} decode processes...")
+            pipeline = ProcessPoolPipeline(
+                config=config.ingest,
+                fast=config.decoder == FAST_DECODER,
+                apply=apply,
+                idle=slurper.save_when_due,
+            )
+        else:
+            pipeline = IngestPipeline(
+                config=config.ingest,
+                decode=decode,
+                apply=apply,
+                idle=slurper.save_when_due,
+            )
+        register_stats(
+            slurper.metrics,
+            "slurper_ingest",
+            "Queue depths, counts and timings of each ingest stage",
+            "stage",
+            pipeline.get_stats,
+        )
+        pipeline.start()
+        callback = pipeline.put
+
+    for exporter in exporters:
+        exporter.start()
+
+    if args.replay:
+        print(f"Replaying {args.replay}...")
+        listener = FrameReplayer(
+            path=args.replay, callback=callback, speed=args.replay_speed
+        )
+    elif config.relays and config.relays.urls:
+        print(f"Subscribing to {len(config.relays.urls)} relays...")
+        listener = MultiRelayListener(
+            urls=config.relays.urls,
+            timeout=config.eddn_timeout,
+            callback=callback,
+            dedupe=DedupeCache(
+                window=config.relays.dedupe_window,
+                max_size=config.relays.dedupe_size,
+            ),
+            min_backoff=config.relays.min_backoff,
+            max_backoff=config.relays.max_backoff,
+            recorder=recorder,
+        )
+    else:
+        # One relay needs no deduplicating, but is backed off all the same
+        listener = MultiRelayListener(
+            urls=[config.eddn_relay_url],
+            timeout=config.eddn_timeout,
+            callback=callback,
+            dedupe=None,
+            recorder=recorder,
+        )
+    if isinstance(listener, MultiRelayListener):
+        register_stats(
+            slurper.metrics,
+            "slurper_relay",
+            "Messages, duplicates, reconnects and lag of each relay",
+            "relay",
+            listener.get_stats,
+        )
     signal.signal(signal.SIGINT, listener.stop)
 
     print("Listening!")
     listener.start()
     print("Closing listener...")
+    if isinstance(listener, MultiRelayListener):
+        print(listener.get_stats())
 
-    print("Saving current stock history...")
-    commodity_storage.save(stock_file=config.stock.file_path, summary=commodity_summary)
-
-    print("Saving current dock descriptions...")
-    journal_storage.save(dock_file=config.dock.file_path, summary=journal_summary)
-
-    print(slurper.get_dev_analysis())
+    if pipeline:
+        print("Processing queued messages...")
+        pipeline.stop()
+        print(pipeline.get_stats())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,235 @@
+"""
+A compact binary file of named columns, stored as a numpy .npz archive.
+
+Strings are kept once each in a shared string table, with string columns
+holding indexes into it, so repeated system names, station types and so on
+cost four bytes a row. Missing values are -1 for strings, NaN for floats
+and vectors, and a separate mask for integers.
+"""
+
+import math
+import numpy
+import os
+import threading
+import weakref
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+STRING = "str"
+INTEGER = "int"
+FLOAT = "float"
+VECTOR = "vec3"
+
+# Version 1 joined the string table with a separator, so had no way to hold
+# a table of just the empty string. Version 2 stores where each one ends.
+FORMAT_VERSION = 2
+_SEPARATOR = "\x00"
+
+# The open files read by each path, to be closed before it's saved over
+_open_files: Dict[str, "weakref.WeakSet[ColumnFile]"] = {}
+_open_files_lock = threading.Lock()
+
+
+def save(path: str, columns: Dict[str, Tuple[str, Sequence[Any]]]) -> None:
+    """
+    Save `columns`, each a (kind, values) pair, to `path`.
+    Columns may be of different lengths. As with the JSON schemas, any string
+    column values that aren't strings are saved as their `str`.
+    """
+    strings: Dict[str, int] = {}
+    arrays = {"version": numpy.array(FORMAT_VERSION)}
+
+    for name, (kind, values) in columns.items():
+        if kind == STRING:
+            arrays[name] = numpy.array(
+                [
+                    (
+                        -1
+                        if value is None
+                        else strings.setdefault(str(value), len(strings))
+                    )
+                    for value in values
+                ],
+                dtype=numpy.int32,
+            )
+        elif kind == INTEGER:
+            missing = [value is None for value in values]
+            arrays[name] = numpy.array(
+                [0 if value is None else value for value in values], dtype=numpy.int64
+            )
+            if any(missing):
+                arrays[f"{name}.none"] = numpy.array(missing, dtype=bool)
+        elif kind == FLOAT:
+            arrays[name] = numpy.array(
+                [math.nan if value is None else value for value in values],
+                dtype=numpy.float64,
+            )
+        elif kind == VECTOR:
+            arrays[name] = numpy.array(
+                [[math.nan] * 3 if value is None else value for value in values],
+                dtype=numpy.float64,
+            ).reshape(-1, 3)
+        else:
+            raise ValueError(f"Unknown column kind: {kind}")
+
+    arrays["strings"] = numpy.frombuffer("".join(strings).encode(), dtype=numpy.uint8)
+    arrays["string_ends"] = numpy.cumsum(
+        [len(string) for string in strings], dtype=numpy.int64
+    )
+
+    # Write beside the file then swap it in, so a crash can't leave it truncated
+    temp_file = f"{path}.tmp"
+    with open(temp_file, "wb") as binary_file:
+        numpy.savez(binary_file, **arrays)
+    # An open file can't be replaced on Windows
+    with _open_files_lock:
+        readers = list(_open_files.get(os.path.abspath(path), ()))
+    for reader in readers:
+        reader.detach()
+    os.replace(temp_file, path)
+
+
+def record_columns(
+    kinds: Dict[str, str], records: Iterable[Any], prefix: str = ""
+) -> Dict[str, Tuple[str, List[Any]]]:
+    """Columns for `save` from the attributes `kinds` names on each record"""
+    records = list(records)
+    return {
+        f"{prefix}{name}": (kind, [getattr(record, name) for record in records])
+        for name, kind in kinds.items()
+    }
+
+
+class ColumnFile:
+    """
+    Read access to a file written by `save`, converting values as asked for.
+    Each column is only read from the file the first time it's used, so the
+    file is kept open until `close`d, or until `save` replaces it, which
+    reads whatever is left first.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._archive = numpy.load(path)
+        version = int(self._archive["version"])
+        if version not in (1, FORMAT_VERSION):
+            self._archive.close()
+            raise ValueError(f"Unsupported columnar file version in {path}")
+
+        blob = self._archive["strings"].tobytes().decode()
+        if version == 1:
+            self.strings: List[str] = blob.split(_SEPARATOR) if blob else []
+        else:
+            ends = self._archive["string_ends"].tolist()
+            self.strings = [blob[start:end] for start, end in zip([0, *ends], ends)]
+        self._names = set(self._archive.files) - {"version", "strings", "string_ends"}
+        self._arrays: Dict[str, numpy.ndarray] = {}
+        # Saves read the columns on a background thread too
+        self._lock = threading.Lock()
+        self._readers = {
+            STRING: self.string,
+            INTEGER: self.integer,
+            FLOAT: self.float,
+            VECTOR: self.vector,
+        }
+        self._path = os.path.abspath(path)
+        with _open_files_lock:
+            _open_files.setdefault(self._path, weakref.WeakSet()).add(self)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+    def length(self, name: str) -> int:
+        return len(self.array(name))
+
+    def array(self, name: str) -> numpy.ndarray:
+        array = self._arrays.get(name)
+        if array is None:
+            with self._lock:
+                array = self._arrays.get(name)
+                if array is None:
+                    array = self._archive[name]
+                    self._arrays[name] = array
+        return array
+
+    def _missing(self, name: str) -> Optional[numpy.ndarray]:
+        """The mask of missing values of an integer column, if any are"""
+        mask = f"{name}.none"
+        return self.array(mask) if mask in self._names else None
+
+    def detach(self) -> None:
+        """Read every column not read yet, then close the file"""
+        with self._lock:
+            for name in self._names - self._arrays.keys():
+                self._arrays[name] = self._archive[name]
+        self.close()
+
+    def close(self) -> None:
+        """Close the file, leaving only the columns already read"""
+        with self._lock:
+            self._archive.close()
+        with _open_files_lock:
+            readers = _open_files.get(self._path)
+            if readers is not None:
+                readers.discard(self)
+                if not readers:
+                    del _open_files[self._path]
+
+    def string(self, name: str, row: int) -> Optional[str]:
+        index = self.array(name)[row]
+        return None if index < 0 else self.strings[index]
+
+    def strings_of(self, name: str) -> List[Optional[str]]:
+        strings = self.strings
+        return [
+            None if index < 0 else strings[index] for index in self.array(name).tolist()
+        ]
+
+    def integer(self, name: str, row: int) -> Optional[int]:
+        missing = self._missing(name)
+        if missing is not None and missing[row]:
+            return None
+        return int(self.array(name)[row])
+
+    def float(self, name: str, row: int) -> Optional[float]:
+        value = float(self.array(name)[row])
+        return None if math.isnan(value) else value
+
+    def vector(self, name: str, row: int) -> Optional[List[float]]:
+        value = self.array(name)[row].tolist()
+        return None if math.isnan(value[0]) else value
+
+    def record(
+        self, kinds: Dict[str, str], row: int, prefix: str = ""
+    ) -> Dict[str, Any]:
+        """The values of a row saved from `record_columns`, by attribute name"""
+        return {
+            name: self._readers[kind](f"{prefix}{name}", row)
+            for name, kind in kinds.items()
+        }
+
+    def records(
+        self, kinds: Dict[str, str], prefix: str = ""
+    ) -> Iterator[Dict[str, Any]]:
+        """Every row, as `record` would give them, reading a column at a time"""
+        columns = {
+            name: self.values(f"{prefix}{name}", kind) for name, kind in kinds.items()
+        }
+        names = list(columns)
+        return (dict(zip(names, values)) for values in zip(*columns.values()))
+
+    def values(self, name: str, kind: str) -> List[Any]:
+        """Every value of a column, as `save` was given them"""
+        if kind == STRING:
+            return self.strings_of(name)
+        values = self.array(name).tolist()
+        if kind == INTEGER:
+            missing = self._missing(name)
+            if missing is not None:
+                values = [
+                    None if none else value
+                    for value, none in zip(values, missing.tolist())
+                ]
+            return values
+        if kind == FLOAT:
+            return [None if math.isnan(value) else value for value in values]
+        return [None if math.isnan(value[0]) else value for value in values]
@@ -0,0 +1,156 @@
+import numpy
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from summary import columnar
+from summary.model import DockSummary, Station
+
+_STATION_KINDS = {
+    "market_id": columnar.INTEGER,
+    "star_pos": columnar.VECTOR,
+    "station_name": columnar.STRING,
+    "station_type": columnar.STRING,
+    "system_address": columnar.INTEGER,
+    "system_name": columnar.STRING,
+    "timestamp": columnar.STRING,
+    "dist_from_star_ls": columnar.FLOAT,
+    "station_allegiance": columnar.STRING,
+}
+
+
+class LazyStations:
+    """
+    A dict-like stand in for `DockSummary.stations` over a binary dock file.
+    Only the keys are read up front; each station is built from its row the
+    first time it's looked up. Stations set since loading take precedence.
+    """
+
+    def __init__(self, columns: columnar.ColumnFile, rows: Dict[str, int]) -> None:
+        self._columns = columns
+        self._rows = rows
+        self._stations: Dict[str, Station] = {}
+        self._added = 0
+
+    def _hydrate(self, key: str) -> Optional[Station]:
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        station = Station(**self._columns.record(_STATION_KINDS, row))
+        self._stations[key] = station
+        return station
+
+    def __getitem__(self, key: str) -> Station:
+        station = self.get(key)
+        if station is None:
+            raise KeyError(key)
+        return station
+
+    def get(self, key: str, default=None):
+        station = self._stations.get(key)
+        if station is None:
+            station = self._hydrate(key)
+        return default if station is None else station
+
+    def __setitem__(self, key: str, station: Station) -> None:
+        if key not in self._stations and key not in self._rows:
+            self._added += 1
+        self._stations[key] = station
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._stations or key in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows) + self._added
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._rows
+        yield from (key for key in self._stations if key not in self._rows)
+
+    def keys(self) -> Iterator[str]:
+        return iter(self)
+
+    def values(self) -> Iterator[Station]:
+        return (station for _, station in self.items())
+
+    def items(self) -> Iterator[Tuple[str, Station]]:
+        return ((key, self[key]) for key in self)
+
+    def star_positions(self) -> Tuple[List[str], numpy.ndarray]:
+        """Every key with its star position, without building the stations"""
+        keys = list(self)
+        star_positions = self._columns.array("star_pos")
+        if self._stations:
+            star_positions = numpy.concatenate(
+                [star_positions, numpy.full((self._added, 3), numpy.nan)]
+            )
+            rows = dict(zip(keys, range(len(keys))))
+            for key, station in self._stations.items():
+                star_positions[rows[key]] = station.star_pos or [numpy.nan] * 3
+        return keys, star_positions
+
+    def columns(self) -> Dict[str, Tuple[str, List]]:
+        """
+        The columns to save, in the order of the keys. Rows of stations not
+        built or set since loading are copied from the file, so saving
+        doesn't build them.
+        """
+        keys = list(self)
+        # Stations added since loading come after the file's, as in `__iter__`
+        rows = dict(self._rows)
+        rows.update(zip(keys[len(self._rows) :], range(len(self._rows), len(keys))))
+        columns = {"key": (columnar.STRING, keys)}
+        for name, kind in _STATION_KINDS.items():
+            values = self._columns.values(name, kind) + [None] * self._added
+            for key, station in self._stations.items():
+                values[rows[key]] = getattr(station, name)
+            columns[name] = (kind, values)
+        return columns
+
+    def field_values(self) -> Dict[str, List]:
+        """
+        Every station's values of each `Station` field, and the keys under
+        "key", in the same order, without building the stations
+        """
+        return {name: values for name, (_, values) in self.columns().items()}
+
+    def hydrated(self) -> int:
+        """How many stations have been built or set since loading"""
+        return len(self._stations)
+
+    def copy(self) -> "LazyStations":
+        """A shallow copy, sharing the read only columns"""
+        stations = LazyStations(self._columns, self._rows)
+        stations._stations = dict(self._stations)
+        stations._added = self._added
+        return stations
+
+
+def load(dock_file: str, lazy: bool = False) -> DockSummary:
+    try:
+        columns = columnar.ColumnFile(dock_file)
+    except FileNotFoundError:
+        return DockSummary()
+
+    keys = columns.strings_of("key")
+    if lazy:
+        return DockSummary(
+            stations=LazyStations(columns, dict(zip(keys, range(len(keys)))))
+        )
+    summary = DockSummary(
+        stations={
+            key: Station(**record)
+            for key, record in zip(keys, columns.records(_STATION_KINDS))
+        }
+    )
+    columns.close()
+    return summary
+
+
+def save(dock_file: str, summary: DockSummary):
+    if isinstance(summary.stations, LazyStations):
+        columnar.save(dock_file, summary.stations.columns())
+        return
+    keys, stations = zip(*summary.stations.items()) if summary.stations else ((), ())
+    columns = {"key": (columnar.STRING, keys)}
+    columns.update(columnar.record_columns(_STATION_KINDS, stations))
+    columnar.save(dock_file, columns)
@@ -1,18 +1,58 @@
-from typing import Optional
+import numpy
+
+from typing import Callable, Dict, List, Optional
 
 from config.model import DockConfig
 from eddn.journal_v1.model import JournalV1 as EddnJournalV1
+from summary.dock_handler.binary_storage import LazyStations
 from summary.model import DockSummary, Station
+from summary.spatial_index import SpatialIndex
+from summary.sqlite_store import StationTable
+from summary.station_registry import STATIONS
+
+
+def dock_key(system: str, station: str) -> str:
+    return f"{system}/{station}"
 
 
 class DockHandler:
     def __init__(self, config: DockConfig, target: DockSummary) -> None:
         self.config = config
         self.journal = target
-        self.save_counter = self.config.autosave_wait
+        self.spatial_index = SpatialIndex()
+        # A station key in each system, to find where a system is by name
+        self.system_keys: Dict[str, str] = {}
+        # Called with the key and station whenever a station is set
+        self.station_listeners: List[Callable[[str, Station], None]] = []
+        self._changes: Dict[str, None] = {}
+        # Goes up with every change, so readers can tell when to look again
+        self.version = 0
+        self._create_spatial_index()
+
+    def _create_spatial_index(self) -> None:
+        stations = self.journal.stations
+        if isinstance(stations, (LazyStations, StationTable)):
+            # Read the positions straight from the store, leaving the stations unbuilt
+            keys, star_positions = stations.star_positions()
+            self.spatial_index.add_many(keys, star_positions)
+            self._add_system_keys(keys, star_positions)
+            return
+        # Otherwise the positions are already gathered in the station registry
+        entries = [(key, station.station_id) for key, station in stations.items()]
+        keys = [key for key, _ in entries]
+        station_ids = numpy.array([station_id for _, station_id in entries], dtype=int)
+        star_positions = STATIONS.coords()[station_ids]
+        self.spatial_index.add_many(keys, star_positions)
+        self._add_system_keys(keys, star_positions)
+
+    def _add_system_keys(self, keys: List[str], star_positions: numpy.ndarray) -> None:
+        known = ~numpy.isnan(star_positions).any(axis=1)
+        for key, is_known in zip(keys, known.tolist()):
+            if is_known:
+                self.system_keys.setdefault(key.split("/", 1)[0], key)
 
     def update(self, journal_v1: EddnJournalV1) -> bool:
-        """Updates the summary and returns true if it's time to save"""
+        """Updates the summary and returns true if anything changed"""
         system = journal_v1.message.system_name
         station = journal_v1.message.station_name
         if dock_entry := self.get_dock_entry(system=system, station=station):
@@ -25,13 +65,7 @@ class DockHandler:
                 )
         else:
             self._set_dock_entry(system=system, station=station, journal_v1=journal_v1)
-
-        if self.save_counter <= 0:
-            self.save_counter = self.config.autosave_wait
-            return True
-        else:
-            self.save_counter -= 1
-            return False
+        return bool(self._changes)
 
     def _dock_details(self, journal_v1: EddnJournalV1) -> Station:
         return Station(
@@ -47,11 +81,23 @@ class DockHandler:
         )
 
     def get_dock_entry(self, system: str, station: str) -> Optional[Station]:
-        key = f"{system}/{station}"
-        return self.journal.stations.get(key, None)
+        return self.journal.stations.get(dock_key(system, station), None)
 
     def _set_dock_entry(
         self, system: str, station: str, journal_v1: EddnJournalV1
     ) -> None:
-        key = f"{system}/{station}"
-        self.journal.stations[key] = self._dock_details(journal_v1=journal_v1)
+        key = dock_key(system, station)
+        dock_entry = self._dock_details(journal_v1=journal_v1)
+        self.journal.stations[key] = dock_entry
+        self.spatial_index.add(key, journal_v1.message.star_pos)
+        if journal_v1.message.star_pos is not None:
+            self.system_keys.setdefault(system, key)
+        self._changes[key] = None
+        self.version += 1
+        for listener in self.station_listeners:
+            listener(key, dock_entry)
+
+    def pop_changes(self) -> List[str]:
+        """The keys of stations changed since last asked, in order"""
+        changes, self._changes = self._changes, {}
+        return list(changes)
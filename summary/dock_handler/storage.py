@@ -1,7 +1,10 @@
 import json
+import os
+
+from typing import Iterable, List
 
 from summary.model import DockSummary
-from summary.schema import DockSummarySchema
+from summary.schema import DockSummarySchema, StationSchema
 
 
 def load(dock_file: str) -> DockSummary:
@@ -14,6 +17,30 @@ def load(dock_file: str) -> DockSummary:
 
 
 def save(dock_file: str, summary: DockSummary):
-    with open(dock_file, "w") as json_file:
+    # Write beside the file then swap it in, so a crash can't leave it truncated
+    temp_file = f"{dock_file}.tmp"
+    with open(temp_file, "w") as json_file:
         data = DockSummarySchema().dump(summary)
         json.dump(obj=data, fp=json_file, indent=4)
+    os.replace(temp_file, dock_file)
+
+
+def copy(summary: DockSummary) -> DockSummary:
+    """
+    A copy that can be saved while the original carries on changing.
+    Stations are replaced rather than changed, so they needn't be copied.
+    """
+    return DockSummary(stations=summary.stations.copy())
+
+
+def dump_changes(summary: DockSummary, keys: Iterable[str]) -> List[dict]:
+    """Log records for the given stations"""
+    schema = StationSchema()
+    return [{"k": key, "v": schema.dump(summary.stations[key])} for key in keys]
+
+
+def apply_changes(summary: DockSummary, changes: List[dict]) -> None:
+    """Replay log records from `dump_changes`"""
+    schema = StationSchema()
+    for change in changes:
+        summary.stations[change["k"]] = schema.load(change["v"])
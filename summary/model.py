@@ -1,23 +1,162 @@
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from datetime import datetime, timezone
+from dateutil.parser import parse
+from operator import attrgetter
+from typing import Any, Dict, List, Optional, Tuple
 
+from summary.station_registry import STATIONS, StationInfo, intern_string
 
-@dataclass
-class CostSnapshot:
-    system_name: str
-    station_name: str
-    timestamp: str
-    buy_price: int
-    stock: int
-    sell_price: int
-    demand: int
-
-    market_id: Optional[int] = None
-    star_pos: Optional[List[float]] = None
-    station_type: Optional[str] = None
-    system_address: Optional[int] = None
-    dist_from_star_ls: Optional[float] = None
-    station_allegiance: Optional[str] = None
+
+def epoch_seconds(timestamp: str) -> int:
+    """The seconds since the epoch of an ISO 8601 timestamp, taken as UTC if unzoned"""
+    try:
+        # Much quicker than dateutil, for the timestamps EDDN normally sends
+        parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        parsed = parse(timestamp)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def _info_property(name: str) -> property:
+    return property(attrgetter(f"info.{name}"))
+
+
+class _CompactRecord:
+    """
+    Slotted stand in for a dataclass, whose dock details are read from a
+    shared `StationInfo`. `FIELDS` are the constructor arguments, in order.
+    """
+
+    __slots__ = ()
+    FIELDS: Tuple[str, ...] = ()
+
+    info: StationInfo
+    system_name = _info_property("system_name")
+    station_name = _info_property("station_name")
+    market_id = _info_property("market_id")
+    star_pos = _info_property("star_pos")
+    station_type = _info_property("station_type")
+    system_address = _info_property("system_address")
+    dist_from_star_ls = _info_property("dist_from_star_ls")
+    station_allegiance = _info_property("station_allegiance")
+
+    @property
+    def station_id(self) -> int:
+        return self.info.station_id
+
+    def _values(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, name) for name in self.FIELDS)
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._values() == other._values()
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        values = ", ".join(
+            f"{name}={value!r}" for name, value in zip(self.FIELDS, self._values())
+        )
+        return f"{self.__class__.__name__}({values})"
+
+    def __reduce__(self):
+        # Station ids only mean something in this process, so pickle the values
+        return self.__class__, self._values()
+
+
+class CostSnapshot(_CompactRecord):
+    __slots__ = (
+        "info",
+        "timestamp",
+        "buy_price",
+        "stock",
+        "sell_price",
+        "demand",
+        "_epoch",
+    )
+    FIELDS = (
+        "system_name",
+        "station_name",
+        "timestamp",
+        "buy_price",
+        "stock",
+        "sell_price",
+        "demand",
+        "market_id",
+        "star_pos",
+        "station_type",
+        "system_address",
+        "dist_from_star_ls",
+        "station_allegiance",
+    )
+
+    def __init__(
+        self,
+        system_name: str,
+        station_name: str,
+        timestamp: str,
+        buy_price: int,
+        stock: int,
+        sell_price: int,
+        demand: int,
+        market_id: Optional[int] = None,
+        star_pos: Optional[List[float]] = None,
+        station_type: Optional[str] = None,
+        system_address: Optional[int] = None,
+        dist_from_star_ls: Optional[float] = None,
+        station_allegiance: Optional[str] = None,
+    ) -> None:
+        self.info = STATIONS.info(
+            system_name=system_name,
+            station_name=station_name,
+            market_id=market_id,
+            star_pos=star_pos,
+            station_type=station_type,
+            system_address=system_address,
+            dist_from_star_ls=dist_from_star_ls,
+            station_allegiance=station_allegiance,
+        )
+        self._set_prices(timestamp, buy_price, stock, sell_price, demand)
+
+    @classmethod
+    def at_station(
+        cls,
+        station: "Station",
+        timestamp: str,
+        buy_price: int,
+        stock: int,
+        sell_price: int,
+        demand: int,
+    ) -> "CostSnapshot":
+        """A snapshot sharing the dock details of `station`"""
+        cost_snapshot = cls.__new__(cls)
+        cost_snapshot.info = station.info
+        cost_snapshot._set_prices(timestamp, buy_price, stock, sell_price, demand)
+        return cost_snapshot
+
+    def _set_prices(
+        self, timestamp: str, buy_price: int, stock: int, sell_price: int, demand: int
+    ) -> None:
+        self.timestamp = intern_string(timestamp)
+        self.buy_price = buy_price
+        self.stock = stock
+        self.sell_price = sell_price
+        self.demand = demand
+        # Not stored, just saves re-parsing the timestamp to rank or print it
+        self._epoch: Optional[int] = None
+
+    @property
+    def epoch(self) -> int:
+        """When the prices were reported, in seconds since the epoch"""
+        if self._epoch is None:
+            self._epoch = epoch_seconds(self.timestamp)
+        return self._epoch
+
+    def set_epoch(self, epoch: int) -> None:
+        self._epoch = epoch
 
 
 @dataclass
@@ -32,17 +171,43 @@ class StockSummary:
     commodities: List[Commodity] = field(default_factory=list)
 
 
-@dataclass
-class Station:
-    market_id: int
-    star_pos: List[float]
-    station_name: str
-    station_type: str
-    system_address: int
-    system_name: str
-    timestamp: str
-    dist_from_star_ls: Optional[float] = None
-    station_allegiance: Optional[str] = None
+class Station(_CompactRecord):
+    __slots__ = ("info", "timestamp")
+    FIELDS = (
+        "market_id",
+        "star_pos",
+        "station_name",
+        "station_type",
+        "system_address",
+        "system_name",
+        "timestamp",
+        "dist_from_star_ls",
+        "station_allegiance",
+    )
+
+    def __init__(
+        self,
+        market_id: int,
+        star_pos: List[float],
+        station_name: str,
+        station_type: str,
+        system_address: int,
+        system_name: str,
+        timestamp: str,
+        dist_from_star_ls: Optional[float] = None,
+        station_allegiance: Optional[str] = None,
+    ) -> None:
+        self.info = STATIONS.info(
+            system_name=system_name,
+            station_name=station_name,
+            market_id=market_id,
+            star_pos=star_pos,
+            station_type=station_type,
+            system_address=system_address,
+            dist_from_star_ls=dist_from_star_ls,
+            station_allegiance=station_allegiance,
+        )
+        self.timestamp = intern_string(timestamp)
 
 
 @dataclass
@@ -1,51 +1,55 @@
 import io
-import numpy
+import math
 
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
-from dateutil.parser import parse
 
 from config.model import CmdLineConfig
-from eddn.commodity_v3.model import Commodity
-from summary.model import CostSnapshot, StockSummary
+from summary.dock_handler.journal_v1 import dock_key
+from summary.model import CostSnapshot
+from summary.spatial_index import SpatialIndex
+from summary.stock_handler.trade_index import TradeIndex
+
+
+def _age(seconds: int) -> str:
+    """How old a price is, as days (if any) and hh:mm:ss"""
+    minutes, seconds = divmod(max(seconds, 0), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return (
+        f"{f' {days:2d}d' if days else '    '} {hours:02d}:{minutes:02d}:{seconds:02d}"
+    )
 
 
 class Output:
-    def __init__(self, config: CmdLineConfig, target: StockSummary):
+    def __init__(
+        self,
+        config: CmdLineConfig,
+        trade_index: TradeIndex,
+        spatial_index: SpatialIndex,
+    ):
         self.config = config
-        self.commodity_summary = target
+        self.trade_index = trade_index
+        self.spatial_index = spatial_index
 
     def get_highest_trade_diffs_str(self) -> str:
-        best_trades = {}
-        for commodity in self.commodity_summary.commodities:
-            if commodity.best_buys and commodity.best_sales:
-                key = float(
-                    commodity.best_sales[0].sell_price
-                    - commodity.best_buys[0].buy_price
-                )
-                while key in best_trades:
-                    key -= 0.001
-                best_trades[key] = commodity
-
         ret_io = io.StringIO()
-        top_five_keys = sorted(best_trades.keys(), reverse=True)[:5]
 
         print_time = datetime.now().astimezone()
         print_time = print_time.replace(microsecond=0)
+        print_epoch = int(print_time.timestamp())
 
         print(f"-{f'- {print_time.isoformat()} -':=^104}-", file=ret_io)
-        for key in top_five_keys:
-            commodity: Commodity = best_trades[key]
+        for key, commodity in self.trade_index.top(5):
             top_buy_from: CostSnapshot = commodity.best_buys[0]
             top_sell_to: CostSnapshot = commodity.best_sales[0]
-            distance: float = get_trade_distance(top_buy_from, top_sell_to)
+            distance: float = self.get_trade_distance(top_buy_from, top_sell_to)
             print(
                 f"  {commodity.name.upper()}  (Best: profit per unit: {key}, Distance: {distance:.2f} ly):",
                 file=ret_io,
             )
             for buy_from in commodity.best_buys[::-1]:
-                buy_age = relativedelta(print_time, parse(buy_from.timestamp))
-                distance: float = get_trade_distance(buy_from, top_sell_to)
+                buy_age = _age(print_epoch - buy_from.epoch)
+                distance: float = self.get_trade_distance(buy_from, top_sell_to)
                 station_highlight = self.config.station_highlights.get(
                     buy_from.station_type.lower(), " "
                 )
@@ -56,14 +60,13 @@ class Output:
                     f" {station_highlight}"
                     f" {distance:6.2f} ly"
                     f" {buy_from.dist_from_star_ls or 0:9.2f} ls"
-                    f"{f' {buy_age.days:2d}d' if buy_age.days else '    '}"
-                    f" {buy_age.hours:02d}:{buy_age.minutes:02d}:{buy_age.seconds:02d}",
+                    f"{buy_age}",
                     file=ret_io,
                 )
 
             for sell_to in commodity.best_sales:
-                sell_age = relativedelta(print_time, parse(sell_to.timestamp))
-                distance: float = get_trade_distance(top_buy_from, sell_to)
+                sell_age = _age(print_epoch - sell_to.epoch)
+                distance: float = self.get_trade_distance(top_buy_from, sell_to)
                 station_highlight = self.config.station_highlights.get(
                     sell_to.station_type.lower(), " "
                 )
@@ -74,16 +77,19 @@ class Output:
                     f" {station_highlight}"
                     f" {distance:6.2f} ly"
                     f" {sell_to.dist_from_star_ls or 0:9.2f} ls"
-                    f"{f' {sell_age.days:2d}d' if sell_age.days else '    '}"
-                    f" {sell_age.hours:02d}:{sell_age.minutes:02d}:{sell_age.seconds:02d}",
+                    f"{sell_age}",
                     file=ret_io,
                 )
             print("-" * 106, file=ret_io)
 
         return ret_io.getvalue()
 
-
-def get_trade_distance(_from: CostSnapshot, _to: CostSnapshot) -> float:
-    a = numpy.array(_from.star_pos)
-    b = numpy.array(_to.star_pos)
-    return numpy.linalg.norm(a - b)
+    def get_trade_distance(self, _from: CostSnapshot, _to: CostSnapshot) -> float:
+        distance = self.spatial_index.distance_between(
+            dock_key(_from.system_name, _from.station_name),
+            dock_key(_to.system_name, _to.station_name),
+        )
+        if distance is None:
+            # Not a station we've docked at, so use where it was when priced
+            return math.dist(_from.star_pos, _to.star_pos)
+        return distance
@@ -0,0 +1,490 @@
+import json
+import math
+import numpy
+import os
+import sys
+import threading
+import traceback
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from summary.dock_handler.journal_v1 import DockHandler
+from summary.output_handler.cmd_line import Output
+from summary.price_history import DAY, HOUR, PriceTrend
+from summary.route_engine import Route, RouteEngine
+from summary.schema import CommoditySchema, CostSnapshotSchema, StationSchema
+from summary.stock_handler.commodity_v3 import StockHandler
+from summary.stock_handler.market_store import MarketStore
+
+DEFAULT_TRADES = 5
+MAX_TRADES = 100
+DEFAULT_NEAREST = 10
+MAX_NEAREST = 1000
+DEFAULT_ROUTES = 5
+MAX_ROUTES = 50
+MAX_HOPS = 8
+DEFAULT_HISTORY_HOURS = 24.0
+
+
+class QueryError(Exception):
+    """A query that can't be answered, with the HTTP status to say so"""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def _number(params: Dict[str, List[str]], name: str) -> Optional[float]:
+    if name not in params:
+        return None
+    try:
+        value = float(params[name][0])
+    except ValueError:
+        raise QueryError(400, f"{name} must be a number")
+    if not math.isfinite(value):
+        raise QueryError(400, f"{name} must be a finite number")
+    return value
+
+
+def _count(params: Dict[str, List[str]], default: int, most: int) -> int:
+    count = _number(params, "count")
+    if count is None:
+        return default
+    return max(1, min(int(count), most))
+
+
+def _trend(trend: PriceTrend) -> Any:
+    return {
+        "samples": trend.samples,
+        "mean": trend.mean,
+        "slope": trend.slope,
+        "volatility": trend.volatility,
+    }
+
+
+def _bucket(bucket: numpy.void) -> Any:
+    def side(name: str) -> Any:
+        count = int(bucket[f"{name}s"])
+        if not count:
+            return None
+        return {
+            "mean": int(bucket[f"{name}_sum"]) / count,
+            "min": int(bucket[f"{name}_min"]),
+            "max": int(bucket[f"{name}_max"]),
+        }
+
+    samples = int(bucket["samples"])
+    return {
+        "time": int(bucket["time"]),
+        "samples": samples,
+        "buy": side("buy"),
+        "sell": side("sell"),
+        "stock": int(bucket["stock_sum"]) / samples,
+        "demand": int(bucket["demand_sum"]) / samples,
+    }
+
+
+class QueryApi:
+    """
+    Answers queries about the live trade state, as values ready for JSON.
+
+    Each answer depends on the stocks, the docks or both, and is only valid
+    while the version of those stays the same.
+    """
+
+    def __init__(
+        self,
+        stock_handler: StockHandler,
+        dock_handler: DockHandler,
+        output: Output,
+        route_engine: RouteEngine,
+    ) -> None:
+        self.stock_handler = stock_handler
+        self.dock_handler = dock_handler
+        self.output = output
+        self.route_engine = route_engine
+        self.commodity_schema = CommoditySchema()
+        self.cost_snapshot_schema = CostSnapshotSchema()
+        self.station_schema = StationSchema()
+
+    def commodities(self, params: Dict[str, List[str]]) -> Any:
+        names = [
+            commodity.name for commodity in self.stock_handler.stock_summary.commodities
+        ]
+        return {"commodities": sorted(names)}
+
+    def commodity(self, params: Dict[str, List[str]], name: str) -> Any:
+        commodity = self.stock_handler.commodity_index.get(name.lower())
+        if commodity is None:
+            raise QueryError(404, f"No prices known for {name}")
+        return self.commodity_schema.dump(commodity)
+
+    def trades(self, params: Dict[str, List[str]]) -> Any:
+        trades = []
+        for profit, commodity in self.stock_handler.trade_index.top(
+            _count(params, DEFAULT_TRADES, MAX_TRADES)
+        ):
+            buy_from, sell_to = commodity.best_buys[0], commodity.best_sales[0]
+            trade = {
+                "commodity": commodity.name,
+                "profit": profit,
+                "distance": self.output.get_trade_distance(buy_from, sell_to),
+                "buy": self.cost_snapshot_schema.dump(buy_from),
+                "sell": self.cost_snapshot_schema.dump(sell_to),
+            }
+            price_history = self.stock_handler.price_history
+            if price_history is not None:
+                # How steady each end of the trade has been lately
+                hours = DEFAULT_HISTORY_HOURS
+                if buy_from.market_id is not None:
+                    buy_trend, _ = price_history.trend(
+                        buy_from.market_id, commodity.name, hours
+                    )
+                    trade["buy_trend"] = _trend(buy_trend)
+                if sell_to.market_id is not None:
+                    _, sell_trend = price_history.trend(
+                        sell_to.market_id, commodity.name, hours
+                    )
+                    trade["sell_trend"] = _trend(sell_trend)
+            trades.append(trade)
+        return {"trades": trades}
+
+    def stations_near(self, params: Dict[str, List[str]]) -> Any:
+        point = [_number(params, axis) for axis in ("x", "y", "z")]
+        if None in point:
+            raise QueryError(400, "x, y and z are all needed")
+        radius = _number(params, "radius")
+        if radius is not None:
+            found = self.dock_handler.spatial_index.within(point, radius)
+        else:
+            found = self.dock_handler.spatial_index.nearest(
+                point, _count(params, DEFAULT_NEAREST, MAX_NEAREST)
+            )
+        stations = []
+        for distance, key in found:
+            station = self.dock_handler.journal.stations.get(key)
+            if station is not None:
+                stations.append(
+                    {"distance": distance, **self.station_schema.dump(station)}
+                )
+        return {"stations": stations}
+
+    def routes(self, params: Dict[str, List[str]]) -> Any:
+        if "system" not in params:
+            raise QueryError(400, "system is needed")
+        jump_range = _number(params, "range")
+        capacity = _number(params, "capacity")
+        if jump_range is None or capacity is None:
+            raise QueryError(400, "range and capacity are both needed")
+        hops = _number(params, "hops")
+        routes = self.route_engine.routes(
+            start_system=params["system"][0],
+            jump_range=jump_range,
+            capacity=int(capacity),
+            hops=1 if hops is None else max(1, min(int(hops), MAX_HOPS)),
+            count=_count(params, DEFAULT_ROUTES, MAX_ROUTES),
+            loop=params.get("loop", ["0"])[0] not in ("0", "false"),
+        )
+        return {"routes": [self._route(route, int(capacity)) for route in routes]}
+
+    def _market_store(self) -> MarketStore:
+        market_store = self.stock_handler.market_store
+        if market_store is None:
+            raise QueryError(404, "The market store isn't enabled")
+        return market_store
+
+    def _market(self, market_store: MarketStore, market_id: int) -> Any:
+        station = market_store.stations[market_store.rows[market_id]]
+        return {
+            "market_id": market_id,
+            "system_name": station.system_name,
+            "station_name": station.station_name,
+        }
+
+    def _market_trade(self, from_id: int, to_id: int) -> Any:
+        market_store = self._market_store()
+        trade = market_store.best_trade(from_id, to_id)
+        return {
+            "from": self._market(market_store, from_id),
+            "to": self._market(market_store, to_id),
+            "commodity": trade and trade.commodity,
+            "profit": trade and trade.unit_profit,
+            "buy_price": trade and trade.buy_price,
+            "sell_price": trade and trade.sell_price,
+            "units": trade and trade.units,
+        }
+
+    def market_trade(
+        self, params: Dict[str, List[str]], from_id: int, to_id: int
+    ) -> Any:
+        market_store = self._market_store()
+        for market_id in (from_id, to_id):
+            if market_id not in market_store.rows:
+                raise QueryError(404, f"No prices known for market {market_id}")
+        return self._market_trade(from_id, to_id)
+
+    def market_destinations(self, params: Dict[str, List[str]], from_id: int) -> Any:
+        market_store = self._market_store()
+        if from_id not in market_store.rows:
+            raise QueryError(404, f"No prices known for market {from_id}")
+        best = market_store.best_from(
+            from_id, _count(params, DEFAULT_TRADES, MAX_TRADES)
+        )
+        return {"trades": [self._market_trade(from_id, to_id) for _, to_id in best]}
+
+    def market_pairs(self, params: Dict[str, List[str]]) -> Any:
+        market_store = self._market_store()
+        if market_store.profit is None:
+            raise QueryError(404, "The profit matrix isn't kept")
+        pairs = market_store.top_pairs(_count(params, DEFAULT_TRADES, MAX_TRADES))
+        return {"trades": [self._market_trade(*pair) for _, pair in pairs]}
+
+    def history(
+        self, params: Dict[str, List[str]], market_id: int, commodity: str
+    ) -> Any:
+        price_history = self.stock_handler.price_history
+        if price_history is None:
+            raise QueryError(404, "The price history isn't enabled")
+        hours = _number(params, "hours")
+        hours = DEFAULT_HISTORY_HOURS if hours is None else max(hours, 1.0)
+        daily = params.get("daily", ["0"])[0] not in ("0", "false")
+        since = price_history.latest - hours * HOUR
+        buckets = price_history.buckets(
+            market_id, commodity, since, DAY if daily else HOUR
+        )
+        buy_trend, sell_trend = price_history.trend(market_id, commodity, hours)
+        return {
+            "market_id": market_id,
+            "commodity": commodity,
+            "buy_trend": _trend(buy_trend),
+            "sell_trend": _trend(sell_trend),
+            "buckets": [_bucket(bucket) for bucket in buckets],
+        }
+
+    def _route(self, route: Route, capacity: int) -> Any:
+        return {
+            "profit": route.profit,
+            "distance": route.distance,
+            "profit_per_ly": route.profit_per_ly,
+            "hops": [
+                {
+                    "commodity": trade.commodity,
+                    "units": trade.units(capacity),
+                    "profit": trade.profit(capacity),
+                    "distance": trade.distance,
+                    "buy": self.cost_snapshot_schema.dump(trade.buy_from),
+                    "sell": self.cost_snapshot_schema.dump(trade.sell_to),
+                }
+                for trade in route.trades
+            ],
+        }
+
+
+STOCKS = "stocks"
+DOCKS = "docks"
+
+MARKETS = "markets"
+HISTORY = "history"
+
+# What answers a path, and the state the answer depends on
+Endpoint = Tuple[Callable[..., Any], Tuple[str, ...]]
+
+
+class QueryServer:
+    """
+    Serves `QueryApi` answers as JSON over HTTP on the local machine only:
+
+      /commodities                      names of the commodities priced
+      /commodities/<name>               best buys and sales of one commodity
+      /trades?count=N                   the most profitable trades
+      /stations/near?x=&y=&z=&radius=R  docks within R ly of a point
+      /stations/near?x=&y=&z=&count=N   the N docks nearest a point
+      /routes?system=&range=&capacity=&hops=N&count=N&loop=1
+                                        the trade routes earning most per ly
+      /markets/<id>/to/<id>             the best commodity to carry between two
+      /markets/<id>/best?count=N        the best markets to sell to from one
+      /markets/top?count=N              the best pairs of markets to trade between
+      /history/<id>/<commodity>?hours=N&daily=1
+                                        a commodity's price buckets at a market
+
+    Answers carry an ETag made from the versions of the state they depend on,
+    and are cached until those versions change, so a client polling with
+    If-None-Match gets a bodiless 304 until something it asked about changes.
+    The versions start again from 0 on a restart, so the ETag also carries a
+    nonce made afresh by each server.
+    Answers are built while holding `state_lock`, so never mid-update.
+    Anything failing unexpectedly is answered with a 500 and counted.
+    """
+
+    def __init__(
+        self,
+        api: QueryApi,
+        port: int,
+        cache_size: int,
+        state_lock: ContextManager,
+    ) -> None:
+        self.api = api
+        self.cache_size = max(1, cache_size)
+        self.state_lock = state_lock
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.errors = 0
+        self._cache: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._nonce = os.urandom(4).hex()
+        self._endpoints: Dict[str, Endpoint] = {
+            "commodities": (self._commodities, (STOCKS,)),
+            "trades": (api.trades, (STOCKS, DOCKS, HISTORY)),
+            "stations": (self._stations, (DOCKS,)),
+            "routes": (api.routes, (STOCKS, DOCKS)),
+            "markets": (self._markets, (MARKETS,)),
+            "history": (self._history, (HISTORY,)),
+        }
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                status, etag, body = server.respond(self.path)
+                if etag and self.headers.get("If-None-Match") == etag:
+                    with server._cache_lock:
+                        server.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if etag:
+                    self.send_header("ETag", etag)
+                    self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                # Requests would otherwise be logged amongst the trade summaries
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread: Optional[threading.Thread] = None
+
+    def _commodities(self, params: Dict[str, List[str]], *path: str) -> Any:
+        if not path:
+            return self.api.commodities(params)
+        if len(path) == 1:
+            return self.api.commodity(params, path[0])
+        raise QueryError(404, "Not found")
+
+    def _stations(self, params: Dict[str, List[str]], *path: str) -> Any:
+        if path == ("near",):
+            return self.api.stations_near(params)
+        raise QueryError(404, "Not found")
+
+    def _markets(self, params: Dict[str, List[str]], *path: str) -> Any:
+        if path == ("top",):
+            return self.api.market_pairs(params)
+        try:
+            market_ids = [int(part) for part in path[::2]]
+        except ValueError:
+            raise QueryError(400, "Market ids must be numbers")
+        if len(path) == 2 and path[1] == "best":
+            return self.api.market_destinations(params, market_ids[0])
+        if len(path) == 3 and path[1] == "to":
+            return self.api.market_trade(params, *market_ids)
+        raise QueryError(404, "Not found")
+
+    def _history(self, params: Dict[str, List[str]], *path: str) -> Any:
+        if len(path) != 2:
+            raise QueryError(404, "Not found")
+        try:
+            market_id = int(path[0])
+        except ValueError:
+            raise QueryError(400, "Market ids must be numbers")
+        return self.api.history(params, market_id, path[1])
+
+    def _etag(self, depends_on: Tuple[str, ...]) -> str:
+        market_store = self.api.stock_handler.market_store
+        price_history = self.api.stock_handler.price_history
+        versions = {
+            STOCKS: self.api.stock_handler.version,
+            DOCKS: self.api.dock_handler.version,
+            MARKETS: market_store.version if market_store else 0,
+            HISTORY: price_history.version if price_history else 0,
+        }
+        return (
+            f'"{self._nonce}-'
+            + "-".join(str(versions[name]) for name in depends_on)
+            + '"'
+        )
+
+    def respond(self, path: str) -> Tuple[int, Optional[str], bytes]:
+        """The status, ETag and body answering a request for `path`"""
+        try:
+            return self._respond(path)
+        except Exception:
+            with self._cache_lock:
+                self.errors += 1
+            print(f"Failed to answer {path}:\n{traceback.format_exc()}")
+            sys.stdout.flush()
+            return 500, None, json.dumps({"error": "Internal error"}).encode()
+
+    def _respond(self, path: str) -> Tuple[int, Optional[str], bytes]:
+        url = urlsplit(path)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        endpoint = self._endpoints.get(parts[0]) if parts else None
+        if endpoint is None:
+            return 404, None, json.dumps({"error": "Not found"}).encode()
+        answer, depends_on = endpoint
+
+        etag = self._etag(depends_on)
+        with self._cache_lock:
+            cached = self._cache.get(path)
+            if cached and cached[0] == etag:
+                self._cache.move_to_end(path)
+                self.hits += 1
+                return 200, etag, cached[1]
+            self.misses += 1
+
+        with self.state_lock:
+            # Taken again now nothing can change under us
+            etag = self._etag(depends_on)
+            try:
+                body = json.dumps(answer(parse_qs(url.query), *parts[1:])).encode()
+            except QueryError as e:
+                return e.status, None, json.dumps({"error": str(e)}).encode()
+
+        with self._cache_lock:
+            self._cache[path] = (etag, body)
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return 200, etag, body
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="query-server", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._cache_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "errors": self.errors,
+                "cached": len(self._cache),
+            }
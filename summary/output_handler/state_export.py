@@ -0,0 +1,305 @@
+"""
+Publishes the live stocks and docks to a memory mapped file, laid out as
+`summary.state_file` describes, for other processes to read with its
+`StateReader`.
+"""
+
+import mmap
+import numpy
+import os
+import sys
+import threading
+import traceback
+
+from datetime import datetime, timezone
+from time import time
+from typing import ContextManager, Dict, List, Optional, Tuple, Union
+
+from summary.dock_handler.binary_storage import LazyStations
+from summary.dock_handler.journal_v1 import DockHandler
+from summary.model import Station, epoch_seconds
+from summary.sqlite_store import StationTable
+from summary.state_file import (
+    COMMODITY,
+    ENTRY,
+    FORMAT_VERSION,
+    HEADER,
+    MAGIC,
+    MISSING,
+    SECTIONS,
+    STATION,
+    GENERATION,
+    GENERATION_OFFSET,
+)
+from summary.stock_handler.commodity_v3 import StockHandler
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+class StateExport:
+    """
+    Publishes the state every `interval` seconds, when it has changed.
+
+    Station records are kept up to date as the dock handler sets stations,
+    so publishing copies them rather than building them again. The best
+    lists are small, and built afresh each time.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        stock_handler: StockHandler,
+        dock_handler: DockHandler,
+        state_lock: ContextManager,
+        interval: float,
+    ) -> None:
+        self.path = path
+        self.stock_handler = stock_handler
+        self.dock_handler = dock_handler
+        self.state_lock = state_lock
+        self.interval = interval
+        self.publishes = 0
+        self._published_versions = None
+
+        self._string_ids: Dict[str, int] = {}
+        self._string_offsets: List[int] = [0]
+        self._string_bytes = bytearray()
+        self._station_rows: Dict[str, int] = {}
+        self._stations = numpy.zeros(1024, dtype=STATION)
+        stations = dock_handler.journal.stations
+        if isinstance(stations, (LazyStations, StationTable)):
+            # Straight from the store's columns, leaving the stations unbuilt
+            self._set_stations(stations.field_values())
+        else:
+            for key, station in stations.items():
+                self._set_station(key, station)
+        dock_handler.station_listeners.append(self._set_station)
+
+        self._file = self._open()
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._generation = GENERATION.unpack_from(self._map, GENERATION_OFFSET)[0]
+
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _open(self):
+        """The file, carrying on from what's there if it's one of ours"""
+        if os.path.exists(self.path):
+            export_file = open(self.path, "r+b")
+            if export_file.read(len(MAGIC)) == MAGIC:
+                return export_file
+            export_file.close()
+        export_file = open(self.path, "w+b")
+        header = numpy.zeros(1, dtype=HEADER)
+        header["magic"] = MAGIC
+        header["version"] = FORMAT_VERSION
+        header["header_size"] = HEADER.itemsize
+        header["file_size"] = HEADER.itemsize
+        export_file.write(header.tobytes())
+        export_file.flush()
+        return export_file
+
+    def _string(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = len(self._string_ids)
+            self._string_ids[value] = string_id
+            self._string_bytes += value.encode()
+            self._string_offsets.append(len(self._string_bytes))
+        return string_id
+
+    def _set_station(self, key: str, station: Station) -> None:
+        """Called by the dock handler whenever it sets a station"""
+        row = self._station_rows.setdefault(key, len(self._station_rows))
+        if row == len(self._stations):
+            grown = numpy.zeros(row * 2, dtype=STATION)
+            grown[:row] = self._stations
+            self._stations = grown
+        record = self._stations[row : row + 1]
+        record["market_id"] = _or_missing(station.market_id)
+        record["system_address"] = _or_missing(station.system_address)
+        record["star_pos"] = station.star_pos or [numpy.nan] * 3
+        record["dist_from_star_ls"] = _or_nan(station.dist_from_star_ls)
+        record["epoch"] = _epoch(station.timestamp)
+        record["system_name"] = self._string(station.system_name)
+        record["station_name"] = self._string(station.station_name)
+        record["station_type"] = self._string(station.station_type)
+        record["station_allegiance"] = self._string(station.station_allegiance)
+
+    def _set_stations(self, values: Dict[str, List]) -> None:
+        """Set the first stations all at once, from each field's values"""
+        keys = values["key"]
+        self._station_rows = dict(zip(keys, range(len(keys))))
+        self._stations = numpy.zeros(max(len(keys), 1024), dtype=STATION)
+        records = self._stations[: len(keys)]
+        records["market_id"] = [_or_missing(value) for value in values["market_id"]]
+        records["system_address"] = [
+            _or_missing(value) for value in values["system_address"]
+        ]
+        records["star_pos"] = [value or [numpy.nan] * 3 for value in values["star_pos"]]
+        records["dist_from_star_ls"] = [
+            _or_nan(value) for value in values["dist_from_star_ls"]
+        ]
+        records["epoch"] = [_epoch(value) for value in values["timestamp"]]
+        for name in (
+            "system_name",
+            "station_name",
+            "station_type",
+            "station_allegiance",
+        ):
+            records[name] = [self._string(value) for value in values[name]]
+
+    def _entries(self) -> Dict[str, numpy.ndarray]:
+        """The commodity and entry records of the best lists"""
+        commodities = sorted(
+            self.stock_handler.stock_summary.commodities,
+            key=lambda commodity: commodity.name.lower(),
+        )
+        commodity_records = numpy.zeros(len(commodities), dtype=COMMODITY)
+        cost_snapshots = []
+        for row, commodity in enumerate(commodities):
+            record = commodity_records[row : row + 1]
+            record["name"] = self._string(commodity.name)
+            record["first_buy"] = len(cost_snapshots)
+            record["buys"] = len(commodity.best_buys)
+            cost_snapshots += commodity.best_buys
+            record["first_sale"] = len(cost_snapshots)
+            record["sales"] = len(commodity.best_sales)
+            cost_snapshots += commodity.best_sales
+
+        entries = numpy.zeros(len(cost_snapshots), dtype=ENTRY)
+        entries["market_id"] = [
+            _or_missing(cost_snapshot.market_id) for cost_snapshot in cost_snapshots
+        ]
+        entries["epoch"] = [cost_snapshot.epoch for cost_snapshot in cost_snapshots]
+        entries["system_name"] = [
+            self._string(cost_snapshot.system_name) for cost_snapshot in cost_snapshots
+        ]
+        entries["station_name"] = [
+            self._string(cost_snapshot.station_name) for cost_snapshot in cost_snapshots
+        ]
+        for name in ("buy_price", "stock", "sell_price", "demand"):
+            entries[name] = [
+                getattr(cost_snapshot, name) for cost_snapshot in cost_snapshots
+            ]
+        return {"commodities": commodity_records, "entries": entries}
+
+    def publish(self) -> bool:
+        """Write the state out, if it's changed, returning true if it was"""
+        with self.state_lock:
+            versions = (self.stock_handler.version, self.dock_handler.version)
+            if versions == self._published_versions:
+                return False
+            sections = self._entries()
+            stations = self._stations[: len(self._station_rows)]
+            sections["stations"] = stations[
+                numpy.argsort(stations["market_id"], kind="stable")
+            ]
+            sections["strings"] = numpy.array(self._string_offsets, dtype="<u4")
+            sections["string_bytes"] = numpy.frombuffer(
+                bytes(self._string_bytes), dtype=numpy.uint8
+            )
+        self._write(sections, versions)
+        self._published_versions = versions
+        self.publishes += 1
+        return True
+
+    def _write(
+        self, sections: Dict[str, numpy.ndarray], versions: Tuple[int, int]
+    ) -> None:
+        offsets = []
+        offset = HEADER.itemsize
+        for name in SECTIONS:
+            offset = _aligned(offset)
+            offsets.append(offset)
+            offset += sections[name].nbytes
+        if offset > len(self._map):
+            self._grow(max(offset, 2 * len(self._map)))
+
+        # Odd, even if a writer stopped mid-write last time and left it odd
+        self._generation = (self._generation + 1) | 1
+        GENERATION.pack_into(self._map, GENERATION_OFFSET, self._generation)
+        for name, start in zip(SECTIONS, offsets):
+            data = sections[name].view(numpy.uint8).data
+            self._map[start : start + len(data)] = data
+
+        header = numpy.zeros(1, dtype=HEADER)
+        header["magic"] = MAGIC
+        header["version"] = FORMAT_VERSION
+        header["header_size"] = HEADER.itemsize
+        header["file_size"] = len(self._map)
+        header["published"] = time()
+        header["stocks_version"], header["docks_version"] = versions
+        header["sections"]["offset"] = offsets
+        # One less than the strings' offsets is the number of strings
+        header["sections"]["count"] = [len(sections[name]) for name in SECTIONS]
+        header["sections"]["count"][0, 0] -= 1
+        # Everything but the generation, which goes last to close the write
+        header_bytes = header.tobytes()
+        after = GENERATION_OFFSET + GENERATION.size
+        self._map[:GENERATION_OFFSET] = header_bytes[:GENERATION_OFFSET]
+        self._map[after : HEADER.itemsize] = header_bytes[after:]
+        self._generation += 1
+        GENERATION.pack_into(self._map, GENERATION_OFFSET, self._generation)
+
+    def _grow(self, size: int) -> None:
+        """Make the file bigger. It's never made smaller, as readers may map it all"""
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def start(self) -> None:
+        self.publish()
+        self._thread = threading.Thread(
+            target=self._run, name="state-export", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop, publishing the state one last time"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.publish()
+        self._map.close()
+        self._file.close()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.publish()
+            except Exception:
+                print(f"Failed to publish {self.path}:\n{traceback.format_exc()}")
+                sys.stdout.flush()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "publishes": self.publishes,
+            "generation": self._generation,
+            "bytes": len(self._map),
+            "strings": len(self._string_ids),
+        }
+
+
+def _or_missing(value: Optional[int]) -> int:
+    return MISSING if value is None else value
+
+
+def _or_nan(value: Optional[float]) -> float:
+    return numpy.nan if value is None else value
+
+
+def _epoch(timestamp: Union[str, datetime]) -> int:
+    # Stations from journal messages carry the datetime the decoder made
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return int(timestamp.timestamp())
+    try:
+        return epoch_seconds(timestamp)
+    except (TypeError, ValueError, OverflowError):
+        return MISSING
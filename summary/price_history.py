@@ -0,0 +1,402 @@
+"""
+A history of every price reported at every market, kept at three resolutions:
+each report as it came, hourly and daily. Each is kept only for as long as
+configured, so the files on disk stay within a size set by the report rate.
+
+Rows are added to an open chunk in memory. Once full, it's sorted by market
+and commodity and written as a .npy file, which is memory mapped to read, so
+a market's history is found by bisecting each file rather than scanning it.
+Hourly and daily buckets are rolled up as each hour and day passes, and are
+all sums, counts and extremes, so buckets of the same hour written at
+different times, say either side of a restart, are simply merged when read.
+"""
+
+import json
+import math
+import numpy
+import os
+
+from dataclasses import dataclass
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+from config.model import HistoryConfig
+from eddn.commodity_v3.model import Message
+
+HOUR = 3600
+DAY = 24 * HOUR
+# How long after an hour ends that reports from it are still waited for,
+# before it's rolled up
+LATE_SECONDS = 600
+
+RAW = numpy.dtype(
+    [
+        ("key", numpy.int64),
+        ("time", numpy.int64),
+        ("buy", numpy.int32),
+        ("stock", numpy.int32),
+        ("sell", numpy.int32),
+        ("demand", numpy.int32),
+    ]
+)
+
+BUCKET = numpy.dtype(
+    [
+        ("key", numpy.int64),
+        ("time", numpy.int64),
+        ("samples", numpy.int32),
+        ("buys", numpy.int32),
+        ("buy_sum", numpy.int64),
+        ("buy_squares", numpy.float64),
+        ("buy_min", numpy.int32),
+        ("buy_max", numpy.int32),
+        ("sells", numpy.int32),
+        ("sell_sum", numpy.int64),
+        ("sell_squares", numpy.float64),
+        ("sell_min", numpy.int32),
+        ("sell_max", numpy.int32),
+        ("stock_sum", numpy.int64),
+        ("demand_sum", numpy.int64),
+    ]
+)
+
+_SUMS = [
+    "samples",
+    "buys",
+    "buy_sum",
+    "buy_squares",
+    "sells",
+    "sell_sum",
+    "sell_squares",
+    "stock_sum",
+    "demand_sum",
+]
+_MINIMUMS = ["buy_min", "sell_min"]
+_MAXIMUMS = ["buy_max", "sell_max"]
+# The minimum of no prices, so any price replaces it
+_NO_MIN = numpy.iinfo(numpy.int32).max
+
+
+def market_key(market_id: int, commodity_id: int) -> int:
+    return market_id << 16 | commodity_id
+
+
+def as_buckets(raw: numpy.ndarray) -> numpy.ndarray:
+    """Each report as a bucket of its own, ready to be combined"""
+    buckets = numpy.zeros(len(raw), dtype=BUCKET)
+    buckets["key"] = raw["key"]
+    buckets["time"] = raw["time"]
+    buckets["samples"] = 1
+    for side in ("buy", "sell"):
+        prices = raw[side]
+        priced = prices != 0
+        buckets[f"{side}s"] = priced
+        buckets[f"{side}_sum"] = prices
+        buckets[f"{side}_squares"] = prices.astype(numpy.float64) ** 2
+        buckets[f"{side}_min"] = numpy.where(priced, prices, _NO_MIN)
+        buckets[f"{side}_max"] = prices
+    buckets["stock_sum"] = raw["stock"]
+    buckets["demand_sum"] = raw["demand"]
+    return buckets
+
+
+def combine(buckets: numpy.ndarray, seconds: int) -> numpy.ndarray:
+    """Merge buckets into one per market, commodity and `seconds` long period"""
+    if not len(buckets):
+        return numpy.zeros(0, dtype=BUCKET)
+    times = buckets["time"] - buckets["time"] % seconds
+    order = numpy.lexsort((times, buckets["key"]))
+    buckets, times = buckets[order], times[order]
+    keys = buckets["key"]
+    starts = numpy.flatnonzero(
+        numpy.concatenate([[True], (keys[1:] != keys[:-1]) | (times[1:] != times[:-1])])
+    )
+    combined = numpy.zeros(len(starts), dtype=BUCKET)
+    combined["key"] = keys[starts]
+    combined["time"] = times[starts]
+    for name in _SUMS:
+        combined[name] = numpy.add.reduceat(buckets[name], starts)
+    for name in _MINIMUMS:
+        combined[name] = numpy.minimum.reduceat(buckets[name], starts)
+    for name in _MAXIMUMS:
+        combined[name] = numpy.maximum.reduceat(buckets[name], starts)
+    return combined
+
+
+class _Tier:
+    """One resolution of the history: sealed chunk files and an open chunk"""
+
+    def __init__(
+        self,
+        folder: str,
+        name: str,
+        dtype: numpy.dtype,
+        chunk_rows: int,
+        retention: float,
+    ) -> None:
+        self.folder = folder
+        self.name = name
+        self.dtype = dtype
+        self.retention = retention
+        self._open = numpy.zeros(chunk_rows, dtype=dtype)
+        self._filled = 0
+        # Each sealed chunk's first and last times, path and rows
+        self._chunks: List[Tuple[int, int, str, numpy.ndarray]] = []
+        self._sequence = 0
+        for file_name in os.listdir(folder):
+            parts = file_name[: -len(".npy")].split("-")
+            if parts[0] == name and file_name.endswith(".npy") and len(parts) == 4:
+                path = os.path.join(folder, file_name)
+                rows = numpy.load(path, mmap_mode="r")
+                self._chunks.append((int(parts[1]), int(parts[2]), path, rows))
+                self._sequence = max(self._sequence, int(parts[3]) + 1)
+        self._chunks.sort()
+
+    def append(self, rows: numpy.ndarray) -> None:
+        while len(rows):
+            taken = min(len(rows), len(self._open) - self._filled)
+            self._open[self._filled : self._filled + taken] = rows[:taken]
+            self._filled += taken
+            rows = rows[taken:]
+            if self._filled == len(self._open):
+                self.seal()
+
+    def seal(self) -> None:
+        """Write the open chunk out, sorted for lookup, and start another"""
+        if not self._filled:
+            return
+        rows = self._open[: self._filled]
+        rows = rows[numpy.lexsort((rows["time"], rows["key"]))]
+        first, last = int(rows["time"].min()), int(rows["time"].max())
+        path = os.path.join(
+            self.folder, f"{self.name}-{first}-{last}-{self._sequence}.npy"
+        )
+        self._sequence += 1
+        # Write beside the file then swap it in, so a crash can't leave it truncated
+        temp_file = f"{path}.tmp"
+        with open(temp_file, "wb") as chunk_file:
+            numpy.save(chunk_file, rows)
+        os.replace(temp_file, path)
+        self._chunks.append((first, last, path, numpy.load(path, mmap_mode="r")))
+        self._filled = 0
+
+    def expire(self, now: float) -> int:
+        """Delete the chunks with nothing newer than the retention, returning how many"""
+        cutoff = now - self.retention
+        expired = [chunk for chunk in self._chunks if chunk[1] < cutoff]
+        for _, _, path, _ in expired:
+            os.remove(path)
+        self._chunks = [chunk for chunk in self._chunks if chunk[1] >= cutoff]
+        return len(expired)
+
+    def rows(self, key: int, since: float) -> numpy.ndarray:
+        """Every row for `key` from `since` on"""
+        found = []
+        for _, last, _, rows in self._chunks:
+            if last < since:
+                continue
+            keys = rows["key"]
+            start = numpy.searchsorted(keys, key, side="left")
+            end = numpy.searchsorted(keys, key, side="right")
+            found.append(numpy.asarray(rows[start:end]))
+        open_rows = self._open[: self._filled]
+        found.append(open_rows[open_rows["key"] == key])
+        rows = numpy.concatenate(found)
+        return rows[rows["time"] >= since]
+
+    def last(self) -> int:
+        """The time of the newest row, or 0 if there are none"""
+        open_rows = self._open[: self._filled]
+        return max(
+            [last for _, last, _, _ in self._chunks] + list(open_rows["time"]),
+            default=0,
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "chunks": len(self._chunks),
+            "rows": sum(len(rows) for *_, rows in self._chunks) + self._filled,
+            "bytes": sum(os.path.getsize(path) for _, _, path, _ in self._chunks),
+        }
+
+
+@dataclass
+class PriceTrend:
+    """How one side of a commodity's price at a market has moved over a while"""
+
+    samples: int
+    mean: Optional[float]
+    # Credits per hour, from a straight line fitted to the hourly means
+    slope: Optional[float]
+    # The standard deviation of every price reported, over their mean
+    volatility: Optional[float]
+
+
+def _trend(buckets: numpy.ndarray, side: str) -> PriceTrend:
+    priced = buckets[buckets[f"{side}s"] > 0]
+    samples = int(priced[f"{side}s"].sum())
+    if not samples:
+        return PriceTrend(samples=0, mean=None, slope=None, volatility=None)
+    mean = float(priced[f"{side}_sum"].sum()) / samples
+    variance = max(float(priced[f"{side}_squares"].sum()) / samples - mean**2, 0.0)
+    slope = None
+    if len(priced) > 1:
+        hourly_means = priced[f"{side}_sum"] / priced[f"{side}s"]
+        slope = float(numpy.polyfit(priced["time"] / HOUR, hourly_means, 1)[0])
+    return PriceTrend(
+        samples=samples,
+        mean=mean,
+        slope=slope,
+        volatility=math.sqrt(variance) / mean if mean else None,
+    )
+
+
+class PriceHistory:
+    """
+    Records the prices of every commodity in each market message, and answers
+    how they've moved. Commodities are numbered in `commodities.json` in the
+    folder, as the files only hold numbers.
+    """
+
+    def __init__(self, config: HistoryConfig) -> None:
+        self.config = config
+        os.makedirs(config.folder, exist_ok=True)
+        # Goes up with every market reported, so readers can tell when to look again
+        self.version = 0
+        self._names_file = os.path.join(config.folder, "commodities.json")
+        self.commodity_ids: Dict[str, int] = {}
+        if os.path.exists(self._names_file):
+            with open(self._names_file) as names_file:
+                for name in json.load(names_file):
+                    self.commodity_ids[name] = len(self.commodity_ids)
+
+        self.raw = _Tier(
+            config.folder, "raw", RAW, config.chunk_rows, config.raw_hours * HOUR
+        )
+        self.hourly = _Tier(
+            config.folder,
+            "hourly",
+            BUCKET,
+            config.chunk_rows,
+            config.hourly_days * DAY,
+        )
+        self.daily = _Tier(
+            config.folder,
+            "daily",
+            BUCKET,
+            config.chunk_rows,
+            config.daily_days * DAY,
+        )
+        # Reports not yet in an hourly bucket, and hours not yet in a daily one
+        self._unrolled_raw: List[numpy.ndarray] = []
+        self._unrolled_hourly: List[numpy.ndarray] = []
+        # The newest report time seen, carried on from the files after a restart
+        self.latest = int(min(self.raw.last(), time()))
+        self._rolled_to = 0
+
+    def _commodity_id(self, name: str) -> int:
+        key = name.lower()
+        commodity_id = self.commodity_ids.get(key)
+        if commodity_id is None:
+            commodity_id = len(self.commodity_ids)
+            self.commodity_ids[key] = commodity_id
+            temp_file = f"{self._names_file}.tmp"
+            with open(temp_file, "w") as names_file:
+                json.dump(list(self.commodity_ids), names_file)
+            os.replace(temp_file, self._names_file)
+        return commodity_id
+
+    def record(self, message: Message, timestamp: float) -> None:
+        """Add the prices of a market message, reported at `timestamp`"""
+        if message.market_id is None or not message.commodities:
+            return
+        # Bogus timestamps from the future are taken as now, so they can't
+        # roll up hours still to come, or stay past their retention
+        timestamp = min(timestamp, time())
+        lines = message.commodities
+        rows = numpy.zeros(len(lines), dtype=RAW)
+        rows["key"] = [
+            market_key(message.market_id, self._commodity_id(line.name))
+            for line in lines
+        ]
+        rows["time"] = int(timestamp)
+        rows["buy"] = [line.buy_price for line in lines]
+        rows["stock"] = [line.stock for line in lines]
+        rows["sell"] = [line.sell_price for line in lines]
+        rows["demand"] = [line.demand for line in lines]
+        self.raw.append(rows)
+        self._unrolled_raw.append(rows)
+        self.latest = max(self.latest, int(timestamp))
+        self.version += 1
+
+        # Roll up every hour that's over, once late reports have had time to arrive
+        complete = self.latest - LATE_SECONDS
+        if complete - complete % HOUR > self._rolled_to:
+            self._roll_up(complete - complete % HOUR)
+
+    def _roll_up(self, until: int) -> None:
+        """Roll reports from before `until` into hours, and whole days into days"""
+        raw = numpy.concatenate(self._unrolled_raw)
+        done = raw["time"] < until
+        self._unrolled_raw = [raw[~done]]
+        hours = combine(as_buckets(raw[done]), HOUR)
+        self.hourly.append(hours)
+        self._unrolled_hourly.append(hours)
+
+        hourly = numpy.concatenate(self._unrolled_hourly)
+        done = hourly["time"] < until - until % DAY
+        self._unrolled_hourly = [hourly[~done]]
+        self.daily.append(combine(hourly[done], DAY))
+        self._rolled_to = until
+
+        for tier in (self.raw, self.hourly, self.daily):
+            tier.expire(self.latest)
+
+    def close(self) -> None:
+        """Roll up and write out everything, to carry on from after a restart"""
+        if self._unrolled_raw:
+            hours = combine(as_buckets(numpy.concatenate(self._unrolled_raw)), HOUR)
+            self.hourly.append(hours)
+            self._unrolled_hourly.append(hours)
+            self._unrolled_raw = []
+        if self._unrolled_hourly:
+            self.daily.append(combine(numpy.concatenate(self._unrolled_hourly), DAY))
+            self._unrolled_hourly = []
+        for tier in (self.raw, self.hourly, self.daily):
+            tier.seal()
+
+    def buckets(
+        self, market_id: int, commodity: str, since: float, seconds: int = HOUR
+    ) -> numpy.ndarray:
+        """
+        The hourly or daily buckets of a commodity at a market from `since` on,
+        including reports not yet rolled up.
+        """
+        commodity_id = self.commodity_ids.get(commodity.lower())
+        if commodity_id is None:
+            return numpy.zeros(0, dtype=BUCKET)
+        key = market_key(market_id, commodity_id)
+        since -= since % seconds
+        tier = self.daily if seconds == DAY else self.hourly
+        found = [tier.rows(key, since)]
+        if seconds == DAY and self._unrolled_hourly:
+            self._unrolled_hourly = [numpy.concatenate(self._unrolled_hourly)]
+            hourly = self._unrolled_hourly[0]
+            found.append(hourly[hourly["key"] == key])
+        if self._unrolled_raw:
+            self._unrolled_raw = [numpy.concatenate(self._unrolled_raw)]
+            raw = self._unrolled_raw[0]
+            found.append(as_buckets(raw[raw["key"] == key]))
+        buckets = combine(numpy.concatenate(found), seconds)
+        return buckets[buckets["time"] >= since]
+
+    def trend(
+        self, market_id: int, commodity: str, hours: float
+    ) -> Tuple[PriceTrend, PriceTrend]:
+        """How the buy and sell prices of a commodity at a market have moved"""
+        since = self.latest - hours * HOUR
+        buckets = self.buckets(market_id, commodity, since)
+        return _trend(buckets, "buy"), _trend(buckets, "sell")
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        return {tier.name: tier.stats() for tier in (self.raw, self.hourly, self.daily)}
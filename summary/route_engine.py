@@ -0,0 +1,290 @@
+"""
+Multi-hop trade routes over the best buys and sales each commodity holds.
+
+Every pairing of a station in a commodity's best buys with one in its best
+sales, at a profit and within jumping distance, is an edge of a graph between
+stations. The graph is kept up to date one commodity at a time, as the stock
+handler reports changes, and searched for the routes earning the most per
+light year travelled.
+"""
+
+import heapq
+import math
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from config.model import RouteConfig
+from summary.dock_handler.journal_v1 import dock_key
+from summary.model import CostSnapshot
+from summary.stock_handler.commodity_v3 import StockHandler
+
+# Hops between stations of the same system are counted as at least this far,
+# so they still cost something to fly
+MIN_HOP_DISTANCE = 1.0
+
+Edge = Tuple[str, str]
+
+
+@dataclass
+class Trade:
+    commodity: str
+    buy_from: CostSnapshot
+    sell_to: CostSnapshot
+    distance: float
+
+    @property
+    def unit_profit(self) -> int:
+        return self.sell_to.sell_price - self.buy_from.buy_price
+
+    def units(self, capacity: int) -> int:
+        """How many units can be carried, bought and sold on one trip"""
+        return min(capacity, self.buy_from.stock, self.sell_to.demand)
+
+    def profit(self, capacity: int) -> int:
+        return self.unit_profit * self.units(capacity)
+
+
+@dataclass
+class Route:
+    trades: List[Trade]
+    profit: int
+    distance: float
+
+    @property
+    def start(self) -> str:
+        buy_from = self.trades[0].buy_from
+        return dock_key(buy_from.system_name, buy_from.station_name)
+
+    @property
+    def is_loop(self) -> bool:
+        sell_to = self.trades[-1].sell_to
+        return dock_key(sell_to.system_name, sell_to.station_name) == self.start
+
+    @property
+    def profit_per_ly(self) -> float:
+        return self.profit / _travelled(self.distance, len(self.trades))
+
+
+def _travelled(distance: float, hops: int) -> float:
+    return max(distance, hops * MIN_HOP_DISTANCE)
+
+
+# A commodity's best buys or sales by station
+_Book = Dict[str, CostSnapshot]
+
+
+def _by_station(cost_snapshots: List[CostSnapshot]) -> _Book:
+    return {
+        dock_key(cost_snapshot.system_name, cost_snapshot.station_name): cost_snapshot
+        for cost_snapshot in cost_snapshots
+    }
+
+
+def _changed(book: _Book, other: _Book) -> Set[str]:
+    """The stations with entries in `book` that aren't the same in `other`"""
+    return {key for key, entry in book.items() if other.get(key) is not entry}
+
+
+# A route while it's being searched: its profit per ly travelled, its profit,
+# the distance travelled, then the edges it follows
+_Partial = Tuple[float, int, float, Tuple[Edge, ...]]
+
+
+class RouteEngine:
+    """
+    Finds trade routes among the stations the stock handler holds prices for.
+
+    Only pairs within `config.max_jump_range` of each other are kept, so one
+    jump of any ship up to that range covers each hop. The graph is brought up
+    to date lazily, for just the commodities changed since the last query.
+    """
+
+    def __init__(self, config: RouteConfig, stock_handler: StockHandler) -> None:
+        self.config = config
+        self.stock_handler = stock_handler
+        # The trades on each edge, by commodity
+        self._edges: Dict[Edge, Dict[str, Trade]] = {}
+        # The stations reachable in a hop from each station, with the distance
+        self._out: Dict[str, Dict[str, float]] = {}
+        # Each commodity's trades, and its best buys and sales as last seen
+        self._trades: Dict[str, Dict[Edge, Trade]] = {}
+        self._books: Dict[str, Tuple[_Book, _Book]] = {}
+        self._systems: Dict[str, List[float]] = {}
+        self._dirty: Set[str] = set(stock_handler.commodity_index)
+        stock_handler.commodity_listeners.append(self._dirty.add)
+
+    def __len__(self) -> int:
+        """How many pairs of stations there's a trade between"""
+        self.refresh()
+        return len(self._edges)
+
+    def refresh(self) -> None:
+        """Bring the graph up to date with the commodities changed since last time"""
+        while self._dirty:
+            name = self._dirty.pop()
+            commodity = self.stock_handler.commodity_index.get(name)
+            if commodity is None:
+                self._update(name, name, {}, {})
+            else:
+                self._update(
+                    name,
+                    commodity.name,
+                    _by_station(commodity.best_buys),
+                    _by_station(commodity.best_sales),
+                )
+
+    def _update(self, name: str, title: str, buys: _Book, sales: _Book) -> None:
+        """
+        Re-pair only the stations whose entries changed. A message changes one
+        station's prices, so this is a few dozen pairs rather than every buy
+        with every sale.
+        """
+        old_buys, old_sales = self._books.get(name, ({}, {}))
+        self._books[name] = (buys, sales)
+        new_buys = _changed(buys, old_buys)
+        new_sales = _changed(sales, old_sales)
+        gone_buys = _changed(old_buys, buys)
+        gone_sales = _changed(old_sales, sales)
+
+        trades = self._trades.setdefault(name, {})
+        for edge in [e for e in trades if e[0] in gone_buys or e[1] in gone_sales]:
+            del trades[edge]
+            self._unlink(edge, name)
+
+        for from_key in new_buys:
+            buy_from = buys[from_key]
+            for to_key, sell_to in sales.items():
+                self._pair(name, title, trades, from_key, buy_from, to_key, sell_to)
+        for to_key in new_sales:
+            sell_to = sales[to_key]
+            for from_key, buy_from in buys.items():
+                if from_key not in new_buys:
+                    self._pair(name, title, trades, from_key, buy_from, to_key, sell_to)
+
+    def _pair(
+        self,
+        name: str,
+        title: str,
+        trades: Dict[Edge, Trade],
+        from_key: str,
+        buy_from: CostSnapshot,
+        to_key: str,
+        sell_to: CostSnapshot,
+    ) -> None:
+        """Add the trade between two stations, if it's profitable and in range"""
+        if sell_to.sell_price <= buy_from.buy_price or to_key == from_key:
+            return
+        from_pos, to_pos = buy_from.star_pos, sell_to.star_pos
+        if from_pos is None or to_pos is None:
+            return
+        distance = math.dist(from_pos, to_pos)
+        if distance > self.config.max_jump_range:
+            return
+        edge = (from_key, to_key)
+        trade = Trade(title, buy_from, sell_to, distance)
+        trades[edge] = trade
+        self._edges.setdefault(edge, {})[name] = trade
+        self._out.setdefault(from_key, {})[to_key] = distance
+        self._systems[buy_from.system_name] = from_pos
+        self._systems[sell_to.system_name] = to_pos
+
+    def _unlink(self, edge: Edge, name: str) -> None:
+        trades = self._edges[edge]
+        del trades[name]
+        if not trades:
+            del self._edges[edge]
+            out = self._out[edge[0]]
+            del out[edge[1]]
+            if not out:
+                del self._out[edge[0]]
+
+    def system_position(self, system: str) -> Optional[List[float]]:
+        """Where a system is, if any station in it is known"""
+        if system in self._systems:
+            return self._systems[system]
+        dock_handler = self.stock_handler.dock_handler
+        key = dock_handler.system_keys.get(system)
+        return None if key is None else dock_handler.spatial_index.position(key)
+
+    def routes(
+        self,
+        start_system: str,
+        jump_range: float,
+        capacity: int,
+        hops: int,
+        count: int = 5,
+        loop: bool = False,
+    ) -> List[Route]:
+        """
+        The `count` routes of `hops` trades earning the most per ly, starting
+        from a station in or a jump away from `start_system`. With `loop`, only
+        routes ending back at the station they started from.
+        """
+        self.refresh()
+        position = self.system_position(start_system)
+        # A loop takes at least two hops, as no trade is to the same station
+        if position is None or hops < (2 if loop else 1) or capacity < 1:
+            return []
+        jump_range = min(jump_range, self.config.max_jump_range)
+        start_keys = {
+            key
+            for _, key in self.stock_handler.dock_handler.spatial_index.within(
+                position, jump_range
+            )
+            if key in self._out
+        }
+
+        # The best trade on each edge a query reaches, worked out once
+        best: Dict[Edge, Tuple[int, Trade]] = {}
+
+        def best_trade(edge: Edge) -> Tuple[int, Trade]:
+            if edge not in best:
+                trade = max(
+                    self._edges[edge].values(),
+                    key=lambda trade: trade.profit(capacity),
+                )
+                best[edge] = (trade.profit(capacity), trade)
+            return best[edge]
+
+        partials: List[_Partial] = [(0.0, 0, 0.0, ())]
+        for hop in range(hops):
+            last_hop = hop == hops - 1
+            extended = []
+            for _, profit, distance, path in partials:
+                here_keys = start_keys if not path else (path[-1][1],)
+                for here in here_keys:
+                    for there, hop_distance in self._out.get(here, {}).items():
+                        if hop_distance > jump_range:
+                            continue
+                        if loop and last_hop and there != path[0][0]:
+                            continue
+                        edge = (here, there)
+                        hop_profit, _ = best_trade(edge)
+                        if hop_profit <= 0:
+                            continue
+                        total = profit + hop_profit
+                        travelled = distance + hop_distance
+                        extended.append(
+                            (
+                                total / _travelled(travelled, hop + 1),
+                                total,
+                                travelled,
+                                path + (edge,),
+                            )
+                        )
+            partials = heapq.nlargest(self.config.beam_width, extended)
+
+        routes = []
+        seen = set()
+        for _, profit, distance, path in partials:
+            # The same loop is found again from each of its stations
+            if loop:
+                if frozenset(path) in seen:
+                    continue
+                seen.add(frozenset(path))
+            trades = [best_trade(edge)[1] for edge in path]
+            routes.append(Route(trades=trades, profit=profit, distance=distance))
+            if len(routes) == count:
+                break
+        return routes
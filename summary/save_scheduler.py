@@ -0,0 +1,47 @@
+from time import monotonic
+from typing import Callable, Dict, List
+
+from config.model import AutosaveConfig
+
+
+class SaveScheduler:
+    """
+    Decides when to save from when things changed, rather than from how many
+    messages have arrived.
+
+    Once something is marked dirty, a save is due when nothing more has
+    changed for `min_interval` seconds, or at the latest `max_interval` seconds
+    after the first unsaved change. Everything dirty is saved together.
+    """
+
+    def __init__(
+        self, config: AutosaveConfig, clock: Callable[[], float] = monotonic
+    ) -> None:
+        self.config = config
+        self._clock = clock
+        self._dirty: Dict[str, None] = {}
+        self._first_change = 0.0
+        self._last_change = 0.0
+
+    def mark_dirty(self, name: str) -> None:
+        now = self._clock()
+        if not self._dirty:
+            self._first_change = now
+        self._last_change = now
+        self._dirty[name] = None
+
+    def is_dirty(self) -> bool:
+        return bool(self._dirty)
+
+    def due(self) -> List[str]:
+        """The names to save now, if it's time, which are then no longer dirty"""
+        if not self._dirty:
+            return []
+        now = self._clock()
+        if (
+            now - self._last_change < self.config.min_interval
+            and now - self._first_change < self.config.max_interval
+        ):
+            return []
+        due, self._dirty = list(self._dirty), {}
+        return due
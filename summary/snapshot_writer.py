@@ -0,0 +1,116 @@
+import os
+import sys
+import threading
+import traceback
+
+from time import perf_counter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class SaveStats:
+    """Counters for the saves of one file"""
+
+    def __init__(self) -> None:
+        self.saves = 0
+        self.skipped = 0
+        self.superseded = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+        self.last_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_bytes = 0
+        self.total_bytes = 0
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "saves": self.saves,
+            "skipped": self.skipped,
+            "superseded": self.superseded,
+            "failed": self.failed,
+            "mean_ms": round(1000 * self.total_seconds / (self.saves or 1), 3),
+            "last_ms": round(1000 * self.last_seconds, 3),
+            "max_ms": round(1000 * self.max_seconds, 3),
+            "last_bytes": self.last_bytes,
+            "total_bytes": self.total_bytes,
+        }
+
+
+class SnapshotWriter:
+    """
+    Writes snapshots to file on a background thread.
+
+    The caller hands over a copy of the state it wants saved and carries on.
+    If a file's previous snapshot is still waiting to be written when a new one
+    arrives, only the newer one is written.
+    """
+
+    def __init__(self) -> None:
+        self.stats: Dict[str, SaveStats] = {}
+        self._pending: Dict[str, Tuple[Callable[[str, Any], None], Any]] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def _stats_for(self, path: str) -> SaveStats:
+        return self.stats.setdefault(path, SaveStats())
+
+    def submit(self, path: str, save: Callable[[str, Any], None], snapshot: Any):
+        """Queue `save(path, snapshot)` to be run in the background"""
+        with self._cond:
+            if path in self._pending:
+                self._stats_for(path).superseded += 1
+            self._pending[path] = (save, snapshot)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="snapshot-writer", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+    def skip(self, path: str) -> None:
+        """Count a save that wasn't needed as nothing had changed"""
+        with self._cond:
+            self._stats_for(path).skipped += 1
+
+    def close(self) -> None:
+        """Write anything still pending, then stop"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                path = next(iter(self._pending))
+                save, snapshot = self._pending.pop(path)
+
+            started = perf_counter()
+            try:
+                save(path, snapshot)
+            except Exception:
+                print(f"Failed to save {path}:\n{traceback.format_exc()}")
+                sys.stdout.flush()
+                with self._cond:
+                    self._stats_for(path).failed += 1
+                continue
+            seconds = perf_counter() - started
+            size = os.path.getsize(path)
+
+            with self._cond:
+                stats = self._stats_for(path)
+                stats.saves += 1
+                stats.total_seconds += seconds
+                stats.last_seconds = seconds
+                stats.max_seconds = max(stats.max_seconds, seconds)
+                stats.last_bytes = size
+                stats.total_bytes += size
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        with self._cond:
+            return {path: stats.summary() for path, stats in self.stats.items()}
@@ -0,0 +1,155 @@
+"""
+A uniform grid over station star positions, for finding the stations near a
+point without measuring the distance to every one of them.
+"""
+
+import math
+import numpy
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Wide enough that a cell holds a handful of systems in the populated bubble
+DEFAULT_CELL_SIZE = 50.0
+
+Cell = Tuple[int, int, int]
+
+
+class SpatialIndex:
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE) -> None:
+        self.cell_size = cell_size
+        self._points = numpy.empty((1024, 3))
+        self._keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._cells: Dict[Cell, List[int]] = {}
+        self._lower = numpy.full(3, math.inf)
+        self._upper = numpy.full(3, -math.inf)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def _cell(self, point: Sequence[float]) -> Cell:
+        size = self.cell_size
+        return (
+            math.floor(point[0] / size),
+            math.floor(point[1] / size),
+            math.floor(point[2] / size),
+        )
+
+    def add(self, key: str, star_pos: Optional[Sequence[float]]) -> None:
+        """Add or move the station `key`. Stations without a position are left out"""
+        if star_pos is None:
+            return
+        row = self._rows.get(key)
+        if row is not None:
+            if tuple(self._points[row]) == tuple(star_pos):
+                return
+            self._cells[self._cell(self._points[row])].remove(row)
+        else:
+            row = len(self._keys)
+            if row == len(self._points):
+                self._points = numpy.concatenate([self._points, self._points])
+            self._keys.append(key)
+            self._rows[key] = row
+
+        self._points[row] = star_pos
+        self._cells.setdefault(self._cell(star_pos), []).append(row)
+        self._lower = numpy.minimum(self._lower, star_pos)
+        self._upper = numpy.maximum(self._upper, star_pos)
+
+    def add_many(self, keys: Sequence[str], star_positions: numpy.ndarray) -> None:
+        """Add stations in bulk, skipping any whose position is NaN"""
+        known = ~numpy.isnan(star_positions[:, 0])
+        keys = [key for key, is_known in zip(keys, known.tolist()) if is_known]
+        points = star_positions[known]
+        if not keys:
+            return
+        if self._keys or len(set(keys)) != len(keys):
+            for key, star_pos in zip(keys, points.tolist()):
+                self.add(key, star_pos)
+            return
+
+        # Starting empty, so the grid can be filled a cell at a time
+        self._points = numpy.concatenate([points, numpy.empty((len(points) + 1, 3))])
+        self._keys = keys
+        self._rows = dict(zip(keys, range(len(keys))))
+        cells = numpy.floor(points / self.cell_size).astype(numpy.int64)
+        order = numpy.lexsort((cells[:, 2], cells[:, 1], cells[:, 0]))
+        cells = cells[order]
+        starts = numpy.flatnonzero(numpy.any(cells[1:] != cells[:-1], axis=1)) + 1
+        for start, end in zip([0, *starts.tolist()], [*starts.tolist(), len(order)]):
+            self._cells[tuple(cells[start].tolist())] = order[start:end].tolist()
+        self._lower = points.min(axis=0)
+        self._upper = points.max(axis=0)
+
+    def position(self, key: str) -> Optional[List[float]]:
+        row = self._rows.get(key)
+        return None if row is None else self._points[row].tolist()
+
+    def distance(self, key: str, point: Sequence[float]) -> Optional[float]:
+        """The distance from station `key` to `point`, if the station is known"""
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        return math.dist(self._points[row].tolist(), point)
+
+    def distance_between(self, key: str, other_key: str) -> Optional[float]:
+        other = self.position(other_key)
+        return None if other is None else self.distance(key, other)
+
+    def within(self, point: Sequence[float], radius: float) -> List[Tuple[float, str]]:
+        """The (distance, key) of every station within `radius` of `point`, nearest first"""
+        rows = self._rows_near(point, radius)
+        if not rows:
+            return []
+        distances = numpy.linalg.norm(self._points[rows] - point, axis=1)
+        found = [
+            (distance, self._keys[row])
+            for distance, row in zip(distances.tolist(), rows)
+            if distance <= radius
+        ]
+        found.sort()
+        return found
+
+    def nearest(self, point: Sequence[float], count: int) -> List[Tuple[float, str]]:
+        """The (distance, key) of the `count` stations nearest `point`, nearest first"""
+        if not self._keys or count <= 0:
+            return []
+        # Widen the search until it finds enough, or covers every station
+        radius = self.cell_size
+        furthest = numpy.linalg.norm(
+            numpy.maximum(
+                numpy.abs(self._lower - point), numpy.abs(self._upper - point)
+            )
+        )
+        while True:
+            found = self.within(point, radius)
+            if len(found) >= count or radius >= furthest:
+                return found[:count]
+            radius *= 2
+
+    def _rows_near(self, point: Sequence[float], radius: float) -> List[int]:
+        """Rows in the cells that the sphere's bounding box touches"""
+        lowest = self._cell([axis - radius for axis in point])
+        highest = self._cell([axis + radius for axis in point])
+        spans = [high - low + 1 for low, high in zip(lowest, highest)]
+        if spans[0] * spans[1] * spans[2] > len(self._cells):
+            # Fewer occupied cells than cells to check, so check those instead
+            return [
+                row
+                for cell, rows in self._cells.items()
+                if all(
+                    low <= axis <= high
+                    for low, axis, high in zip(lowest, cell, highest)
+                )
+                for row in rows
+            ]
+
+        rows = []
+        for x in range(lowest[0], highest[0] + 1):
+            for y in range(lowest[1], highest[1] + 1):
+                for z in range(lowest[2], highest[2] + 1):
+                    rows.extend(self._cells.get((x, y, z), ()))
+        return rows
@@ -0,0 +1,462 @@
+import numpy
+import os
+import sqlite3
+
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from config.model import Config
+from eddn.commodity_v3.model import Message
+from summary.dock_handler import storage as journal_storage
+from summary.model import Commodity, CostSnapshot, DockSummary, Station, StockSummary
+from summary.station_registry import STATIONS
+from summary.stock_handler import storage as commodity_storage
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stations (
+    key TEXT PRIMARY KEY,
+    market_id INTEGER,
+    system_address INTEGER,
+    system_name TEXT,
+    station_name TEXT,
+    station_type TEXT,
+    star_x REAL,
+    star_y REAL,
+    star_z REAL,
+    dist_from_star_ls REAL,
+    station_allegiance TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS stations_market_id ON stations (market_id);
+CREATE INDEX IF NOT EXISTS stations_system_address ON stations (system_address);
+
+CREATE TABLE IF NOT EXISTS markets (
+    market_id INTEGER PRIMARY KEY,
+    system_name TEXT,
+    station_name TEXT,
+    timestamp TEXT
+);
+
+CREATE TABLE IF NOT EXISTS prices (
+    market_id INTEGER,
+    commodity TEXT,
+    buy_price INTEGER,
+    stock INTEGER,
+    sell_price INTEGER,
+    demand INTEGER,
+    timestamp TEXT,
+    PRIMARY KEY (market_id, commodity)
+);
+CREATE INDEX IF NOT EXISTS prices_commodity ON prices (commodity);
+
+CREATE TABLE IF NOT EXISTS commodities (
+    name TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS best_prices (
+    commodity TEXT,
+    side TEXT,
+    rank INTEGER,
+    system_name TEXT,
+    station_name TEXT,
+    timestamp TEXT,
+    buy_price INTEGER,
+    stock INTEGER,
+    sell_price INTEGER,
+    demand INTEGER,
+    market_id INTEGER,
+    star_x REAL,
+    star_y REAL,
+    star_z REAL,
+    station_type TEXT,
+    system_address INTEGER,
+    dist_from_star_ls REAL,
+    station_allegiance TEXT,
+    PRIMARY KEY (commodity, side, rank)
+);
+CREATE INDEX IF NOT EXISTS best_prices_market_id ON best_prices (market_id);
+"""
+
+_STATION_COLUMNS = (
+    "market_id, system_address, system_name, station_name, station_type,"
+    " star_x, star_y, star_z, dist_from_star_ls, station_allegiance, timestamp"
+)
+
+_BEST_PRICE_COLUMNS = (
+    "system_name, station_name, timestamp, buy_price, stock, sell_price, demand,"
+    " market_id, star_x, star_y, star_z, station_type, system_address,"
+    " dist_from_star_ls, station_allegiance"
+)
+
+BUYS = "buy"
+SALES = "sell"
+
+
+def _split_star_pos(star_pos) -> Tuple:
+    if not star_pos:
+        return (None, None, None)
+    return tuple(star_pos)
+
+
+def _join_star_pos(x, y, z):
+    return None if x is None else [x, y, z]
+
+
+def _station_row(key: str, station: Station) -> Tuple:
+    return (
+        key,
+        station.market_id,
+        station.system_address,
+        station.system_name,
+        station.station_name,
+        station.station_type,
+        *_split_star_pos(station.star_pos),
+        station.dist_from_star_ls,
+        station.station_allegiance,
+        str(station.timestamp),
+    )
+
+
+def _station_from_row(row: Tuple) -> Station:
+    (
+        market_id,
+        system_address,
+        system_name,
+        station_name,
+        station_type,
+        star_x,
+        star_y,
+        star_z,
+        dist_from_star_ls,
+        station_allegiance,
+        timestamp,
+    ) = row
+    station = Station(
+        market_id=market_id,
+        star_pos=_join_star_pos(star_x, star_y, star_z),
+        station_name=station_name,
+        station_type=station_type,
+        system_address=system_address,
+        system_name=system_name,
+        timestamp=timestamp,
+        dist_from_star_ls=dist_from_star_ls,
+        station_allegiance=station_allegiance,
+    )
+    # The database keeps it, so the registry needn't once nothing else does
+    STATIONS.release(station.info)
+    return station
+
+
+def _best_price_row(name: str, side: str, rank: int, cost_snapshot: CostSnapshot):
+    return (
+        name,
+        side,
+        rank,
+        cost_snapshot.system_name,
+        cost_snapshot.station_name,
+        cost_snapshot.timestamp,
+        cost_snapshot.buy_price,
+        cost_snapshot.stock,
+        cost_snapshot.sell_price,
+        cost_snapshot.demand,
+        cost_snapshot.market_id,
+        *_split_star_pos(cost_snapshot.star_pos),
+        cost_snapshot.station_type,
+        cost_snapshot.system_address,
+        cost_snapshot.dist_from_star_ls,
+        cost_snapshot.station_allegiance,
+    )
+
+
+def _cost_snapshot_from_row(row: Tuple) -> CostSnapshot:
+    (
+        system_name,
+        station_name,
+        timestamp,
+        buy_price,
+        stock,
+        sell_price,
+        demand,
+        market_id,
+        star_x,
+        star_y,
+        star_z,
+        station_type,
+        system_address,
+        dist_from_star_ls,
+        station_allegiance,
+    ) = row
+    cost_snapshot = CostSnapshot(
+        system_name=system_name,
+        station_name=station_name,
+        timestamp=timestamp,
+        buy_price=buy_price,
+        stock=stock,
+        sell_price=sell_price,
+        demand=demand,
+        market_id=market_id,
+        star_pos=_join_star_pos(star_x, star_y, star_z),
+        station_type=station_type,
+        system_address=system_address,
+        dist_from_star_ls=dist_from_star_ls,
+        station_allegiance=station_allegiance,
+    )
+    STATIONS.release(cost_snapshot.info)
+    return cost_snapshot
+
+
+class StationTable:
+    """
+    A dict-like view of the stations table, to stand in for
+    `DockSummary.stations`. Only the most recently used `cache_size` stations
+    are kept in memory; the rest are read from the database when asked for.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, cache_size: int) -> None:
+        self._connection = connection
+        self._cache: "OrderedDict[str, Station]" = OrderedDict()
+        self.cache_size = cache_size
+
+    def _remember(self, key: str, station: Station) -> None:
+        replaced = self._cache.get(key)
+        if replaced is not None and replaced.info is not station.info:
+            STATIONS.release(replaced.info)
+        self._cache[key] = station
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            STATIONS.release(self._cache.popitem(last=False)[1].info)
+
+    def __getitem__(self, key: str) -> Station:
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        row = self._connection.execute(
+            f"SELECT {_STATION_COLUMNS} FROM stations WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        station = _station_from_row(row)
+        self._remember(key, station)
+        return station
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key: str, station: Station) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO stations"
+            f" (key, {_STATION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            _station_row(key, station),
+        )
+        self._remember(key, station)
+
+    def __delitem__(self, key: str) -> None:
+        self._connection.execute("DELETE FROM stations WHERE key = ?", (key,))
+        station = self._cache.pop(key, None)
+        if station is not None:
+            STATIONS.release(station.info)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM stations").fetchone()[0]
+
+    def __iter__(self) -> Iterator[str]:
+        keys = self._connection.execute("SELECT key FROM stations").fetchall()
+        return (key for (key,) in keys)
+
+    def keys(self) -> Iterator[str]:
+        return iter(self)
+
+    def values(self) -> Iterator[Station]:
+        return (station for _, station in self.items())
+
+    def items(self) -> Iterator[Tuple[str, Station]]:
+        rows = self._connection.execute(
+            f"SELECT key, {_STATION_COLUMNS} FROM stations"
+        ).fetchall()
+        return ((row[0], _station_from_row(row[1:])) for row in rows)
+
+    def star_positions(self) -> Tuple[List[str], numpy.ndarray]:
+        """Every key with its star position, without building the stations"""
+        rows = self._connection.execute(
+            "SELECT key, star_x, star_y, star_z FROM stations"
+        ).fetchall()
+        keys = [row[0] for row in rows]
+        # None, for stations with no position, becomes NaN
+        star_positions = numpy.array([row[1:] for row in rows], dtype=float).reshape(
+            len(rows), 3
+        )
+        return keys, star_positions
+
+    def field_values(self) -> Dict[str, List]:
+        """
+        Every station's values of each `Station` field, and the keys under
+        "key", in the same order, without building the stations
+        """
+        rows = self._connection.execute(
+            f"SELECT key, {_STATION_COLUMNS} FROM stations"
+        ).fetchall()
+        names = ["key", *(name.strip() for name in _STATION_COLUMNS.split(","))]
+        values = {
+            name: [row[index] for row in rows] for index, name in enumerate(names)
+        }
+        values["star_pos"] = [
+            _join_star_pos(*star_pos)
+            for star_pos in zip(
+                values.pop("star_x"), values.pop("star_y"), values.pop("star_z")
+            )
+        ]
+        return values
+
+    def for_market(self, market_id: int) -> List[Station]:
+        rows = self._connection.execute(
+            f"SELECT {_STATION_COLUMNS} FROM stations WHERE market_id = ?",
+            (market_id,),
+        ).fetchall()
+        return [_station_from_row(row) for row in rows]
+
+    def in_system(self, system_address: int) -> List[Station]:
+        rows = self._connection.execute(
+            f"SELECT {_STATION_COLUMNS} FROM stations WHERE system_address = ?",
+            (system_address,),
+        ).fetchall()
+        return [_station_from_row(row) for row in rows]
+
+
+class SqliteStore:
+    """
+    Keeps docks, best prices and every market's latest prices in SQLite.
+
+    Writes are made as changes happen but only committed on save, so each
+    save is a single batched transaction. If the database is new, any
+    existing JSON dock and stock files are imported into it.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.dock_file = config.dock.file_path
+        self.stock_file = config.stock.file_path
+        self.database_file = config.storage.sqlite_file
+        self.station_cache_size = config.storage.station_cache_size
+
+        is_new = not os.path.exists(self.database_file)
+        self.connection = sqlite3.connect(self.database_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(_SCHEMA)
+        self._import_json = is_new
+        self._stock_changes: Dict[str, None] = {}
+
+    def load_docks(self) -> DockSummary:
+        stations = StationTable(self.connection, cache_size=self.station_cache_size)
+        if self._import_json:
+            for key, station in journal_storage.load(self.dock_file).stations.items():
+                stations[key] = station
+            self.connection.commit()
+        return DockSummary(stations=stations)
+
+    def load_stocks(self) -> StockSummary:
+        if self._import_json:
+            summary = commodity_storage.load(self.stock_file)
+            self._write_best_prices(summary, [c.name for c in summary.commodities])
+            self.connection.commit()
+
+        summary = StockSummary()
+        by_name = {}
+        for (name,) in self.connection.execute(
+            "SELECT name FROM commodities ORDER BY rowid"
+        ):
+            by_name[name] = Commodity(name=name, best_buys=[], best_sales=[])
+            summary.commodities.append(by_name[name])
+        for name, side, *row in self.connection.execute(
+            f"SELECT commodity, side, {_BEST_PRICE_COLUMNS} FROM best_prices"
+            " ORDER BY commodity, side, rank"
+        ):
+            commodity = by_name[name]
+            best = commodity.best_buys if side == BUYS else commodity.best_sales
+            best.append(_cost_snapshot_from_row(row))
+        return summary
+
+    def market_received(self, message: Message) -> bool:
+        """Record every price from a market message"""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO markets"
+            " (market_id, system_name, station_name, timestamp) VALUES (?, ?, ?, ?)",
+            (
+                message.market_id,
+                message.system_name,
+                message.station_name,
+                message.timestamp,
+            ),
+        )
+        self.connection.execute(
+            "DELETE FROM prices WHERE market_id = ?", (message.market_id,)
+        )
+        self.connection.executemany(
+            "INSERT INTO prices (market_id, commodity, buy_price, stock,"
+            " sell_price, demand, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    message.market_id,
+                    commodity.name.lower(),
+                    commodity.buy_price,
+                    commodity.stock,
+                    commodity.sell_price,
+                    commodity.demand,
+                    message.timestamp,
+                )
+                for commodity in message.commodities
+            ],
+        )
+        return True
+
+    def docks_changed(self, summary: DockSummary, keys: Iterable[str]) -> None:
+        """Stations are written as they are set, so only need committing"""
+        pass
+
+    def stocks_changed(self, summary: StockSummary, names: Iterable[str]) -> None:
+        self._stock_changes.update(dict.fromkeys(names))
+
+    def save_docks(self, summary: DockSummary) -> None:
+        self.connection.commit()
+
+    def save_stocks(self, summary: StockSummary) -> None:
+        changes, self._stock_changes = self._stock_changes, {}
+        self._write_best_prices(summary, changes)
+        self.connection.commit()
+
+    def _write_best_prices(self, summary: StockSummary, names: Iterable[str]) -> None:
+        by_name = {
+            commodity.name.lower(): commodity for commodity in summary.commodities
+        }
+        for name in names:
+            commodity = by_name[name.lower()]
+            self.connection.execute(
+                "INSERT OR IGNORE INTO commodities (name) VALUES (?)", (commodity.name,)
+            )
+            self.connection.execute(
+                "DELETE FROM best_prices WHERE commodity = ?", (commodity.name,)
+            )
+            self.connection.executemany(
+                f"INSERT INTO best_prices (commodity, side, rank, {_BEST_PRICE_COLUMNS})"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    _best_price_row(commodity.name, BUYS, rank, buy)
+                    for rank, buy in enumerate(commodity.best_buys)
+                ]
+                + [
+                    _best_price_row(commodity.name, SALES, rank, sale)
+                    for rank, sale in enumerate(commodity.best_sales)
+                ],
+            )
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        return {}
@@ -0,0 +1,284 @@
+"""
+The live stocks and docks, published to a memory mapped file that other
+processes can map read only and query in place, without parsing anything.
+
+The file starts with a fixed header, followed by sections of fixed size
+records, each at an offset the header gives:
+
+  strings       uint32 offsets into the string bytes, one more than strings
+  string bytes  every string, UTF-8 encoded, end to end
+  stations      STATION records, sorted by market id
+  commodities   COMMODITY records, sorted by lower case name
+  entries       ENTRY records, each commodity's best buys then best sales
+
+Strings are stored once each and referred to by number, -1 for none. They
+are only ever added to, so a string's number stays the same as long as the
+slurper runs. Numbers are little endian.
+
+The slurper is the only writer. It makes the header's generation odd before
+changing anything and even again after, so a reader that sees the same even
+generation before and after its query knows nothing changed under it. The
+file only ever grows, so readers' mappings stay valid, and it's rewritten in
+place rather than replaced, so readers needn't reopen it.
+
+Only numpy is needed to read the file, so other programs can import this
+module without the slurper's settings.
+"""
+
+import mmap
+import numpy
+import struct
+
+from time import sleep
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+MAGIC = b"EDSSTATE"
+FORMAT_VERSION = 1
+
+SECTIONS = ("strings", "string_bytes", "stations", "commodities", "entries")
+
+HEADER = numpy.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("header_size", "<u4"),
+        # Odd while the file is being written
+        ("generation", "<u8"),
+        ("file_size", "<u8"),
+        ("published", "<f8"),
+        ("stocks_version", "<u8"),
+        ("docks_version", "<u8"),
+        # The offset and the number of items of each section
+        ("sections", [("offset", "<u8"), ("count", "<u8")], (len(SECTIONS),)),
+    ]
+)
+# Read and written on its own, as the seqlock
+GENERATION = struct.Struct("<Q")
+GENERATION_OFFSET = HEADER.fields["generation"][1]
+
+STATION = numpy.dtype(
+    [
+        ("market_id", "<i8"),
+        ("system_address", "<i8"),
+        ("star_pos", "<f8", (3,)),
+        ("dist_from_star_ls", "<f8"),
+        ("epoch", "<i8"),
+        ("system_name", "<i4"),
+        ("station_name", "<i4"),
+        ("station_type", "<i4"),
+        ("station_allegiance", "<i4"),
+    ]
+)
+
+COMMODITY = numpy.dtype(
+    [
+        ("name", "<i4"),
+        ("first_buy", "<u4"),
+        ("buys", "<u4"),
+        ("first_sale", "<u4"),
+        ("sales", "<u4"),
+    ]
+)
+
+ENTRY = numpy.dtype(
+    [
+        ("market_id", "<i8"),
+        ("epoch", "<i8"),
+        ("system_name", "<i4"),
+        ("station_name", "<i4"),
+        ("buy_price", "<i4"),
+        ("stock", "<i4"),
+        ("sell_price", "<i4"),
+        ("demand", "<i4"),
+    ]
+)
+
+# Market ids, system addresses and report times that aren't known
+MISSING = -1
+
+T = TypeVar("T")
+
+
+class StateView:
+    """
+    The sections of one generation of the file, as numpy arrays over the
+    mapping itself. Only valid until the writer next publishes, which
+    `StateReader.read` checks for.
+    """
+
+    def __init__(self, buffer: mmap.mmap, header: numpy.void) -> None:
+        self.header = header
+        sections = {
+            name: (int(section["offset"]), int(section["count"]))
+            for name, section in zip(SECTIONS, header["sections"])
+        }
+
+        def section(name: str, dtype, count: int) -> numpy.ndarray:
+            return numpy.frombuffer(
+                buffer, dtype=dtype, count=count, offset=sections[name][0]
+            )
+
+        string_count = sections["strings"][1]
+        self.string_offsets = section("strings", "<u4", string_count + 1)
+        self.string_bytes = memoryview(buffer)[
+            sections["string_bytes"][0] : sections["string_bytes"][0]
+            + sections["string_bytes"][1]
+        ]
+        self.stations = section("stations", STATION, sections["stations"][1])
+        self.commodities = section("commodities", COMMODITY, sections["commodities"][1])
+        self.entries = section("entries", ENTRY, sections["entries"][1])
+
+    def string(self, string_id: int) -> Optional[str]:
+        if string_id < 0:
+            return None
+        start, end = self.string_offsets[string_id : string_id + 2]
+        return bytes(self.string_bytes[start:end]).decode()
+
+    def commodity_names(self) -> List[str]:
+        return [self.string(name) for name in self.commodities["name"].tolist()]
+
+    def find_commodity(self, name: str) -> Optional[numpy.void]:
+        """The commodity's record, by bisecting the names"""
+        key = name.lower()
+        low, high = 0, len(self.commodities)
+        while low < high:
+            middle = (low + high) // 2
+            if self.string(int(self.commodities[middle]["name"])).lower() < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.commodities):
+            record = self.commodities[low]
+            if self.string(int(record["name"])).lower() == key:
+                return record
+        return None
+
+    def best_buys(self, commodity: numpy.void) -> numpy.ndarray:
+        start = int(commodity["first_buy"])
+        return self.entries[start : start + int(commodity["buys"])]
+
+    def best_sales(self, commodity: numpy.void) -> numpy.ndarray:
+        start = int(commodity["first_sale"])
+        return self.entries[start : start + int(commodity["sales"])]
+
+    def find_station(self, market_id: int) -> Optional[numpy.void]:
+        market_ids = self.stations["market_id"]
+        row = int(numpy.searchsorted(market_ids, market_id))
+        if row < len(market_ids) and market_ids[row] == market_id:
+            return self.stations[row]
+        return None
+
+    def entry(self, entry: numpy.void) -> Dict[str, Any]:
+        """An entry as a dict, with its names looked up"""
+        return {
+            "system_name": self.string(int(entry["system_name"])),
+            "station_name": self.string(int(entry["station_name"])),
+            "market_id": _or_none(int(entry["market_id"])),
+            "epoch": _or_none(int(entry["epoch"])),
+            "buy_price": int(entry["buy_price"]),
+            "stock": int(entry["stock"]),
+            "sell_price": int(entry["sell_price"]),
+            "demand": int(entry["demand"]),
+        }
+
+    def station(self, station: numpy.void) -> Dict[str, Any]:
+        """A station as a dict, with its names looked up"""
+        star_pos = station["star_pos"].tolist()
+        dist_from_star_ls = float(station["dist_from_star_ls"])
+        return {
+            "market_id": _or_none(int(station["market_id"])),
+            "system_address": _or_none(int(station["system_address"])),
+            "system_name": self.string(int(station["system_name"])),
+            "station_name": self.string(int(station["station_name"])),
+            "station_type": self.string(int(station["station_type"])),
+            "station_allegiance": self.string(int(station["station_allegiance"])),
+            "star_pos": None if numpy.isnan(star_pos[0]) else star_pos,
+            "dist_from_star_ls": (
+                None if numpy.isnan(dist_from_star_ls) else dist_from_star_ls
+            ),
+            "epoch": _or_none(int(station["epoch"])),
+        }
+
+
+def _or_none(value: int) -> Optional[int]:
+    return None if value == MISSING else value
+
+
+class StateReader:
+    """
+    Read only access to a file a `StateExport` publishes, for use from other
+    processes. Queries are functions of a `StateView`, and are run again if
+    the file was published to while they ran, so they should copy out
+    anything they want to keep rather than return views of it.
+    """
+
+    def __init__(self, path: str, retry_wait: float = 0.001) -> None:
+        self.path = path
+        self.retry_wait = retry_wait
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self._header()
+        if header["magic"] != MAGIC or header["version"] != FORMAT_VERSION:
+            raise ValueError(f"{path} isn't a state export this can read")
+
+    def _header(self) -> numpy.void:
+        return numpy.frombuffer(self._map, dtype=HEADER, count=1)[0].copy()
+
+    def _generation(self) -> int:
+        return GENERATION.unpack_from(self._map, GENERATION_OFFSET)[0]
+
+    def read(self, query: Callable[[StateView], T]) -> T:
+        """Run `query` over a consistent generation of the file"""
+        while True:
+            generation = self._generation()
+            if generation % 2:
+                sleep(self.retry_wait)
+                continue
+            header = self._header()
+            if header["file_size"] > len(self._map):
+                # Grown since it was mapped. Views of the old mapping keep it open
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                continue
+            try:
+                result = query(StateView(self._map, header))
+            except Exception:
+                # Read mid-write, and found nonsense
+                if self._generation() != generation:
+                    continue
+                raise
+            if self._generation() == generation:
+                return result
+
+    def generation(self) -> int:
+        """Changes whenever the file is published to, so callers can tell"""
+        return self._generation()
+
+    def commodity(self, name: str) -> Optional[Dict[str, Any]]:
+        """The best buys and sales of one commodity"""
+
+        def query(view: StateView) -> Optional[Dict[str, Any]]:
+            commodity = view.find_commodity(name)
+            if commodity is None:
+                return None
+            return {
+                "name": view.string(int(commodity["name"])),
+                "best_buys": [view.entry(entry) for entry in view.best_buys(commodity)],
+                "best_sales": [
+                    view.entry(entry) for entry in view.best_sales(commodity)
+                ],
+            }
+
+        return self.read(query)
+
+    def station(self, market_id: int) -> Optional[Dict[str, Any]]:
+        def query(view: StateView) -> Optional[Dict[str, Any]]:
+            station = view.find_station(market_id)
+            return None if station is None else view.station(station)
+
+        return self.read(query)
+
+    def commodity_names(self) -> List[str]:
+        return self.read(StateView.commodity_names)
+
+    def close(self) -> None:
+        self._file.close()
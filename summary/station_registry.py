@@ -0,0 +1,201 @@
+"""
+The dock details shared by stations and the cost snapshots taken at them.
+
+Each distinct set of details is kept once, as a `StationInfo` with interned
+strings, and its star position is a row of one shared numpy array rather
+than a list of its own. Stations and cost snapshots then just point at it.
+An info let go of, such as when a station leaves the SQLite cache, is dropped
+and its row reused once nothing else points at it.
+"""
+
+import math
+import numpy
+import sys
+import threading
+
+from typing import Dict, List, Optional, Tuple
+
+_INITIAL_CAPACITY = 1024
+# Released infos are checked after this many releases, or half as many as held
+_MIN_RELEASES = 64
+
+
+def intern_string(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class StationInfo:
+    """The details of a station at the time it was reported"""
+
+    __slots__ = (
+        "station_id",
+        "system_name",
+        "station_name",
+        "market_id",
+        "station_type",
+        "system_address",
+        "dist_from_star_ls",
+        "station_allegiance",
+    )
+
+    def __init__(
+        self,
+        station_id: int,
+        system_name: str,
+        station_name: str,
+        market_id: Optional[int],
+        station_type: Optional[str],
+        system_address: Optional[int],
+        dist_from_star_ls: Optional[float],
+        station_allegiance: Optional[str],
+    ) -> None:
+        self.station_id = station_id
+        self.system_name = intern_string(system_name)
+        self.station_name = intern_string(station_name)
+        self.market_id = market_id
+        self.station_type = intern_string(station_type)
+        self.system_address = system_address
+        self.dist_from_star_ls = dist_from_star_ls
+        self.station_allegiance = intern_string(station_allegiance)
+
+    @property
+    def star_pos(self) -> Optional[List[float]]:
+        return STATIONS.star_pos(self.station_id)
+
+    def matches(
+        self,
+        market_id: Optional[int],
+        star_pos: Optional[List[float]],
+        station_type: Optional[str],
+        system_address: Optional[int],
+        dist_from_star_ls: Optional[float],
+        station_allegiance: Optional[str],
+    ) -> bool:
+        return (
+            self.market_id == market_id
+            and self.station_type == station_type
+            and self.system_address == system_address
+            and self.dist_from_star_ls == dist_from_star_ls
+            and self.station_allegiance == station_allegiance
+            and self.star_pos == (None if star_pos is None else list(star_pos))
+        )
+
+
+class StationRegistry:
+    """
+    Hands out a shared `StationInfo` for each system and station name, making
+    a new one, with a new station id, whenever the details reported change.
+    Older infos stay valid for anything still pointing at them.
+
+    Infos are kept until released, which the SQLite `StationTable` does as
+    it drops stations from its cache. A released info still pointed at by a
+    cost snapshot is kept too, and checked again with later releases, until
+    only the registry holds it. Then it's dropped and its station id is
+    handed out again.
+    """
+
+    def __init__(self) -> None:
+        self._coords = numpy.full((_INITIAL_CAPACITY, 3), math.nan)
+        self._infos: Dict[Tuple[str, str], StationInfo] = {}
+        self._released: Dict[int, StationInfo] = {}
+        self._releases = 0
+        self._free_ids: List[int] = []
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """How many infos are in use"""
+        return self._count - len(self._free_ids)
+
+    def release(self, info: StationInfo) -> None:
+        """Let go of an info, dropping it once nothing else points at it"""
+        with self._lock:
+            self._released[info.station_id] = info
+            self._releases += 1
+            if self._releases >= max(_MIN_RELEASES, len(self._released) // 2):
+                self._drop_unused()
+
+    def _drop_unused(self) -> None:
+        for station_id in list(self._released):
+            info = self._released[station_id]
+            key = (info.system_name, info.station_name)
+            is_newest = self._infos.get(key) is info
+            # Held by _released, `info` and getrefcount's argument, and by
+            # _infos if the newest, so anything more is a station or snapshot
+            if sys.getrefcount(info) > 3 + is_newest:
+                continue
+            if is_newest:
+                del self._infos[key]
+            del self._released[station_id]
+            self._coords[station_id] = math.nan
+            self._free_ids.append(station_id)
+        self._releases = 0
+
+    def _next_id(self) -> int:
+        try:
+            return self._free_ids.pop()
+        except IndexError:
+            self._count += 1
+            return self._count - 1
+
+    def info(
+        self,
+        system_name: str,
+        station_name: str,
+        market_id: Optional[int] = None,
+        star_pos: Optional[List[float]] = None,
+        station_type: Optional[str] = None,
+        system_address: Optional[int] = None,
+        dist_from_star_ls: Optional[float] = None,
+        station_allegiance: Optional[str] = None,
+    ) -> StationInfo:
+        details = (
+            market_id,
+            star_pos,
+            station_type,
+            system_address,
+            dist_from_star_ls,
+            station_allegiance,
+        )
+        key = (system_name, station_name)
+        info = self._infos.get(key)
+        if info is not None and info.matches(*details):
+            return info
+
+        # Stores load on background threads too, so add new infos one at a time
+        with self._lock:
+            info = self._infos.get(key)
+            if info is not None and info.matches(*details):
+                return info
+            info = StationInfo(
+                station_id=self._next_id(),
+                system_name=system_name,
+                station_name=station_name,
+                market_id=market_id,
+                station_type=station_type,
+                system_address=system_address,
+                dist_from_star_ls=dist_from_star_ls,
+                station_allegiance=station_allegiance,
+            )
+            self._set_star_pos(info.station_id, star_pos)
+            self._infos[(info.system_name, info.station_name)] = info
+            return info
+
+    def _set_star_pos(self, station_id: int, star_pos: Optional[List[float]]) -> None:
+        if station_id == len(self._coords):
+            # Fill the bigger copy before swapping it in, so readers never see a gap
+            coords = numpy.full((2 * len(self._coords), 3), math.nan)
+            coords[:station_id] = self._coords
+            self._coords = coords
+        self._coords[station_id] = math.nan if star_pos is None else star_pos
+
+    def star_pos(self, station_id: int) -> Optional[List[float]]:
+        star_pos = self._coords[station_id].tolist()
+        return None if math.isnan(star_pos[0]) else star_pos
+
+    def coords(self) -> numpy.ndarray:
+        """The star positions of every station id, NaN where not known or free"""
+        return self._coords[: self._count]
+
+
+STATIONS = StationRegistry()
@@ -0,0 +1,68 @@
+from summary import columnar
+from summary.model import Commodity, CostSnapshot, StockSummary
+
+_SNAPSHOT_KINDS = {
+    "system_name": columnar.STRING,
+    "station_name": columnar.STRING,
+    "timestamp": columnar.STRING,
+    "buy_price": columnar.INTEGER,
+    "stock": columnar.INTEGER,
+    "sell_price": columnar.INTEGER,
+    "demand": columnar.INTEGER,
+    "market_id": columnar.INTEGER,
+    "star_pos": columnar.VECTOR,
+    "station_type": columnar.STRING,
+    "system_address": columnar.INTEGER,
+    "dist_from_star_ls": columnar.FLOAT,
+    "station_allegiance": columnar.STRING,
+}
+
+# Which list of its commodity each cost snapshot row belongs in
+_BUY = 0
+_SALE = 1
+
+
+def load(stock_file: str) -> StockSummary:
+    try:
+        columns = columnar.ColumnFile(stock_file)
+    except FileNotFoundError:
+        return StockSummary()
+
+    summary = StockSummary(
+        commodities=[
+            Commodity(name=name, best_buys=[], best_sales=[])
+            for name in columns.strings_of("commodity")
+        ]
+    )
+    owners = columns.array("snapshot.commodity").tolist()
+    sides = columns.array("snapshot.side").tolist()
+    records = columns.records(_SNAPSHOT_KINDS, "snapshot.")
+    for owner, side, record in zip(owners, sides, records):
+        commodity = summary.commodities[owner]
+        entries = commodity.best_buys if side == _BUY else commodity.best_sales
+        entries.append(CostSnapshot(**record))
+    columns.close()
+    return summary
+
+
+def save(stock_file: str, summary: StockSummary):
+    owners, sides, snapshots = [], [], []
+    for index, commodity in enumerate(summary.commodities):
+        for side, entries in (
+            (_BUY, commodity.best_buys),
+            (_SALE, commodity.best_sales),
+        ):
+            owners.extend([index] * len(entries))
+            sides.extend([side] * len(entries))
+            snapshots.extend(entries)
+
+    columns = {
+        "commodity": (
+            columnar.STRING,
+            [commodity.name for commodity in summary.commodities],
+        ),
+        "snapshot.commodity": (columnar.INTEGER, owners),
+        "snapshot.side": (columnar.INTEGER, sides),
+    }
+    columns.update(columnar.record_columns(_SNAPSHOT_KINDS, snapshots, "snapshot."))
+    columnar.save(stock_file, columns)
@@ -0,0 +1,132 @@
+import heapq
+import numpy
+
+from typing import Dict, List, Optional, Set, Tuple
+
+from summary.model import CostSnapshot
+from summary.stock_handler.market_book import (
+    MarketBook,
+    StationKey,
+    rank_score,
+    station_key,
+)
+
+
+class BookTable:
+    """
+    One side of every commodity's market book, numbered by commodity slot.
+
+    Alongside the books it keeps each book's entry limit in an array, and the
+    slots each station is listed in, so that a whole market message can be
+    checked against them at once. Books must only be changed through here.
+
+    With `expiring`, it also keeps a heap of when each entry was reported, so
+    the entries older than some time can be found without looking through
+    every book. Replaced entries are left in the heap, and skipped over when
+    they come to the top.
+    """
+
+    def __init__(
+        self,
+        descending: bool = False,
+        half_life: Optional[float] = None,
+        expiring: bool = False,
+    ) -> None:
+        self.books: List[MarketBook] = []
+        self.limits = numpy.empty(64)
+        self.descending = descending
+        self.half_life = half_life
+        self.expiring = expiring
+        self._listed: Dict[StationKey, Set[int]] = {}
+        self._expiry: List[Tuple[int, int, StationKey]] = []
+        # How many entries there are across all the books
+        self._entries = 0
+
+    def scores(self, prices: numpy.ndarray, epoch: int) -> numpy.ndarray:
+        """The `rank_score` of prices reported at `epoch`, to check against limits"""
+        return rank_score(prices, epoch, -1 if self.descending else 1, self.half_life)
+
+    def add(self, book: MarketBook) -> int:
+        """Add the next commodity's book, returning its slot"""
+        slot = len(self.books)
+        self.books.append(book)
+        if slot == len(self.limits):
+            self.limits = numpy.concatenate([self.limits, numpy.empty(slot)])
+        self.limits[slot] = book.entry_limit()
+        self._entries += len(book)
+        for cost_snapshot in book.entries:
+            self._listed.setdefault(station_key(cost_snapshot), set()).add(slot)
+            self._track(slot, cost_snapshot)
+        return slot
+
+    def listed(self, station: StationKey, slots: numpy.ndarray) -> numpy.ndarray:
+        """Which of `slots` the station has an entry in"""
+        listed = self._listed.get(station)
+        if not listed:
+            return numpy.zeros(len(slots), dtype=bool)
+        return numpy.isin(slots, list(listed))
+
+    def upsert(self, slot: int, cost_snapshot: CostSnapshot) -> bool:
+        book = self.books[slot]
+        # The entry that would be pushed out if this one gets in
+        last = (
+            station_key(book.entries[-1]) if book.is_full() and book.entries else None
+        )
+        entries = len(book)
+        if not book.upsert(cost_snapshot):
+            return False
+        self._entries += len(book) - entries
+
+        station = station_key(cost_snapshot)
+        if station in book:
+            self._listed.setdefault(station, set()).add(slot)
+            self._track(slot, cost_snapshot)
+        else:
+            self._unlist(station, slot)
+        if last is not None and last not in book:
+            self._unlist(last, slot)
+        self.limits[slot] = book.entry_limit()
+        return True
+
+    def remove(self, slot: int, station: StationKey) -> bool:
+        book = self.books[slot]
+        if not book.remove(station):
+            return False
+        self._entries -= 1
+        self._unlist(station, slot)
+        self.limits[slot] = book.entry_limit()
+        return True
+
+    def _track(self, slot: int, cost_snapshot: CostSnapshot) -> None:
+        if not self.expiring:
+            return
+        heapq.heappush(
+            self._expiry, (cost_snapshot.epoch, slot, station_key(cost_snapshot))
+        )
+        # Drop the replaced entries once they outnumber the live ones
+        if len(self._expiry) > 2 * self._entries + 1024:
+            self._expiry = [
+                (entry.epoch, slot, station_key(entry))
+                for slot, book in enumerate(self.books)
+                for entry in book.entries
+            ]
+            heapq.heapify(self._expiry)
+
+    def expire(self, before: int) -> Set[int]:
+        """Remove every entry reported before `before`, returning the slots changed"""
+        changed = set()
+        while self._expiry and self._expiry[0][0] < before:
+            _, slot, station = heapq.heappop(self._expiry)
+            entry = self.books[slot].get(station)
+            # Unless it's since been replaced by a newer report
+            if entry is not None and entry.epoch < before:
+                self.remove(slot, station)
+                changed.add(slot)
+        return changed
+
+    def _unlist(self, station: StationKey, slot: int) -> None:
+        listed = self._listed.get(station)
+        if listed is not None:
+            listed.discard(slot)
+            if not listed:
+                del self._listed[station]
@@ -1,6 +1,8 @@
 import numpy
 
-from typing import Optional
+from operator import attrgetter
+from time import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
 
 from config.model import StockConfig
 from eddn.commodity_v3.model import (
@@ -8,21 +10,93 @@ from eddn.commodity_v3.model import (
     CommodityV3 as EddnCommodityV3,
     Message,
 )
-from summary.dock_handler.journal_v1 import DockHandler
-from summary.model import Commodity as StockCommodity, CostSnapshot, StockSummary
+from summary.dock_handler.journal_v1 import DockHandler, dock_key
+from summary.model import (
+    Commodity as StockCommodity,
+    CostSnapshot,
+    Station,
+    StockSummary,
+    epoch_seconds,
+)
+from summary.price_history import PriceHistory
+from summary.stock_handler.book_table import BookTable
+from summary.stock_handler.market_book import MarketBook, station_key
+from summary.stock_handler.market_store import MarketStore
+from summary.stock_handler.trade_index import TradeIndex
+
+_LINE_COLUMNS = [
+    attrgetter(name) for name in ("buy_price", "stock", "sell_price", "demand")
+]
 
 
 class StockHandler:
     def __init__(
-        self, config: StockConfig, target: StockSummary, dock_handler: DockHandler
+        self,
+        config: StockConfig,
+        target: StockSummary,
+        dock_handler: DockHandler,
+        market_store: Optional[MarketStore] = None,
+        price_history: Optional[PriceHistory] = None,
     ) -> None:
         self.config = config
-        self._origin = numpy.array(self.config.origin_coords)
         self.stock_summary = target
         self.dock_handler = dock_handler
+        # Every price of every market, if kept, not just the best
+        self.market_store = market_store
+        self.price_history = price_history
         self.commodity_index = {}
+        self.commodity_slots: Dict[str, int] = {}
+        self._slot_commodities: List[StockCommodity] = []
+        half_life = None
+        if config.half_life_hours is not None:
+            half_life = config.half_life_hours * 3600
+        expiring = config.max_age_hours is not None
+        self.buy_table = BookTable(
+            descending=False, half_life=half_life, expiring=expiring
+        )
+        self.sell_table = BookTable(
+            descending=True, half_life=half_life, expiring=expiring
+        )
+        self.trade_index = TradeIndex()
+        self._changes: Dict[str, None] = {}
+        # Called with the lower case name of each commodity as its books change
+        self.commodity_listeners: List[Callable[[str], None]] = []
+        # Goes up with every change, so readers can tell when to look again
+        self.version = 0
+        # The newest report time seen, which prices are aged against, and when
+        # the last report arrived, so the ages keep going up while none do
+        self.latest = 0
+        self._received_at = 0.0
+        self._next_sweep = 0
+        # Each market's commodity names, with their slots and summaries
+        self._layouts: Dict[
+            int, Tuple[List[str], Optional[numpy.ndarray], List[StockCommodity]]
+        ] = {}
+        # Each market's dock key, and its dock entry if it passes the checks
+        self._verdicts: Dict[Optional[int], Tuple[str, Optional[Station]]] = {}
+        self._acceptable_types: FrozenSet[str] = frozenset(
+            config.acceptable_station_types
+        )
+        self._verdict_hits = 0
+        self._verdict_misses = 0
+        self.dock_handler.station_listeners.append(self._forget_verdict)
         self._create_commodity_index()
-        self.save_counter = self.config.autosave_wait
+
+    def set_config(self, config: StockConfig) -> None:
+        """
+        Check stations against new settings from here on. The ranking and
+        expiry of the best lists stay as they were set up.
+        """
+        self.config = config
+        self._acceptable_types = frozenset(config.acceptable_station_types)
+        self._verdicts.clear()
+
+    def _forget_verdict(self, key: str, station: Station) -> None:
+        """Called by the dock handler whenever it sets a station"""
+        if station.market_id is None:
+            self._verdicts.clear()
+        else:
+            self._verdicts.pop(station.market_id, None)
 
     def _create_commodity_index(self) -> None:
         """
@@ -30,7 +104,32 @@ class StockHandler:
         is live in this adapter. We drop and re-create on file load.
         """
         for commodity in self.stock_summary.commodities:
-            self.commodity_index[commodity.name.lower()] = commodity
+            self._index_commodity(commodity)
+
+    def _index_commodity(self, commodity: StockCommodity) -> None:
+        name = commodity.name.lower()
+        self.commodity_index[name] = commodity
+        # Both sides are added together, so share a slot
+        self.commodity_slots[name] = self.buy_table.add(
+            MarketBook(
+                entries=commodity.best_buys,
+                price=lambda cost_snapshot: cost_snapshot.buy_price,
+                descending=False,
+                max_size=self.config.max_best,
+                half_life=self.buy_table.half_life,
+            )
+        )
+        self.sell_table.add(
+            MarketBook(
+                entries=commodity.best_sales,
+                price=lambda cost_snapshot: cost_snapshot.sell_price,
+                descending=True,
+                max_size=self.config.max_best,
+                half_life=self.sell_table.half_life,
+            )
+        )
+        self._slot_commodities.append(commodity)
+        self.trade_index.update(commodity)
 
     def _get_stock_commodity(self, name: str) -> Optional[StockCommodity]:
         if name.lower() in self.commodity_index:
@@ -38,113 +137,257 @@ class StockHandler:
         else:
             stock_commodity = StockCommodity(name=name, best_buys=[], best_sales=[])
             self.stock_summary.commodities.append(stock_commodity)
-            self.commodity_index[name.lower()] = stock_commodity
+            self._index_commodity(stock_commodity)
+            self._changed(name.lower())
             return stock_commodity
 
     def update(self, commodity_v3: EddnCommodityV3) -> bool:
-        """Updates the summary and returns true if it's time to save"""
-        for eddn_commodity in commodity_v3.message.commodities:
-            self._update_commodity_summary(eddn_commodity, commodity_v3.message)
+        """Updates the summary and returns true if anything changed"""
+        # All lines share the message timestamp and station, so only check them once
+        message = commodity_v3.message
+        # Bogus timestamps from the future are taken as now, so they can't
+        # expire everything, hold back the sweeps, or stay listed for ever
+        self._received_at = time()
+        epoch = min(epoch_seconds(message.timestamp), self._received_at)
+        journal_dock = self._get_verdict(message)
+        if journal_dock and self.market_store is not None:
+            self.market_store.update(message, journal_dock)
+        if journal_dock and self.price_history is not None:
+            self.price_history.record(message, epoch)
+        self.latest = max(self.latest, epoch)
+        if self.config.max_age_hours is not None:
+            self._sweep(self.latest)
+            # Too old to be listed, so it would only be expired again
+            if epoch < self._cutoff():
+                journal_dock = None
 
-        if self.save_counter <= 0:
-            self.save_counter = self.config.autosave_wait
-            return True
-        else:
-            self.save_counter -= 1
-            return False
+        if journal_dock and self.config.batch_update:
+            slots, commodities = self._get_layout(message)
+            if slots is not None:
+                self._update_batch(message, journal_dock, epoch, slots, commodities)
+                return bool(self._changes)
+
+        for eddn_commodity in message.commodities:
+            self._update_commodity_summary(eddn_commodity, message, journal_dock, epoch)
+        return bool(self._changes)
+
+    def _cutoff(self, now: Optional[float] = None) -> float:
+        """The report time prices have to be from to stay listed"""
+        return (self.latest if now is None else now) - self.config.max_age_hours * 3600
+
+    def _sweep(self, now: float) -> None:
+        """Expire old prices, every `expiry_interval` seconds of reports"""
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.config.expiry_interval
+        self.expire(self._cutoff(now))
+
+    def expire_idle(self) -> None:
+        """
+        Expire old prices while no reports arrive. The newest report time is
+        taken to have moved on by the time since it arrived, up to the clock,
+        so a replay of old reports doesn't expire everything when it pauses.
+        """
+        if self.config.max_age_hours is None or not self._received_at:
+            return
+        now = time()
+        self._sweep(min(now, self.latest + now - self._received_at))
+
+    def expire(self, before: float) -> None:
+        """
+        Drop the prices reported before `before` from the best lists. The next
+        best in each list move up, and new reports fill the room made.
+        """
+        changed = self.buy_table.expire(before) | self.sell_table.expire(before)
+        for slot in sorted(changed):
+            stock_commodity = self._slot_commodities[slot]
+            self.trade_index.update(stock_commodity)
+            self._changed(stock_commodity.name.lower())
+
+    def _get_layout(
+        self, message: Message
+    ) -> Tuple[Optional[numpy.ndarray], List[StockCommodity]]:
+        """
+        The slots and summaries of the message's commodities, in order.
+        Markets mostly list the same commodities each time, so these are
+        remembered for each market until its list changes.
+        """
+        names = [eddn_commodity.name for eddn_commodity in message.commodities]
+        layout = self._layouts.get(message.market_id)
+        if layout is None or layout[0] != names:
+            commodities = [self._get_stock_commodity(name) for name in names]
+            slots = [
+                self.commodity_slots[commodity.name.lower()]
+                for commodity in commodities
+            ]
+            # Checks for a whole batch go stale if a commodity is listed twice
+            if len(set(slots)) != len(slots):
+                layout = (names, None, commodities)
+            else:
+                layout = (names, numpy.array(slots, dtype=int), commodities)
+            self._layouts[message.market_id] = layout
+        return layout[1], layout[2]
+
+    def _update_batch(
+        self,
+        message: Message,
+        journal_dock: Station,
+        epoch: int,
+        slots: numpy.ndarray,
+        commodities: List[StockCommodity],
+    ) -> None:
+        """
+        Has the same effect as updating line by line, but checks the prices and
+        volumes of the whole message at once, so that only lines that can change
+        a book are made into cost snapshots.
+        """
+        lines = message.commodities
+        station = (journal_dock.system_name, journal_dock.station_name)
+
+        buy_price, stock, sell_price, demand = [
+            numpy.fromiter(map(column, lines), dtype=numpy.int64, count=len(lines))
+            for column in _LINE_COLUMNS
+        ]
+        buys_wanted = (buy_price != 0) & (stock >= self.config.min_stock)
+        sales_wanted = (sell_price != 0) & (demand >= self.config.min_demand)
+        # A station already in a book has to be moved or removed, whatever its price
+        buys_to_apply = (
+            buys_wanted
+            & (self.buy_table.scores(buy_price, epoch) < self.buy_table.limits[slots])
+        ) | self.buy_table.listed(station, slots)
+        sales_to_apply = (
+            sales_wanted
+            & (
+                self.sell_table.scores(sell_price, epoch)
+                < self.sell_table.limits[slots]
+            )
+        ) | self.sell_table.listed(station, slots)
+
+        for i in numpy.flatnonzero(buys_to_apply | sales_to_apply).tolist():
+            line = lines[i]
+            stock_commodity = commodities[i]
+            cost_snapshot = CostSnapshot.at_station(
+                station=journal_dock,
+                timestamp=message.timestamp,
+                buy_price=line.buy_price,
+                stock=line.stock,
+                sell_price=line.sell_price,
+                demand=line.demand,
+            )
+            cost_snapshot.set_epoch(epoch)
+
+            buys_changed = buys_to_apply[i] and self._insert_buy(
+                stock_commodity, cost_snapshot
+            )
+            sales_changed = sales_to_apply[i] and self._insert_sell(
+                stock_commodity, cost_snapshot
+            )
+            if buys_changed or sales_changed:
+                self.trade_index.update(stock_commodity)
+                self._changed(stock_commodity.name.lower())
+
+    def _get_verdict(self, message: Message) -> Optional[Station]:
+        """
+        The dock entry of the message's station, if it's one we want prices for.
+        Remembered for each market until the dock handler changes its station.
+        """
+        key = dock_key(message.system_name, message.station_name)
+        verdict = self._verdicts.get(message.market_id)
+        # Fleet carriers keep their market id as they move between systems
+        if verdict is not None and verdict[0] == key:
+            self._verdict_hits += 1
+            return verdict[1]
+
+        self._verdict_misses += 1
+        journal_dock = self._get_acceptable_dock(key)
+        self._verdicts[message.market_id] = (key, journal_dock)
+        return journal_dock
+
+    def get_verdict_stats(self) -> Dict[str, int]:
+        return {
+            "hits": self._verdict_hits,
+            "misses": self._verdict_misses,
+            "cached": len(self._verdicts),
+        }
+
+    def _get_acceptable_dock(self, key: str) -> Optional[Station]:
+        journal_dock = self.dock_handler.journal.stations.get(key, None)
+        if journal_dock is None:
+            return None
+        dist_from_origin = self.dock_handler.spatial_index.distance(
+            key, self.config.origin_coords
+        )
+        if (
+            journal_dock.station_type in self._acceptable_types
+            and dist_from_origin is not None
+            and dist_from_origin <= self.config.max_from_origin
+            and journal_dock.dist_from_star_ls is not None
+            and journal_dock.dist_from_star_ls <= self.config.max_from_sun
+        ):
+            return journal_dock
+        return None
+
+    def _changed(self, name: str) -> None:
+        self._changes[name] = None
+        self.version += 1
+        for listener in self.commodity_listeners:
+            listener(name)
+
+    def pop_changes(self) -> List[str]:
+        """The lower case names of commodities changed since last asked, in order"""
+        changes, self._changes = self._changes, {}
+        return list(changes)
 
     def _update_commodity_summary(
-        self, eddn_commodity: EddnCommodity, message: Message
+        self,
+        eddn_commodity: EddnCommodity,
+        message: Message,
+        journal_dock: Optional[Station],
+        epoch: int,
     ):
         stock_commodity: StockCommodity = self._get_stock_commodity(eddn_commodity.name)
-        system = message.system_name
-        station = message.station_name
-        if journal_dock := self.dock_handler.get_dock_entry(
-            system=system, station=station
-        ):
-            station_type = journal_dock.station_type
-            coords = numpy.array(journal_dock.star_pos)
-            dist_from_origin = numpy.linalg.norm(coords - self._origin)
-            if (
-                station_type in self.config.acceptable_station_types
-                and dist_from_origin <= self.config.max_from_origin
-                and journal_dock.dist_from_star_ls is not None
-                and journal_dock.dist_from_star_ls <= self.config.max_from_sun
-            ):
-                cost_snapshot = CostSnapshot(
-                    system_name=system,
-                    station_name=station,
-                    timestamp=message.timestamp,
-                    buy_price=eddn_commodity.buy_price,
-                    stock=eddn_commodity.stock,
-                    sell_price=eddn_commodity.sell_price,
-                    demand=eddn_commodity.demand,
-                    market_id=journal_dock.market_id,
-                    star_pos=journal_dock.star_pos,
-                    station_type=station_type,
-                    system_address=journal_dock.system_address,
-                    dist_from_star_ls=journal_dock.dist_from_star_ls,
-                    station_allegiance=journal_dock.station_allegiance,
-                )
-
-                self._insert_buy(stock_commodity, cost_snapshot)
-                self._insert_sell(stock_commodity, cost_snapshot)
-
-    def _insert_buy(self, stock_commodity: StockCommodity, cost_snapshot: CostSnapshot):
-        # Remove any existing results
-        for i in range(len(stock_commodity.best_buys) - 1, -1, -1):
-            buy = stock_commodity.best_buys[i]
-            if (
-                buy.system_name == cost_snapshot.system_name
-                and buy.station_name == cost_snapshot.station_name
-            ):
-                stock_commodity.best_buys.pop(i)
-
-        # No buyable price, so not for sale
-        if cost_snapshot.buy_price == 0:
-            return
+        if journal_dock:
+            cost_snapshot = CostSnapshot.at_station(
+                station=journal_dock,
+                timestamp=message.timestamp,
+                buy_price=eddn_commodity.buy_price,
+                stock=eddn_commodity.stock,
+                sell_price=eddn_commodity.sell_price,
+                demand=eddn_commodity.demand,
+            )
+            cost_snapshot.set_epoch(epoch)
 
-        # Check supply, ignore if too low
-        if cost_snapshot.stock < self.config.min_stock:
-            return
+            buys_changed = self._insert_buy(stock_commodity, cost_snapshot)
+            sales_changed = self._insert_sell(stock_commodity, cost_snapshot)
+            if buys_changed or sales_changed:
+                self.trade_index.update(stock_commodity)
+                self._changed(stock_commodity.name.lower())
 
-        # Put lowest prices first
-        i = 0
-        while i < len(stock_commodity.best_buys):
-            if cost_snapshot.buy_price < stock_commodity.best_buys[i].buy_price:
-                break
-            i += 1
-        stock_commodity.best_buys.insert(i, cost_snapshot)
+    def _insert_buy(
+        self, stock_commodity: StockCommodity, cost_snapshot: CostSnapshot
+    ) -> bool:
+        """Returns true if the best buys changed"""
+        slot = self.commodity_slots[stock_commodity.name.lower()]
+
+        # No buyable price, so not for sale; or supply too low
+        if cost_snapshot.buy_price == 0 or cost_snapshot.stock < self.config.min_stock:
+            return self.buy_table.remove(slot, station_key(cost_snapshot))
 
-        # Trim excess results
-        stock_commodity.best_buys = stock_commodity.best_buys[: self.config.max_best]
+        # Lowest prices first
+        return self.buy_table.upsert(slot, cost_snapshot)
 
     def _insert_sell(
         self, stock_commodity: StockCommodity, cost_snapshot: CostSnapshot
-    ):
-        # Remove any existing results
-        for i in range(len(stock_commodity.best_sales) - 1, -1, -1):
-            sale = stock_commodity.best_sales[i]
-            if (
-                sale.system_name == cost_snapshot.system_name
-                and sale.station_name == cost_snapshot.station_name
-            ):
-                stock_commodity.best_sales.pop(i)
-
-        # No sellable price, so not wanted
-        if cost_snapshot.sell_price == 0:
-            return
+    ) -> bool:
+        """Returns true if the best sales changed"""
+        slot = self.commodity_slots[stock_commodity.name.lower()]
 
-        # Check demand, ignore if too low
-        if cost_snapshot.demand < self.config.min_demand:
-            return
+        # No sellable price, so not wanted; or demand too low
+        if (
+            cost_snapshot.sell_price == 0
+            or cost_snapshot.demand < self.config.min_demand
+        ):
+            return self.sell_table.remove(slot, station_key(cost_snapshot))
 
-        # Put highest prices first
-        i = 0
-        while i < len(stock_commodity.best_sales):
-            if cost_snapshot.sell_price > stock_commodity.best_sales[i].sell_price:
-                break
-            i += 1
-        stock_commodity.best_sales.insert(i, cost_snapshot)
-        # Trim excess results
-        stock_commodity.best_sales = stock_commodity.best_sales[: self.config.max_best]
+        # Highest prices first
+        return self.sell_table.upsert(slot, cost_snapshot)
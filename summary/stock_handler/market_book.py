@@ -0,0 +1,146 @@
+import math
+import numpy
+
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+from summary.model import CostSnapshot
+
+StationKey = Tuple[str, str]
+
+
+def station_key(cost_snapshot: CostSnapshot) -> StationKey:
+    return (cost_snapshot.system_name, cost_snapshot.station_name)
+
+
+def rank_score(price, epoch, direction: int, half_life: Optional[float]):
+    """
+    What entries are ranked by, lowest first, for a price or array of prices
+    reported at `epoch`. Without a half life it's just the price. With one,
+    a price counts for half as much each `half_life` seconds it ages, so an
+    old bargain drops below a newer, slightly worse price. As every entry ages
+    at the same rate, their order doesn't depend on when it's worked out, so
+    the score can be the log of the price less a term growing with its age.
+    """
+    if half_life is None:
+        return direction * price
+    return direction * numpy.log(numpy.maximum(price, 1)) - epoch * (
+        math.log(2) / half_life
+    )
+
+
+class MarketBook:
+    """
+    One side of a commodity's market: the best buys or the best sales,
+    at most one per station, ordered best price first.
+
+    `entries` is the live list also held as `Commodity.best_buys` or
+    `Commodity.best_sales`, so output and storage see it as before.
+    A parallel list of sort keys lets entries be found and placed by bisection
+    instead of scanning, and the station index finds the entry to replace.
+    Equal prices keep the order they arrived in. With a `half_life`, prices
+    are ranked by `rank_score`, so older ones are ranked as if worse.
+    """
+
+    def __init__(
+        self,
+        entries: List[CostSnapshot],
+        price: Callable[[CostSnapshot], int],
+        descending: bool,
+        max_size: int,
+        half_life: Optional[float] = None,
+    ) -> None:
+        self.entries = entries
+        self.max_size = max_size
+        self.half_life = half_life
+        self._price = price
+        self._direction = -1 if descending else 1
+        self._keys: List[Tuple[float, int]] = []
+        self._by_station: Dict[StationKey, Tuple[float, int]] = {}
+        self._sequence = 0
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        """Index entries loaded from file, tidying any duplicates or misordering"""
+        ranked = []
+        seen = set()
+        for cost_snapshot in self.entries:
+            key = station_key(cost_snapshot)
+            if key not in seen:
+                seen.add(key)
+                ranked.append((self._next_key(cost_snapshot), cost_snapshot))
+        ranked.sort(key=lambda pair: pair[0])
+        ranked = ranked[: self.max_size]
+
+        self.entries[:] = [cost_snapshot for _, cost_snapshot in ranked]
+        self._keys = [key for key, _ in ranked]
+        self._by_station = {
+            station_key(cost_snapshot): key for key, cost_snapshot in ranked
+        }
+
+    def _next_key(self, cost_snapshot: CostSnapshot) -> Tuple[float, int]:
+        self._sequence += 1
+        score = rank_score(
+            self._price(cost_snapshot),
+            cost_snapshot.epoch if self.half_life is not None else 0,
+            self._direction,
+            self.half_life,
+        )
+        return (score, self._sequence)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, station: StationKey) -> bool:
+        return station in self._by_station
+
+    def get(self, station: StationKey) -> Optional[CostSnapshot]:
+        key = self._by_station.get(station)
+        if key is None:
+            return None
+        return self.entries[bisect_left(self._keys, key)]
+
+    def is_full(self) -> bool:
+        return len(self._keys) >= self.max_size
+
+    def entry_limit(self) -> float:
+        """
+        The `rank_score` a new station's entry has to be below to get in.
+        Infinite if there's room.
+        """
+        if not self.is_full():
+            return math.inf
+        if not self._keys:
+            # A book with no room at all
+            return -math.inf
+        return self._keys[-1][0]
+
+    def remove(self, station: StationKey) -> bool:
+        """Remove the station's entry, returning true if there was one"""
+        key = self._by_station.pop(station, None)
+        if key is None:
+            return False
+        i = bisect_left(self._keys, key)
+        del self._keys[i]
+        del self.entries[i]
+        return True
+
+    def upsert(self, cost_snapshot: CostSnapshot) -> bool:
+        """Replace the station's entry, returning true if the book changed"""
+        removed = self.remove(station_key(cost_snapshot))
+
+        key = self._next_key(cost_snapshot)
+        if self.is_full() and (not self._keys or key > self._keys[-1]):
+            return removed
+
+        # Sequence numbers only increase, so this lands after any equal prices
+        i = bisect_left(self._keys, key)
+        self._keys.insert(i, key)
+        self.entries.insert(i, cost_snapshot)
+        self._by_station[station_key(cost_snapshot)] = key
+
+        # Trim excess results
+        if len(self._keys) > self.max_size:
+            self._keys.pop()
+            del self._by_station[station_key(self.entries.pop())]
+        return True
@@ -0,0 +1,259 @@
+import numpy
+
+from dataclasses import dataclass
+from operator import attrgetter
+from typing import Dict, List, Optional, Tuple
+
+from config.model import MarketStoreConfig, StockConfig
+from eddn.commodity_v3.model import Message
+from summary.model import Station
+
+# The cost of a commodity a market doesn't sell, so that no sale can profit
+# from it, while leaving room to subtract any price without overflowing
+NOT_SOLD = 2**30
+
+_LINE_COLUMNS = [
+    attrgetter(name) for name in ("buy_price", "stock", "sell_price", "demand")
+]
+
+
+def _grown(array: numpy.ndarray, shape: Tuple[int, ...], fill: int) -> numpy.ndarray:
+    """A copy of `array` enlarged to `shape`, with the new cells set to `fill`"""
+    grown = numpy.full(shape, fill, dtype=array.dtype)
+    grown[tuple(slice(0, size) for size in array.shape)] = array
+    return grown
+
+
+@dataclass
+class MarketTrade:
+    commodity: str
+    buy_price: int
+    sell_price: int
+    units: int
+
+    @property
+    def unit_profit(self) -> int:
+        return self.sell_price - self.buy_price
+
+
+class MarketStore:
+    """
+    The latest prices of every commodity at every market, unlike the stock
+    summary that only keeps the best few of each commodity. Each market has a
+    number, `rows[market_id]`, that is its column in the price arrays (so each
+    commodity's prices everywhere are together) and its row in the matrix.
+
+    With `config.profit_matrix` it also keeps the best profit per unit of
+    carrying anything from each market to each other market, and each
+    market's best destination. A market reporting only changes its own row
+    and column of the matrix, both worked out over just the commodities it
+    sells or buys. The matrix takes 4 bytes for every pair of markets.
+    """
+
+    def __init__(self, config: MarketStoreConfig, stock_config: StockConfig) -> None:
+        self.config = config
+        self.min_stock = stock_config.min_stock
+        self.min_demand = stock_config.min_demand
+        # Goes up with every market reported, so readers can tell when to look again
+        self.version = 0
+
+        self.commodity_ids: Dict[str, int] = {}
+        self.commodity_names: List[str] = []
+        self.rows: Dict[int, int] = {}
+        self.stations: List[Station] = []
+        self.market_ids: List[int] = []
+
+        commodities, markets = 64, config.initial_markets
+        # The price to buy from each market, or NOT_SOLD, and the units in stock
+        self.cost = numpy.full((commodities, markets), NOT_SOLD, dtype=numpy.int32)
+        self.stock = numpy.zeros((commodities, markets), dtype=numpy.int32)
+        # The price each market pays, or 0 if it isn't buying, and its demand
+        self.sale = numpy.zeros((commodities, markets), dtype=numpy.int32)
+        self.demand = numpy.zeros((commodities, markets), dtype=numpy.int32)
+
+        self.profit = None
+        if config.profit_matrix:
+            self.profit = numpy.zeros((markets, markets), dtype=numpy.int32)
+            self.best = numpy.zeros(markets, dtype=numpy.int32)
+            self.best_to = numpy.zeros(markets, dtype=numpy.int32)
+
+    def __len__(self) -> int:
+        return len(self.market_ids)
+
+    def nbytes(self) -> int:
+        arrays = [self.cost, self.stock, self.sale, self.demand]
+        if self.profit is not None:
+            arrays += [self.profit, self.best, self.best_to]
+        return sum(array.nbytes for array in arrays)
+
+    def _commodity_id(self, name: str) -> int:
+        key = name.lower()
+        commodity_id = self.commodity_ids.get(key)
+        if commodity_id is None:
+            commodity_id = len(self.commodity_names)
+            self.commodity_ids[key] = commodity_id
+            self.commodity_names.append(name)
+            if commodity_id == self.cost.shape[0]:
+                shape = (commodity_id * 2, self.cost.shape[1])
+                self.cost = _grown(self.cost, shape, NOT_SOLD)
+                self.stock = _grown(self.stock, shape, 0)
+                self.sale = _grown(self.sale, shape, 0)
+                self.demand = _grown(self.demand, shape, 0)
+        return commodity_id
+
+    def _row(self, market_id: int, station: Station) -> int:
+        row = self.rows.get(market_id)
+        if row is not None:
+            self.stations[row] = station
+            return row
+
+        row = len(self.market_ids)
+        self.rows[market_id] = row
+        self.market_ids.append(market_id)
+        self.stations.append(station)
+        if row == self.cost.shape[1]:
+            # Grown gently, as the profit matrix is copied whole each time
+            markets = row + max(row // 4, 256)
+            shape = (self.cost.shape[0], markets)
+            self.cost = _grown(self.cost, shape, NOT_SOLD)
+            self.stock = _grown(self.stock, shape, 0)
+            self.sale = _grown(self.sale, shape, 0)
+            self.demand = _grown(self.demand, shape, 0)
+            if self.profit is not None:
+                self.profit = _grown(self.profit, (markets, markets), 0)
+                self.best = _grown(self.best, (markets,), 0)
+                self.best_to = _grown(self.best_to, (markets,), 0)
+        return row
+
+    def update(self, message: Message, station: Station) -> None:
+        """Replace the prices of the market, from a message of its whole market"""
+        if message.market_id is None:
+            return
+        row = self._row(message.market_id, station)
+        lines = message.commodities
+        ids = numpy.fromiter(
+            (self._commodity_id(line.name) for line in lines),
+            dtype=int,
+            count=len(lines),
+        )
+        buy_price, stock, sell_price, demand = [
+            numpy.fromiter(map(column, lines), dtype=numpy.int64, count=len(lines))
+            for column in _LINE_COLUMNS
+        ]
+
+        self.cost[:, row] = NOT_SOLD
+        self.stock[:, row] = 0
+        self.sale[:, row] = 0
+        self.demand[:, row] = 0
+        buyable = (buy_price != 0) & (stock >= self.min_stock)
+        sellable = (sell_price != 0) & (demand >= self.min_demand)
+        self.cost[ids[buyable], row] = buy_price[buyable]
+        self.stock[ids[buyable], row] = stock[buyable]
+        self.sale[ids[sellable], row] = sell_price[sellable]
+        self.demand[ids[sellable], row] = demand[sellable]
+
+        if self.profit is not None:
+            self._update_profits(row)
+        self.version += 1
+
+    def _profits_from(self, row: int) -> numpy.ndarray:
+        """The best profit per unit carrying anything from `row` to each market"""
+        markets = len(self.market_ids)
+        sold = numpy.flatnonzero(self.cost[:, row] != NOT_SOLD)
+        if not len(sold):
+            return numpy.zeros(markets, dtype=numpy.int32)
+        costs = self.cost[sold, row, numpy.newaxis]
+        profits = (self.sale[sold, :markets] - costs).max(axis=0)
+        numpy.maximum(profits, 0, out=profits)
+        profits[row] = 0
+        return profits
+
+    def _profits_to(self, row: int) -> numpy.ndarray:
+        """The best profit per unit carrying anything from each market to `row`"""
+        markets = len(self.market_ids)
+        bought = numpy.flatnonzero(self.sale[:, row] != 0)
+        if not len(bought):
+            return numpy.zeros(markets, dtype=numpy.int32)
+        sales = self.sale[bought, row, numpy.newaxis]
+        profits = (sales - self.cost[bought, :markets]).max(axis=0)
+        numpy.maximum(profits, 0, out=profits)
+        profits[row] = 0
+        return profits
+
+    def _update_profits(self, row: int) -> None:
+        markets = len(self.market_ids)
+        profit = self.profit
+
+        row_profits = self._profits_from(row)
+        profit[row, :markets] = row_profits
+        self.best_to[row] = row_profits.argmax()
+        self.best[row] = row_profits[self.best_to[row]]
+
+        column = self._profits_to(row)
+        profit[:markets, row] = column
+        best = self.best[:markets]
+        best_to = self.best_to[:markets]
+        # Markets the new column beats the best of
+        beaten = column > best
+        best[beaten] = column[beaten]
+        best_to[beaten] = row
+        # Markets whose best was this one, that may now be bettered elsewhere
+        fallen = numpy.flatnonzero((best_to == row) & (column < best))
+        if len(fallen):
+            rows = profit[fallen, :markets]
+            best_to[fallen] = rows.argmax(axis=1)
+            best[fallen] = rows[numpy.arange(len(fallen)), best_to[fallen]]
+
+    def best_trade(self, from_id: int, to_id: int) -> Optional[MarketTrade]:
+        """The most profitable commodity to carry from one market to another"""
+        from_row, to_row = self.rows.get(from_id), self.rows.get(to_id)
+        if from_row is None or to_row is None or from_row == to_row:
+            return None
+        profits = self.sale[:, to_row].astype(numpy.int64) - self.cost[:, from_row]
+        commodity_id = int(profits.argmax())
+        if profits[commodity_id] <= 0:
+            return None
+        return MarketTrade(
+            commodity=self.commodity_names[commodity_id],
+            buy_price=int(self.cost[commodity_id, from_row]),
+            sell_price=int(self.sale[commodity_id, to_row]),
+            units=int(
+                min(
+                    self.stock[commodity_id, from_row],
+                    self.demand[commodity_id, to_row],
+                )
+            ),
+        )
+
+    def best_from(self, from_id: int, count: int) -> List[Tuple[int, int]]:
+        """The (profit per unit, market id) of the `count` best places to sell to"""
+        row = self.rows.get(from_id)
+        if row is None:
+            return []
+        markets = len(self.market_ids)
+        if self.profit is not None:
+            profits = self.profit[row, :markets]
+        else:
+            profits = self._profits_from(row)
+        return self._top(profits, count, lambda to_row: self.market_ids[to_row])
+
+    def top_pairs(self, count: int) -> List[Tuple[int, Tuple[int, int]]]:
+        """The (profit per unit, (from, to) market ids) of the best trades"""
+        if self.profit is None:
+            raise ValueError("The profit matrix isn't kept")
+        markets = len(self.market_ids)
+        return self._top(
+            self.best[:markets],
+            count,
+            lambda row: (self.market_ids[row], self.market_ids[self.best_to[row]]),
+        )
+
+    def _top(self, profits: numpy.ndarray, count: int, label) -> list:
+        count = min(count, len(profits))
+        if count <= 0:
+            return []
+        rows = numpy.argpartition(-profits, count - 1)[:count]
+        rows = rows[numpy.argsort(-profits[rows], kind="stable")]
+        return [
+            (int(profits[row]), label(int(row))) for row in rows if profits[row] > 0
+        ]
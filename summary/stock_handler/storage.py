@@ -1,8 +1,14 @@
 import json
+import os
 
-from summary.model import StockSummary
+from typing import Iterable, List
+
+from summary.model import Commodity, CostSnapshot, StockSummary
 from summary.schema import StockSummarySchema
 
+# Log records are written often, so skip the schema for these simple records
+_SNAPSHOT_FIELDS = CostSnapshot.FIELDS
+
 
 def load(stock_file: str) -> StockSummary:
     try:
@@ -14,6 +20,56 @@ def load(stock_file: str) -> StockSummary:
 
 
 def save(stock_file: str, summary: StockSummary):
-    with open(stock_file, "w") as json_file:
+    # Write beside the file then swap it in, so a crash can't leave it truncated
+    temp_file = f"{stock_file}.tmp"
+    with open(temp_file, "w") as json_file:
         data = StockSummarySchema().dump(summary)
         json.dump(obj=data, fp=json_file, indent=4)
+    os.replace(temp_file, stock_file)
+
+
+def copy(summary: StockSummary) -> StockSummary:
+    """
+    A copy that can be saved while the original carries on changing.
+    Cost snapshots are replaced rather than changed, so they needn't be copied.
+    """
+    return StockSummary(
+        commodities=[
+            Commodity(
+                name=commodity.name,
+                best_buys=list(commodity.best_buys),
+                best_sales=list(commodity.best_sales),
+            )
+            for commodity in summary.commodities
+        ]
+    )
+
+
+def dump_changes(summary: StockSummary, names: Iterable[str]) -> List[dict]:
+    """Log records for the given commodities, by lower case name"""
+    by_name = {commodity.name.lower(): commodity for commodity in summary.commodities}
+    return [
+        {
+            "c": by_name[name].name,
+            "b": [_dump_snapshot(buy) for buy in by_name[name].best_buys],
+            "s": [_dump_snapshot(sale) for sale in by_name[name].best_sales],
+        }
+        for name in names
+    ]
+
+
+def apply_changes(summary: StockSummary, changes: List[dict]) -> None:
+    """Replay log records from `dump_changes`"""
+    by_name = {commodity.name.lower(): commodity for commodity in summary.commodities}
+    for change in changes:
+        name = change["c"]
+        if name.lower() not in by_name:
+            by_name[name.lower()] = Commodity(name=name, best_buys=[], best_sales=[])
+            summary.commodities.append(by_name[name.lower()])
+        commodity = by_name[name.lower()]
+        commodity.best_buys = [CostSnapshot(**buy) for buy in change["b"]]
+        commodity.best_sales = [CostSnapshot(**sale) for sale in change["s"]]
+
+
+def _dump_snapshot(cost_snapshot: CostSnapshot) -> dict:
+    return {name: getattr(cost_snapshot, name) for name in _SNAPSHOT_FIELDS}
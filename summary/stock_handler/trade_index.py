@@ -0,0 +1,47 @@
+from bisect import bisect_left, insort
+from typing import Dict, List, Tuple
+
+from summary.model import Commodity as StockCommodity
+
+
+class TradeIndex:
+    """
+    Commodities ranked by the profit from their best buy to their best sale.
+
+    Only commodities touched by a message are re-ranked, so the top trades
+    can be read off at any time without walking the whole stock summary.
+    Equal profits are ranked in the order the commodities were first seen.
+    """
+
+    def __init__(self) -> None:
+        self._ranked: List[Tuple[int, int, str]] = []
+        self._keys: Dict[str, Tuple[int, int, str]] = {}
+        self._commodities: Dict[str, StockCommodity] = {}
+        self._positions: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ranked)
+
+    def update(self, commodity: StockCommodity) -> None:
+        """Re-rank the commodity after a change to its best buys or sales"""
+        name = commodity.name.lower()
+        position = self._positions.setdefault(name, len(self._positions))
+        self._commodities[name] = commodity
+
+        if old_key := self._keys.pop(name, None):
+            del self._ranked[bisect_left(self._ranked, old_key)]
+
+        if commodity.best_buys and commodity.best_sales:
+            profit = (
+                commodity.best_sales[0].sell_price - commodity.best_buys[0].buy_price
+            )
+            key = (-profit, position, name)
+            insort(self._ranked, key)
+            self._keys[name] = key
+
+    def top(self, count: int) -> List[Tuple[int, StockCommodity]]:
+        """The `count` most profitable commodities, with their profit per unit"""
+        return [
+            (-profit, self._commodities[name])
+            for profit, _, name in self._ranked[:count]
+        ]
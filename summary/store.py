@@ -0,0 +1,185 @@
+from typing import Dict, Iterable
+
+from config.model import Config
+from eddn.commodity_v3.model import Message
+from summary.dock_handler import (
+    binary_storage as journal_binary_storage,
+    storage as journal_storage,
+)
+from summary.model import DockSummary, StockSummary
+from summary.snapshot_writer import SnapshotWriter
+from summary.stock_handler import (
+    binary_storage as commodity_binary_storage,
+    storage as commodity_storage,
+)
+from summary.write_ahead_log import WriteAheadLog
+
+JSON_STORE = "json"
+LOG_STORE = "log"
+SQLITE_STORE = "sqlite"
+
+JSON_FORMAT = "json"
+BINARY_FORMAT = "binary"
+
+
+class JsonStore:
+    """
+    Keeps docks and stocks as whole snapshot files, either JSON or, with
+    `storage.snapshot_format` set to binary, columnar files that load far
+    faster and can be read lazily.
+
+    Saving takes a cheap copy of the state and leaves the serializing and
+    writing to a background thread, skipping the save if nothing has changed.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.dock_file = config.dock.file_path
+        self.stock_file = config.stock.file_path
+        self.writer = SnapshotWriter()
+        if config.storage and config.storage.snapshot_format == BINARY_FORMAT:
+            lazy = config.storage.lazy_load
+            self.load_dock_file = lambda path: journal_binary_storage.load(
+                path, lazy=lazy
+            )
+            # Reads every station and closes the file, for compacting a log
+            self.read_dock_file = journal_binary_storage.load
+            self.save_dock_file = journal_binary_storage.save
+            self.load_stock_file = commodity_binary_storage.load
+            self.save_stock_file = commodity_binary_storage.save
+        else:
+            self.load_dock_file = journal_storage.load
+            self.read_dock_file = journal_storage.load
+            self.save_dock_file = journal_storage.save
+            self.load_stock_file = commodity_storage.load
+            self.save_stock_file = commodity_storage.save
+        self._docks_dirty = False
+        self._stocks_dirty = False
+
+    def load_docks(self) -> DockSummary:
+        return self.load_dock_file(self.dock_file)
+
+    def load_stocks(self) -> StockSummary:
+        return self.load_stock_file(self.stock_file)
+
+    def market_received(self, message: Message) -> bool:
+        """
+        Called with each market message, for stores that keep every price.
+        Returns true if that left something to save.
+        """
+        return False
+
+    def docks_changed(self, summary: DockSummary, keys: Iterable[str]) -> None:
+        """Called after each message with the stations it changed"""
+        self._docks_dirty = True
+
+    def stocks_changed(self, summary: StockSummary, names: Iterable[str]) -> None:
+        """Called after each message with the commodities it changed"""
+        self._stocks_dirty = True
+
+    def save_docks(self, summary: DockSummary) -> None:
+        if not self._docks_dirty:
+            self.writer.skip(self.dock_file)
+            return
+        self._docks_dirty = False
+        self.writer.submit(
+            path=self.dock_file,
+            save=self.save_dock_file,
+            snapshot=journal_storage.copy(summary),
+        )
+
+    def save_stocks(self, summary: StockSummary) -> None:
+        if not self._stocks_dirty:
+            self.writer.skip(self.stock_file)
+            return
+        self._stocks_dirty = False
+        self.writer.submit(
+            path=self.stock_file,
+            save=self.save_stock_file,
+            snapshot=commodity_storage.copy(summary),
+        )
+
+    def close(self) -> None:
+        """Wait for any saves still being written"""
+        self.writer.close()
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        return self.writer.get_stats()
+
+
+class LogStore(JsonStore):
+    """
+    Appends the changes made since the last save to a log beside each snapshot
+    file. The snapshots are brought up to date in the background as the logs
+    are compacted.
+    """
+
+    def __init__(self, config: Config) -> None:
+        super().__init__(config)
+        self.dock_log = WriteAheadLog(
+            log_file=f"{self.dock_file}.log",
+            snapshot_file=self.dock_file,
+            load_snapshot=self.load_dock_file,
+            save_snapshot=self.save_dock_file,
+            apply_changes=journal_storage.apply_changes,
+            compact_bytes=config.storage.compact_bytes,
+            read_snapshot=self.read_dock_file,
+        )
+        self.stock_log = WriteAheadLog(
+            log_file=f"{self.stock_file}.log",
+            snapshot_file=self.stock_file,
+            load_snapshot=self.load_stock_file,
+            save_snapshot=self.save_stock_file,
+            apply_changes=commodity_storage.apply_changes,
+            compact_bytes=config.storage.compact_bytes,
+        )
+        self._dock_changes: Dict[str, None] = {}
+        self._stock_changes: Dict[str, None] = {}
+
+    def load_docks(self) -> DockSummary:
+        return self.dock_log.load()
+
+    def load_stocks(self) -> StockSummary:
+        return self.stock_log.load()
+
+    def docks_changed(self, summary: DockSummary, keys: Iterable[str]) -> None:
+        self._dock_changes.update(dict.fromkeys(keys))
+
+    def stocks_changed(self, summary: StockSummary, names: Iterable[str]) -> None:
+        self._stock_changes.update(dict.fromkeys(names))
+
+    def save_docks(self, summary: DockSummary) -> None:
+        if not self._dock_changes:
+            self.dock_log.skip()
+            return
+        changes, self._dock_changes = self._dock_changes, {}
+        self.dock_log.append(journal_storage.dump_changes(summary, changes))
+        self.dock_log.flush()
+
+    def save_stocks(self, summary: StockSummary) -> None:
+        if not self._stock_changes:
+            self.stock_log.skip()
+            return
+        changes, self._stock_changes = self._stock_changes, {}
+        self.stock_log.append(commodity_storage.dump_changes(summary, changes))
+        self.stock_log.flush()
+
+    def close(self) -> None:
+        self.dock_log.close()
+        self.stock_log.close()
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            log.log_file: log.get_stats() for log in (self.dock_log, self.stock_log)
+        }
+
+
+def create_store(config: Config) -> JsonStore:
+    if config.storage and config.storage.mode == LOG_STORE:
+        return LogStore(config)
+    if config.storage and config.storage.mode == SQLITE_STORE:
+        # Imported here to avoid a circular import, the sqlite store being
+        # a duck-typed stand in for the others
+        from summary.sqlite_store import SqliteStore
+
+        return SqliteStore(config)
+    return JsonStore(config)
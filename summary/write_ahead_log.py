@@ -0,0 +1,176 @@
+import json
+import os
+import sys
+import threading
+import traceback
+
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+class WriteAheadLog:
+    """
+    An append-only log of changes on top of a snapshot file.
+
+    Each change is one compact JSON line, so the cost of recording state is
+    proportional to what changed rather than to everything held. Once the log
+    grows past `compact_bytes` it is set aside and a background thread folds it
+    into a new snapshot. `save_snapshot` must replace the snapshot atomically,
+    so a crash can't leave a half written one behind. The snapshot is read
+    with `read_snapshot`, if given, to compact, as everything in it is saved
+    again anyway.
+
+    Changes must be idempotent (set, not add) since a log may be replayed
+    over a snapshot that already includes it if a compaction was interrupted.
+    Appends, saves skipped with nothing to append, and compactions are
+    counted for `get_stats`.
+    """
+
+    def __init__(
+        self,
+        log_file: str,
+        snapshot_file: str,
+        load_snapshot: Callable[[str], Any],
+        save_snapshot: Callable[[str, Any], None],
+        apply_changes: Callable[[Any, List[dict]], None],
+        compact_bytes: int,
+        read_snapshot: Optional[Callable[[str], Any]] = None,
+    ) -> None:
+        self.log_file = log_file
+        self.snapshot_file = snapshot_file
+        self.compacting_file = f"{log_file}.compacting"
+        self._load_snapshot = load_snapshot
+        self._read_snapshot = read_snapshot or load_snapshot
+        self._save_snapshot = save_snapshot
+        self._apply_changes = apply_changes
+        self.compact_bytes = compact_bytes
+
+        self._log = None
+        self._compactor: Optional[threading.Thread] = None
+
+        self._stats_lock = threading.Lock()
+        self.appends = 0
+        self.skipped = 0
+        self.changes = 0
+        self.appended_bytes = 0
+        self.compactions = 0
+        self.failed_compactions = 0
+        self.total_compaction_seconds = 0.0
+        self.last_compaction_seconds = 0.0
+
+    def load(self) -> Any:
+        """Load the snapshot and replay any logged changes over it"""
+        summary = self._load_snapshot(self.snapshot_file)
+        for path in (self.compacting_file, self.log_file):
+            self._apply_changes(summary, list(_read_changes(path)))
+        # Finish off a compaction that was interrupted last time
+        if os.path.exists(self.compacting_file):
+            self._start_compaction()
+        return summary
+
+    def append(self, changes: List[dict]) -> None:
+        if self._log is None:
+            self._log = open(self.log_file, "a")
+            # Don't let new changes run on from a line a crash left unfinished
+            if self._log.tell() and not _ends_with_newline(self.log_file):
+                self._log.write("\n")
+        started = self._log.tell()
+        for change in changes:
+            self._log.write(json.dumps(change, separators=(",", ":")))
+            self._log.write("\n")
+        with self._stats_lock:
+            self.appends += 1
+            self.changes += len(changes)
+            self.appended_bytes += self._log.tell() - started
+
+    def skip(self) -> None:
+        """Count a save that appended nothing as nothing had changed"""
+        with self._stats_lock:
+            self.skipped += 1
+
+    def flush(self) -> None:
+        """Push appended changes to disk, compacting if the log has grown too big"""
+        if self._log is None:
+            return
+        self._log.flush()
+        if self._log.tell() < self.compact_bytes or self.is_compacting():
+            return
+        if os.path.exists(self.compacting_file):
+            # A previous compaction failed, retry it before setting more aside
+            self._start_compaction()
+        else:
+            self._log.close()
+            self._log = None
+            os.replace(self.log_file, self.compacting_file)
+            self._start_compaction()
+
+    def is_compacting(self) -> bool:
+        return self._compactor is not None and self._compactor.is_alive()
+
+    def close(self) -> None:
+        """Flush and wait for any compaction in progress"""
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if self._compactor is not None:
+            self._compactor.join()
+
+    def _start_compaction(self) -> None:
+        self._compactor = threading.Thread(
+            target=self._compact, name=f"compact-{self.log_file}", daemon=True
+        )
+        self._compactor.start()
+
+    def _compact(self) -> None:
+        started = perf_counter()
+        try:
+            summary = self._read_snapshot(self.snapshot_file)
+            self._apply_changes(summary, list(_read_changes(self.compacting_file)))
+            self._save_snapshot(self.snapshot_file, summary)
+            os.remove(self.compacting_file)
+        except Exception:
+            # The set aside log is kept, and replayed or retried on next start
+            print(f"Failed to compact {self.log_file}:\n{traceback.format_exc()}")
+            sys.stdout.flush()
+            with self._stats_lock:
+                self.failed_compactions += 1
+            return
+        seconds = perf_counter() - started
+        with self._stats_lock:
+            self.compactions += 1
+            self.total_compaction_seconds += seconds
+            self.last_compaction_seconds = seconds
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            return {
+                "appends": self.appends,
+                "skipped": self.skipped,
+                "changes": self.changes,
+                "appended_bytes": self.appended_bytes,
+                "compactions": self.compactions,
+                "failed_compactions": self.failed_compactions,
+                "mean_compaction_ms": round(
+                    1000 * self.total_compaction_seconds / (self.compactions or 1), 3
+                ),
+                "last_compaction_ms": round(1000 * self.last_compaction_seconds, 3),
+            }
+
+
+def _read_changes(path: str) -> Iterator[dict]:
+    try:
+        with open(path) as log_file:
+            for line in log_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Partly written by a crash, skip it
+                    continue
+    except FileNotFoundError:
+        return
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as log_file:
+        log_file.seek(-1, os.SEEK_END)
+        return log_file.read(1) == b"\n"
@@ -0,0 +1,382 @@
+"""
+The fast decoders must build exactly what the marshmallow schemas build, or
+raise so the schemas are used instead.
+"""
+
+import copy
+import pytest
+import simplejson
+import zlib
+
+from datetime import datetime, timezone
+from marshmallow.exceptions import ValidationError
+from typing import Any, Callable, Optional
+
+from eddn.commodity_v3 import decoder as commodity_v3_decoder
+from eddn.commodity_v3.schema import CommodityV3Schema
+from eddn.decoder import COMMODITY_V3_SCHEMA, JOURNAL_V1_SCHEMA, MessageDecoder
+from eddn.journal_v1 import decoder as journal_v1_decoder
+from eddn.journal_v1.schema import JournalV1Schema
+
+COMMODITY_V3 = {
+    "$schemaRef": COMMODITY_V3_SCHEMA,
+    "header": {
+        "uploaderID": "uploader",
+        "softwareName": "E:D Market Connector",
+        "softwareVersion": "5.0.0",
+        "gatewayTimestamp": "2023-01-01T12:00:01.123456Z",
+    },
+    "message": {
+        "systemName": "Sol",
+        "stationName": "Abraham Lincoln",
+        "marketId": 128016640,
+        "timestamp": "2023-01-01T12:00:00Z",
+        "commodities": [
+            {
+                "name": "gold",
+                "meanPrice": 47609,
+                "buyPrice": 46000,
+                "stock": 1200,
+                "stockBracket": 2,
+                "sellPrice": 45500,
+                "demand": 0,
+                "demandBracket": "",
+                "statusFlags": ["Rare"],
+            },
+            {
+                "name": "tea",
+                "meanPrice": 1500,
+                "buyPrice": 0,
+                "stock": 0,
+                "stockBracket": 0,
+                "sellPrice": 1700,
+                "demand": 5000,
+                "demandBracket": 3,
+            },
+        ],
+        "economies": [
+            {"name": "Service", "proportion": 0.7},
+            {"name": "Industrial", "proportion": 1},
+        ],
+        "prohibited": ["Slaves"],
+        "horizons": True,
+        "odyssey": False,
+    },
+}
+
+JOURNAL_V1 = {
+    "$schemaRef": JOURNAL_V1_SCHEMA,
+    "header": {
+        "uploaderID": "uploader",
+        "softwareName": "EDDiscovery",
+        "softwareVersion": "17.0.0",
+        "gatewayTimestamp": "2023-01-01T12:00:01.5Z",
+    },
+    "message": {
+        "event": "Docked",
+        "StarPos": [0.0, 0, -1.5],
+        "StarSystem": "Sol",
+        "SystemAddress": 10477373803,
+        "timestamp": "2023-01-01T12:00:00Z",
+        "DistFromStarLS": 506.7,
+        "MarketID": 128016640,
+        "StationAllegiance": "Federation",
+        "StationName": "Abraham Lincoln",
+        "StationType": "Orbis",
+    },
+}
+
+
+def changed(message: dict, *edits: Callable[[dict], Any]) -> dict:
+    """A copy of a message with each edit applied to it"""
+    message = copy.deepcopy(message)
+    for edit in edits:
+        edit(message)
+    return message
+
+
+def setter(section: str, key: str, value: Any) -> Callable[[dict], None]:
+    def edit(message: dict) -> None:
+        message[section][key] = value
+
+    return edit
+
+
+def remover(section: str, key: str) -> Callable[[dict], None]:
+    def edit(message: dict) -> None:
+        del message[section][key]
+
+    return edit
+
+
+def commodity_setter(key: str, value: Any) -> Callable[[dict], None]:
+    def edit(message: dict) -> None:
+        message["message"]["commodities"][0][key] = value
+
+    return edit
+
+
+def fast_or_none(decode: Callable[[dict], Any], message: dict) -> Optional[Any]:
+    try:
+        return decode(message)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def model_or_error(decoder: MessageDecoder, message: dict) -> Any:
+    try:
+        return decoder.validate_json(message).model
+    except (ValidationError, TypeError) as error:
+        return type(error)
+
+
+# Each case is the message and whether the fast decoder should take it as-is
+COMMODITY_V3_CASES = {
+    "as sent": (COMMODITY_V3, True),
+    "extra fields": (
+        changed(
+            COMMODITY_V3,
+            setter("message", "carrierDockingAccess", "all"),
+            setter("header", "extra", 1),
+            commodity_setter("legality", ""),
+        ),
+        True,
+    ),
+    "optional fields missing": (
+        changed(
+            COMMODITY_V3,
+            remover("message", "economies"),
+            remover("message", "prohibited"),
+            remover("message", "horizons"),
+            remover("message", "odyssey"),
+        ),
+        True,
+    ),
+    "optional fields null": (
+        changed(
+            COMMODITY_V3,
+            setter("message", "economies", None),
+            setter("header", "gatewayTimestamp", None),
+            commodity_setter("statusFlags", None),
+        ),
+        True,
+    ),
+    "integer as string": (
+        changed(COMMODITY_V3, setter("message", "marketId", "1")),
+        False,
+    ),
+    "integer as float": (changed(COMMODITY_V3, commodity_setter("stock", 12.0)), False),
+    "boolean as integer": (
+        changed(COMMODITY_V3, setter("message", "odyssey", 1)),
+        False,
+    ),
+    "boolean as string": (
+        changed(COMMODITY_V3, setter("message", "horizons", "true")),
+        False,
+    ),
+    "proportion as string": (
+        changed(
+            COMMODITY_V3,
+            lambda message: message["message"]["economies"][0].update(
+                proportion="0.25"
+            ),
+        ),
+        False,
+    ),
+    "bracket as float": (
+        changed(COMMODITY_V3, commodity_setter("stockBracket", 1.0)),
+        False,
+    ),
+    "required field missing": (
+        changed(COMMODITY_V3, remover("message", "marketId")),
+        False,
+    ),
+    "header field missing": (
+        changed(COMMODITY_V3, remover("header", "uploaderID")),
+        False,
+    ),
+    "gateway timestamp missing": (
+        changed(COMMODITY_V3, remover("header", "gatewayTimestamp")),
+        False,
+    ),
+    "required field null": (
+        changed(COMMODITY_V3, commodity_setter("buyPrice", None)),
+        False,
+    ),
+    "string as integer": (
+        changed(COMMODITY_V3, setter("message", "stationName", 7)),
+        False,
+    ),
+}
+
+JOURNAL_V1_CASES = {
+    "as sent": (JOURNAL_V1, True),
+    "extra fields": (
+        changed(
+            JOURNAL_V1,
+            setter("message", "StationFaction", {"Name": "Mother Gaia"}),
+            setter("header", "extra", 1),
+        ),
+        True,
+    ),
+    "optional fields missing": (
+        changed(
+            JOURNAL_V1,
+            remover("message", "DistFromStarLS"),
+            remover("message", "MarketID"),
+            remover("message", "StationAllegiance"),
+            remover("message", "StationName"),
+            remover("message", "StationType"),
+        ),
+        True,
+    ),
+    "optional fields null": (
+        changed(
+            JOURNAL_V1,
+            setter("message", "MarketID", None),
+            setter("header", "gatewayTimestamp", None),
+        ),
+        True,
+    ),
+    "timestamp without seconds": (
+        changed(JOURNAL_V1, setter("message", "timestamp", "2023-01-01T12:00")),
+        True,
+    ),
+    "timestamp with space and offset": (
+        changed(
+            JOURNAL_V1, setter("message", "timestamp", "2023-01-01 12:00:00+01:30")
+        ),
+        True,
+    ),
+    "timestamp without zone": (
+        changed(JOURNAL_V1, setter("message", "timestamp", "2023-01-01T12:00:00.25")),
+        True,
+    ),
+    "timestamp date alone": (
+        changed(JOURNAL_V1, setter("message", "timestamp", "2023-01-01")),
+        False,
+    ),
+    "timestamp basic format": (
+        changed(JOURNAL_V1, setter("message", "timestamp", "20230101T120000Z")),
+        False,
+    ),
+    "timestamp comma fraction": (
+        changed(JOURNAL_V1, setter("message", "timestamp", "2023-01-01T12:00:00,5Z")),
+        False,
+    ),
+    "timestamp long fraction": (
+        changed(
+            JOURNAL_V1,
+            setter("message", "timestamp", "2023-01-01T12:00:00.1234567Z"),
+        ),
+        False,
+    ),
+    "timestamp hour alone": (
+        changed(JOURNAL_V1, setter("message", "timestamp", "2023-01-01T12")),
+        False,
+    ),
+    "timestamp compact offset": (
+        changed(JOURNAL_V1, setter("message", "timestamp", "2023-01-01T12:00:00+0130")),
+        False,
+    ),
+    "timestamp out of range": (
+        changed(JOURNAL_V1, setter("message", "timestamp", "2023-01-01T25:00:00Z")),
+        False,
+    ),
+    "gateway timestamp date alone": (
+        changed(JOURNAL_V1, setter("header", "gatewayTimestamp", "2023-01-01")),
+        False,
+    ),
+    "integer as string": (
+        changed(JOURNAL_V1, setter("message", "SystemAddress", "10477373803")),
+        False,
+    ),
+    "number as string": (
+        changed(JOURNAL_V1, setter("message", "DistFromStarLS", "506.7")),
+        False,
+    ),
+    "star position not a list": (
+        changed(JOURNAL_V1, setter("message", "StarPos", {"x": 0})),
+        False,
+    ),
+    "star position not finite": (
+        changed(JOURNAL_V1, setter("message", "StarPos", [0.0, float("nan"), 0.0])),
+        False,
+    ),
+    "star position missing": (
+        changed(JOURNAL_V1, remover("message", "StarPos")),
+        False,
+    ),
+    "required field missing": (changed(JOURNAL_V1, remover("message", "event")), False),
+    "header field missing": (
+        changed(JOURNAL_V1, remover("header", "softwareName")),
+        False,
+    ),
+}
+
+
+@pytest.mark.parametrize(
+    "message, fast", COMMODITY_V3_CASES.values(), ids=COMMODITY_V3_CASES.keys()
+)
+def test_commodity_v3_decoder_matches_schema(message: dict, fast: bool) -> None:
+    decoded = fast_or_none(commodity_v3_decoder.decode, message)
+    assert (decoded is not None) == fast
+    if decoded is not None:
+        assert decoded == CommodityV3Schema().load(message)
+
+
+@pytest.mark.parametrize(
+    "message, fast", JOURNAL_V1_CASES.values(), ids=JOURNAL_V1_CASES.keys()
+)
+def test_journal_v1_decoder_matches_schema(message: dict, fast: bool) -> None:
+    decoded = fast_or_none(journal_v1_decoder.decode, message)
+    assert (decoded is not None) == fast
+    if decoded is not None:
+        assert decoded == JournalV1Schema().load(message)
+
+
+@pytest.mark.parametrize(
+    "message",
+    [message for message, _ in COMMODITY_V3_CASES.values()]
+    + [message for message, _ in JOURNAL_V1_CASES.values()],
+    ids=[f"commodity/3 {case}" for case in COMMODITY_V3_CASES]
+    + [f"journal/1 {case}" for case in JOURNAL_V1_CASES],
+)
+def test_fast_message_decoder_falls_back_to_schema(message: dict) -> None:
+    expected = model_or_error(MessageDecoder(fast=False), message)
+    assert model_or_error(MessageDecoder(fast=True), message) == expected
+
+
+# JSON that orjson, if installed, reads differently from simplejson or not at all
+RAW_JOURNAL_V1_CASES = {
+    "wide integer": simplejson.dumps(JOURNAL_V1).replace(
+        "10477373803", "123456789012345678901234567890"
+    ),
+    "number too big for a float": simplejson.dumps(JOURNAL_V1).replace(
+        "506.7", "1e400"
+    ),
+    "NaN": simplejson.dumps(JOURNAL_V1).replace("506.7", "NaN"),
+}
+
+
+def decoded_or_error(decoder: MessageDecoder, raw: str) -> Any:
+    try:
+        return decoder.decode(zlib.compress(raw.encode())).model
+    except (ValidationError, ValueError) as error:
+        return type(error)
+
+
+@pytest.mark.parametrize(
+    "raw", RAW_JOURNAL_V1_CASES.values(), ids=RAW_JOURNAL_V1_CASES.keys()
+)
+def test_fast_message_decoder_parses_as_schema_path_does(raw: str) -> None:
+    expected = decoded_or_error(MessageDecoder(fast=False), raw)
+    assert decoded_or_error(MessageDecoder(fast=True), raw) == expected
+
+
+def test_journal_v1_timestamps_are_aware() -> None:
+    decoded = journal_v1_decoder.decode(JOURNAL_V1)
+    assert decoded.message.timestamp == datetime(2023, 1, 1, 12, tzinfo=timezone.utc)
+    assert decoded.header.gateway_timestamp == datetime(
+        2023, 1, 1, 12, 0, 1, 500000, tzinfo=timezone.utc
+    )